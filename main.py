@@ -5,13 +5,17 @@ ZLO Android 镜像工具 - 主入口
 支持 GUI 与 CLI 模式
 """
 import argparse
+import os
+import stat
 import sys
 from pathlib import Path
 
 from zlo_tool import __version__
+from zlo_tool.cache import ResultCache
 from zlo_tool.env import default_environment
+from zlo_tool.fileindex import SEARCH_DEFAULT_LIMIT, search_projects
 from zlo_tool.gui import run_gui
-from zlo_tool.ops import OperationError, OperationRunner
+from zlo_tool.ops import ErofsOptions, OperationError, OperationRunner
 from zlo_tool.projects import InvalidProjectName, ProjectExistsError, ProjectManager
 
 
@@ -21,6 +25,12 @@ def main() -> int:
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
     parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
+    parser.add_argument(
+        "--cache-dir",
+        default=os.environ.get("ZLO_CACHE_DIR"),
+        help="分解结果缓存目录（也可用环境变量 ZLO_CACHE_DIR，默认不启用缓存）",
+    )
+    parser.add_argument("--cache-size", type=float, default=20, help="缓存容量上限（GB，默认 20），超出按 LRU 淘汰")
 
     subparsers = parser.add_subparsers(dest="command", help="子命令")
 
@@ -37,36 +47,106 @@ def main() -> int:
     # IMG 操作
     parser_unpack_img = subparsers.add_parser("unpack-img", help="分解 IMG 镜像")
     parser_unpack_img.add_argument("project", help="项目名称")
+    parser_unpack_img.add_argument("-j", "--jobs", type=int, default=1, help="并行分解的分区数（默认 1，串行）")
+    parser_unpack_img.add_argument("--index", action="store_true", help="分解后更新项目的文件索引（供 search 使用）")
 
     parser_pack_img = subparsers.add_parser("pack-img", help="打包 IMG 镜像")
     parser_pack_img.add_argument("project", help="项目名称")
     parser_pack_img.add_argument("--sparse", action="store_true", help="输出稀疏镜像")
+    parser_pack_img.add_argument("-j", "--jobs", type=int, default=1, help="并行打包的分区数（默认 1，串行）")
+    parser_pack_img.add_argument("--headroom", type=float, default=10, help="在最小镜像大小之上追加的余量（百分比，默认 10）")
+    parser_pack_img.add_argument("--minimal", action="store_true", help="shrink-to-fit：把 ext4 镜像收缩到内容所需的最小值")
+    parser_pack_img.add_argument(
+        "--profile", choices=["default", "readonly"], default="default",
+        help="构建配置：readonly 为只读分区去掉日志与保留块，并共享重复文件的数据块",
+    )
+    parser_pack_img.add_argument(
+        "--fs", choices=["auto", "ext4", "erofs"], default="auto",
+        help="输出文件系统：auto 沿用各分区分解时的文件系统（默认）",
+    )
+    parser_pack_img.add_argument(
+        "--erofs-compress", choices=["lz4", "lz4hc", "lzma"], default="lz4hc", help="EROFS 压缩算法（默认 lz4hc）"
+    )
+    parser_pack_img.add_argument("--erofs-level", type=int, default=None, help="EROFS 压缩级别（默认取算法默认值）")
+    parser_pack_img.add_argument("--erofs-cluster", type=int, default=0, help="EROFS 物理簇大小（KB，默认由 mkfs.erofs 决定）")
+    parser_pack_img.add_argument("--erofs-workers", type=int, default=0, help="EROFS 压缩线程数（默认由 mkfs.erofs 决定）")
+    parser_pack_img.add_argument("--force", action="store_true", help="忽略清单，重新打包所有分区")
+    parser_pack_img.add_argument("--hash", action="store_true", help="清单中记录文件内容哈希（mtime 不可靠时使用）")
+    parser_pack_img.add_argument("--watch", action="store_true", help="监视模式：目录变化后只重新打包变化的分区")
+    parser_pack_img.add_argument("--interval", type=float, default=2.0, help="监视模式的轮询间隔（秒，默认 2）")
+
+    # 镜像浏览（不解包）
+    parser_ls = subparsers.add_parser("ls", help="列出镜像内的目录（无需分解）")
+    parser_ls.add_argument("project", help="项目名称")
+    parser_ls.add_argument("image", help="镜像文件（相对项目目录，可省略 .img），支持稀疏镜像")
+    parser_ls.add_argument("path", nargs="?", default="/", help="镜像内路径（默认 /）")
+    parser_ls.add_argument("-R", "--recursive", action="store_true", help="递归列出子目录")
+
+    parser_cat = subparsers.add_parser("cat", help="把镜像内单个文件输出到标准输出（无需分解）")
+    parser_cat.add_argument("project", help="项目名称")
+    parser_cat.add_argument("image", help="镜像文件（相对项目目录，可省略 .img），支持稀疏镜像")
+    parser_cat.add_argument("path", help="镜像内文件路径")
+
+    parser_extract = subparsers.add_parser("extract", help="只提取镜像内指定的文件或目录（无需分解）")
+    parser_extract.add_argument("project", help="项目名称")
+    parser_extract.add_argument("image", help="镜像文件（相对项目目录，可省略 .img），支持稀疏镜像")
+    parser_extract.add_argument("paths", nargs="+", help="镜像内路径，可指定多个")
+    parser_extract.add_argument("-o", "--output", default=None, help="输出目录（默认 zlo_out/<分区名>/，保留镜像内路径）")
+
+    # 文件索引
+    parser_index = subparsers.add_parser("index", help="为项目中的镜像建立文件索引（无需分解）")
+    parser_index.add_argument("project", help="项目名称")
+    parser_index.add_argument("--force", action="store_true", help="忽略已有索引，全部重建")
+
+    parser_search = subparsers.add_parser("search", help="在所有项目的文件索引中搜索")
+    parser_search.add_argument("pattern", nargs="?", default="", help="路径子串；含 * ? [ 时按通配符匹配完整路径")
+    parser_search.add_argument("--project", action="append", default=None, help="只搜索指定项目，可重复")
+    parser_search.add_argument("--sha256", default=None, help="按内容哈希（或其前缀）查找相同文件")
+    parser_search.add_argument("--limit", type=int, default=SEARCH_DEFAULT_LIMIT, help=f"最多显示的结果数（默认 {SEARCH_DEFAULT_LIMIT}）")
 
     # SUPER 操作
     parser_unpack_super = subparsers.add_parser("unpack-super", help="分解 SUPER 镜像")
     parser_unpack_super.add_argument("project", help="项目名称")
+    parser_unpack_super.add_argument("--only", default=None, help="只提取指定分区，逗号分隔，如 vendor,odm")
+    parser_unpack_super.add_argument("-j", "--jobs", type=int, default=None, help="并行提取的分区数（默认 CPU 核数）")
 
     parser_pack_super = subparsers.add_parser("pack-super", help="打包 SUPER 镜像")
     parser_pack_super.add_argument("project", help="项目名称")
+    parser_pack_super.add_argument("--sparse", action="store_true", help="输出稀疏 super 镜像")
+    parser_pack_super.add_argument("--device-size", type=int, default=None, help="设备大小（字节，默认取布局所需的最小值）")
+    parser_pack_super.add_argument("--ab", action="store_true", help="A/B 布局：按 _a/_b 分组并为 _b 槽预留空间")
+    parser_pack_super.add_argument("--shrink", action="store_true", help="布局前把 RAW ext4 镜像的副本收缩到最小（zlo_pack 中的镜像不变）")
+    parser_pack_super.add_argument("--alignment", type=int, default=1024, help="分区对齐（KB，默认 1024）")
+    parser_pack_super.add_argument("--plan", action="store_true", help="只输出布局规划，不生成镜像")
 
     # DAT 操作
     parser_unpack_dat = subparsers.add_parser("unpack-dat", help="分解 DAT 文件")
     parser_unpack_dat.add_argument("project", help="项目名称")
+    parser_unpack_dat.add_argument("--sparse", action="store_true", help="直接输出稀疏镜像")
+
+    parser_unpack_datbr = subparsers.add_parser("unpack-datbr", help="直接分解 .new.dat.br 为 IMG")
+    parser_unpack_datbr.add_argument("project", help="项目名称")
 
     parser_pack_dat = subparsers.add_parser("pack-dat", help="打包 DAT 文件")
     parser_pack_dat.add_argument("project", help="项目名称")
+    parser_pack_dat.add_argument(
+        "--transfer-version", type=int, default=4, choices=[1, 2, 3, 4], help="transfer.list 版本（默认 4）"
+    )
 
     # BR 操作
     parser_unpack_br = subparsers.add_parser("unpack-br", help="解压 Brotli 文件")
     parser_unpack_br.add_argument("project", help="项目名称")
+    parser_unpack_br.add_argument("-j", "--jobs", type=int, default=None, help="并行解压的文件数（默认 CPU 核数）")
 
     parser_pack_br = subparsers.add_parser("pack-br", help="压缩为 Brotli")
     parser_pack_br.add_argument("project", help="项目名称")
     parser_pack_br.add_argument("--quality", type=int, default=5, help="压缩等级 (0-11)")
+    parser_pack_br.add_argument("-j", "--jobs", type=int, default=None, help="并行压缩的文件数（默认 CPU 核数）")
 
     # BIN 操作
     parser_unpack_bin = subparsers.add_parser("unpack-bin", help="分解 payload.bin")
     parser_unpack_bin.add_argument("project", help="项目名称")
+    parser_unpack_bin.add_argument("-j", "--jobs", type=int, default=None, help="并行解码的进程数（默认 CPU 核数）")
 
     args = parser.parse_args()
 
@@ -102,36 +182,110 @@ def main() -> int:
             print(f"✅ 项目已删除：{args.name}")
             return 0
 
+        elif args.command == "search":
+            if not args.pattern and not args.sha256:
+                print("❌ 请指定搜索路径或 --sha256", file=sys.stderr)
+                return 1
+            names = args.project or project_manager.list_projects()
+            hits = search_projects(
+                {name: project_manager.root_dir / name for name in names}, args.pattern, args.sha256, args.limit
+            )
+            for hit in hits:
+                target = f" -> {hit.link}" if hit.link else ""
+                digest = hit.sha256[:16] if hit.sha256 else "-"
+                print(
+                    f"{hit.project}/{hit.image}:{hit.path}{target}  "
+                    f"{stat.filemode(hit.mode)} {hit.uid}:{hit.gid} {hit.size} {digest} {hit.selinux or ''}".rstrip()
+                )
+            suffix = "（已达上限，可用 --limit 调整）" if len(hits) >= args.limit else ""
+            print(f"共 {len(hits)} 条结果{suffix}", file=sys.stderr)
+            return 0
+
         # 操作类命令
         project_dir = env.root_dir / args.project
         if not project_dir.exists():
             print(f"❌ 项目不存在：{args.project}", file=sys.stderr)
             return 1
 
+        cache = ResultCache(Path(args.cache_dir), int(args.cache_size * 1024**3)) if args.cache_dir else None
+        # ls / cat 的结果写到标准输出，日志改走标准错误
+        log_stream = sys.stderr if args.command in ("ls", "cat") else sys.stdout
         runner = OperationRunner(
             env=env,
-            logger=lambda msg: print(msg),
-            progress=lambda fraction, message: print(f"[{fraction * 100:.1f}%] {message}"),
+            logger=lambda msg: print(msg, file=log_stream),
+            progress=lambda fraction, message: print(f"[{fraction * 100:.1f}%] {message}", file=log_stream),
+            cache=cache,
         )
 
         if args.command == "unpack-img":
-            runner.unpack_img(project_dir)
+            runner.unpack_img(project_dir, jobs=args.jobs, index=args.index)
+        elif args.command == "index":
+            runner.index_img(project_dir, force=args.force)
         elif args.command == "pack-img":
-            runner.pack_img(project_dir, sparse=args.sparse)
+            erofs = ErofsOptions(args.erofs_compress, args.erofs_level, args.erofs_cluster * 1024, args.erofs_workers)
+            if args.watch:
+                runner.watch_img(
+                    project_dir,
+                    sparse=args.sparse,
+                    jobs=args.jobs,
+                    interval=args.interval,
+                    hash_files=args.hash,
+                    headroom=args.headroom / 100,
+                    minimal=args.minimal,
+                    profile=args.profile,
+                    fs=args.fs,
+                    erofs=erofs,
+                )
+            else:
+                runner.pack_img(
+                    project_dir,
+                    sparse=args.sparse,
+                    jobs=args.jobs,
+                    force=args.force,
+                    hash_files=args.hash,
+                    headroom=args.headroom / 100,
+                    minimal=args.minimal,
+                    profile=args.profile,
+                    fs=args.fs,
+                    erofs=erofs,
+                )
+        elif args.command == "ls":
+            for line in runner.list_img(project_dir, args.image, args.path, recursive=args.recursive):
+                print(line)
+            return 0
+        elif args.command == "cat":
+            runner.cat_img(project_dir, args.image, args.path, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+            return 0
+        elif args.command == "extract":
+            output = Path(args.output) if args.output else None
+            for dest in runner.extract_from_img(project_dir, args.image, args.paths, output):
+                print(f"已提取：{dest}")
         elif args.command == "unpack-super":
-            runner.unpack_super(project_dir)
+            only = [name.strip() for name in args.only.split(",") if name.strip()] if args.only else None
+            runner.unpack_super(project_dir, only=only, jobs=args.jobs)
         elif args.command == "pack-super":
-            runner.pack_super(project_dir)
+            runner.pack_super(
+                project_dir,
+                sparse=args.sparse,
+                device_size=args.device_size,
+                ab=args.ab,
+                shrink=args.shrink,
+                alignment=args.alignment * 1024,
+                plan_only=args.plan,
+            )
         elif args.command == "unpack-dat":
-            runner.unpack_dat(project_dir)
+            runner.unpack_dat(project_dir, sparse=args.sparse)
+        elif args.command == "unpack-datbr":
+            runner.unpack_datbr(project_dir)
         elif args.command == "pack-dat":
-            runner.pack_dat(project_dir)
+            runner.pack_dat(project_dir, version=args.transfer_version)
         elif args.command == "unpack-br":
-            runner.unpack_br(project_dir)
+            runner.unpack_br(project_dir, jobs=args.jobs)
         elif args.command == "pack-br":
-            runner.pack_br(project_dir, quality=args.quality)
+            runner.pack_br(project_dir, quality=args.quality, jobs=args.jobs)
         elif args.command == "unpack-bin":
-            runner.unpack_bin(project_dir)
+            runner.unpack_bin(project_dir, jobs=args.jobs)
         else:
             parser.print_help()
             return 1
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.blockio
+镜像文件的按偏移访问：只读映射、稀疏格式常量与保留空洞的读写
+"""
+from __future__ import annotations
+
+import errno
+import mmap
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+# Android 稀疏镜像（libsparse）格式
+SPARSE_MAGIC = 0xED26FF3A
+SPARSE_HEADER = struct.Struct("<IHHHHIIII")
+SPARSE_CHUNK_HEADER = struct.Struct("<HHII")
+
+CHUNK_TYPE_RAW = 0xCAC1
+CHUNK_TYPE_FILL = 0xCAC2
+CHUNK_TYPE_DONT_CARE = 0xCAC3
+CHUNK_TYPE_CRC32 = 0xCAC4
+
+# 用户态复制的单次读写长度
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+FICLONE = 0x40049409
+
+# 全零检测与空洞的粒度，与文件系统块大小一致
+HOLE_BLOCK_SIZE = 4096
+_ZERO_BLOCK = bytes(HOLE_BLOCK_SIZE)
+
+
+def zero_chunks(length: int, chunk_size: int) -> Iterator[bytes]:
+    """产出共 length 字节的全零块，每块不超过 chunk_size；用于把空洞写入不可 seek 的输出"""
+    while length > 0:
+        step = min(chunk_size, length)
+        yield bytes(step)
+        length -= step
+
+
+class MappedFile:
+    """
+    以 mmap 只读映射的 RAW 镜像，接口与 SparseImage 的 read_at 一致，
+    文件系统解析器可以不区分 RAW / 稀疏镜像；view() 返回零拷贝切片，供大块写出使用。
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._fh = self.path.open("rb")
+        try:
+            self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._fh.close()
+            raise
+        self._view = memoryview(self._mm)
+        self.size = len(self._mm)
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        return self._mm[offset:offset + size]
+
+    def view(self, offset: int, size: int) -> memoryview:
+        return self._view[offset:offset + size]
+
+    def close(self) -> None:
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+            self._mm.close()
+            self._fh.close()
+
+
+def data_regions(fd: int, offset: int, length: int) -> Iterator[Tuple[int, int]]:
+    """
+    用 SEEK_DATA / SEEK_HOLE 列出 [offset, offset+length) 中的数据区域 (起点, 长度)，空洞不返回。
+    平台或文件系统不支持时整段视为数据，由调用方按全零块扫描。
+    """
+    end = offset + length
+    if not hasattr(os, "SEEK_DATA"):
+        if length > 0:
+            yield offset, length
+        return
+    # lseek 会移动共享的文件位置，结束后恢复，避免影响文件对象的缓冲读写
+    saved = os.lseek(fd, 0, os.SEEK_CUR)
+    try:
+        pos = offset
+        while pos < end:
+            try:
+                start = os.lseek(fd, pos, os.SEEK_DATA)
+            except OSError as exc:
+                if exc.errno != errno.ENXIO:
+                    yield pos, end - pos
+                # ENXIO：pos 之后只剩空洞
+                return
+            if start >= end:
+                return
+            try:
+                stop = min(os.lseek(fd, start, os.SEEK_HOLE), end)
+            except OSError:
+                stop = end
+            yield start, stop - start
+            pos = stop
+    finally:
+        os.lseek(fd, saved, os.SEEK_SET)
+
+
+def nonzero_runs(data: bytes, block_size: int = HOLE_BLOCK_SIZE) -> Iterator[Tuple[int, int]]:
+    """按块扫描 data，返回非全零块组成的连续区间 (偏移, 长度)"""
+    view = memoryview(data)
+    zero = _ZERO_BLOCK if block_size == HOLE_BLOCK_SIZE else bytes(block_size)
+    start = -1
+    for pos in range(0, len(view), block_size):
+        block = view[pos:pos + block_size]
+        if block == zero[:len(block)]:
+            if start >= 0:
+                yield start, pos - start
+                start = -1
+        elif start < 0:
+            start = pos
+    if start >= 0:
+        yield start, len(view) - start
+
+
+def pwrite_all(fh: BinaryIO, data: bytes, offset: int) -> None:
+    """定位写入；无 os.pwrite 的平台（Windows）退化为 seek+write"""
+    if hasattr(os, "pwrite"):
+        fd = fh.fileno()
+        view = memoryview(data)
+        while view:
+            count = os.pwrite(fd, view, offset)
+            view = view[count:]
+            offset += count
+    else:
+        fh.seek(offset)
+        fh.write(data)
+
+
+def write_nonzero(fh: BinaryIO, data: bytes, offset: int) -> int:
+    """
+    只写出 data 中的非全零块，全零块跳过，留在输出中成为空洞；返回实际写入的字节数。
+    目标区域必须尚未写入过（新建或截断得到的文件），否则跳过的位置会保留旧数据。
+    """
+    view = memoryview(data)
+    written = 0
+    for start, length in nonzero_runs(view):
+        pwrite_all(fh, view[start:start + length], offset + start)
+        written += length
+    return written
+
+
+def disk_usage(path: Path) -> int:
+    """文件实际占用的磁盘空间（st_blocks）；不提供 st_blocks 的平台返回表观大小"""
+    st = Path(path).stat()
+    blocks = getattr(st, "st_blocks", None)
+    return blocks * 512 if blocks is not None else st.st_size
+
+
+def pread(fh: BinaryIO, size: int, offset: int, lock: Optional[threading.Lock] = None) -> bytes:
+    """按偏移读取；无 os.pread 的平台（Windows）退化为加锁 seek+read"""
+    if hasattr(os, "pread"):
+        return os.pread(fh.fileno(), size, offset)
+    if lock is None:
+        fh.seek(offset)
+        return fh.read(size)
+    with lock:
+        fh.seek(offset)
+        return fh.read(size)
+
+
+def copy_range(
+    src: BinaryIO,
+    src_offset: int,
+    dst: BinaryIO,
+    dst_offset: int,
+    length: int,
+    lock: Optional[threading.Lock] = None,
+    holes: bool = False,
+) -> None:
+    """
+    把 src[src_offset:src_offset+length] 写到 dst 的 dst_offset，优先走内核 copy_file_range。
+
+    holes=True 时跳过源文件的空洞（SEEK_DATA/SEEK_HOLE）与数据中的全零块，输出对应位置保持为空洞；
+    仅用于写入新建文件中尚未写过的区域。源数据不足时抛出 EOFError。
+    """
+    if holes:
+        if src_offset + length > os.fstat(src.fileno()).st_size:
+            raise EOFError("源文件数据不足，无法完成复制")
+        for start, size in data_regions(src.fileno(), src_offset, length):
+            pos, stop = start, start + size
+            while pos < stop:
+                chunk = pread(src, min(stop - pos, COPY_BUFFER_SIZE), pos, lock)
+                if not chunk:
+                    raise EOFError("源文件数据不足，无法完成复制")
+                write_nonzero(dst, chunk, dst_offset + (pos - src_offset))
+                pos += len(chunk)
+        return
+
+    if hasattr(os, "copy_file_range"):
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        try:
+            while length > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, length, src_offset, dst_offset)
+                if copied == 0:
+                    raise EOFError("源文件数据不足，无法完成复制")
+                src_offset += copied
+                dst_offset += copied
+                length -= copied
+            return
+        except OSError:
+            # 跨文件系统 / 不支持的内核，退回用户态复制
+            pass
+
+    dst.seek(dst_offset)
+    while length > 0:
+        chunk = pread(src, min(length, COPY_BUFFER_SIZE), src_offset, lock)
+        if not chunk:
+            raise EOFError("源文件数据不足，无法完成复制")
+        dst.write(chunk)
+        src_offset += len(chunk)
+        length -= len(chunk)
+
+
+def clone_file(src: Path, dst: Path) -> str:
+    """
+    为 src 生成一份私有副本，返回实际使用的方式。
+
+    先尝试 reflink（FICLONE，btrfs/xfs 等写时复制），否则按数据区域复制：
+    源文件的空洞与全零块不写入，副本保留为稀疏文件。
+    """
+    with src.open("rb") as fin, dst.open("wb") as fout:
+        try:
+            import fcntl
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+            return "reflink"
+        except (ImportError, OSError):
+            pass
+        size = os.fstat(fin.fileno()).st_size
+        copy_range(fin, 0, fout, 0, size, holes=True)
+        fout.truncate(size)
+    return "稀疏复制"
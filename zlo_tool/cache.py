@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.cache
+分解结果的内容寻址缓存
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from . import __version__
+
+DEFAULT_CACHE_SIZE = 20 * 1024 * 1024 * 1024
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+FICLONE = 0x40049409
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+    restored_bytes: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"命中 {self.hits}，未命中 {self.misses}，写入 {self.stores}，淘汰 {self.evictions}，"
+            f"复用 {self.restored_bytes // (1024*1024)} MB"
+        )
+
+
+def _copy_owner(src: Path, dst: Path) -> None:
+    """以 root 运行时连同属主一起复制（copystat 不复制 uid/gid）"""
+    if hasattr(os, "geteuid") and os.geteuid() == 0:
+        st = src.stat()
+        os.chown(dst, st.st_uid, st.st_gid)
+
+
+def _link_or_copy(src: Path, dst: Path, hardlink: bool = True) -> str:
+    """
+    依次尝试 reflink、硬链接，最后退回完整复制；返回实际使用的方式。
+    hardlink=False 时不使用硬链接：两端共用 inode，对一端 chmod/chown/setfattr 会同时改动另一端。
+    """
+    try:
+        import fcntl
+        with src.open("rb") as fin, dst.open("wb") as fout:
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+        shutil.copystat(src, dst)
+        _copy_owner(src, dst)
+        return "reflink"
+    except (ImportError, OSError):
+        dst.unlink(missing_ok=True)
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    _copy_owner(src, dst)
+    return "copy"
+
+
+def _hardlink_allowed(rel: str, tree: bool) -> bool:
+    """
+    只有按路径保存的镜像产物（super 拆分、dat/br/payload 转换出的 *.img）可以硬链接：
+    它们只会被整体替换；解包出的目录树是用户修改权限与属性的地方，必须与缓存各自独立。
+    """
+    return not tree and rel.lower().endswith(".img")
+
+
+class ResultCache:
+    """
+    以输入内容哈希 + 操作名 + 操作版本 + 工具版本为键，保存分解产物。
+
+    目录结构：``entries/<key[:2]>/<key>/{meta.json, data/}``，
+    ``meta.json`` 的 mtime 即最近使用时间，据此做 LRU 淘汰。
+    写入与恢复优先 reflink；镜像产物可退回硬链接，解包出的目录树退回完整复制。
+    命中时按记录的 size 与 mtime 校验条目，经硬链接被原地修改过的条目视为失效。
+    """
+
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_CACHE_SIZE) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._hash_memo_path = self.root / "hashes.json"
+        self._hash_memo: Optional[Dict[str, str]] = None
+
+    # ------------------------------------------------------------------ #
+    # 键
+    # ------------------------------------------------------------------ #
+    def key(self, inputs: Sequence[Path], operation: str, version: int, params: str = "") -> str:
+        digest = hashlib.sha256(f"{__version__}\0{operation}\0{version}\0{params}".encode("utf-8"))
+        for path in inputs:
+            digest.update(self.file_hash(path).encode("ascii"))
+        return digest.hexdigest()
+
+    def file_hash(self, path: Path) -> str:
+        """文件内容的 sha256；按 (设备, inode, 大小, mtime) 记忆，未变化的输入不再重复读取"""
+        st = path.stat()
+        memo_key = f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+        with self._lock:
+            memo = self._load_hash_memo()
+            if memo_key in memo:
+                return memo[memo_key]
+
+        digest = hashlib.sha256()
+        with path.open("rb") as fh:
+            while True:
+                chunk = fh.read(HASH_BUFFER_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        value = digest.hexdigest()
+
+        with self._lock:
+            memo = self._load_hash_memo()
+            memo[memo_key] = value
+            self._write_json(self._hash_memo_path, memo)
+        return value
+
+    def inventory_path(self, directory: Path) -> Path:
+        """目录输入清单的识别结果缓存文件，按目录的绝对路径区分"""
+        digest = hashlib.sha256(os.fsencode(Path(directory).resolve())).hexdigest()
+        return self.root / "inventory" / f"{digest[:32]}.json"
+
+    # ------------------------------------------------------------------ #
+    # 查询与恢复
+    # ------------------------------------------------------------------ #
+    def restore(self, key: str, dest: Path, clear: bool = False) -> Optional[List[str]]:
+        """
+        命中时把条目恢复到 dest 下（同名文件被替换），返回恢复的相对路径列表；
+        未命中返回 None。clear=True 时命中后先清空 dest，使其与缓存内容完全一致。
+        """
+        entry = self._entry_dir(key)
+        meta = self._read_meta(entry)
+        with self._lock:
+            if meta is None or not self._validate(entry, meta):
+                self.stats.misses += 1
+                if meta is not None:
+                    shutil.rmtree(entry, ignore_errors=True)
+                return None
+
+        data = entry / "data"
+        if clear and dest.exists():
+            shutil.rmtree(dest)
+        dest.mkdir(parents=True, exist_ok=True)
+        for rel in meta["dirs"]:
+            (dest / rel).mkdir(parents=True, exist_ok=True)
+        for rel, target in meta["symlinks"].items():
+            out = dest / rel
+            out.parent.mkdir(parents=True, exist_ok=True)
+            if os.path.lexists(out):
+                out.unlink()
+            os.symlink(target, out)
+        for rel in meta["files"]:
+            out = dest / rel
+            out.parent.mkdir(parents=True, exist_ok=True)
+            if os.path.lexists(out):
+                out.unlink()
+            _link_or_copy(data / rel, out, _hardlink_allowed(rel, meta.get("tree", True)))
+        # 目录权限最后设置，避免只读目录挡住其中文件的恢复
+        for rel, mode in sorted(meta["dirs"].items(), reverse=True):
+            os.chmod(dest / rel, mode)
+
+        os.utime(entry / "meta.json")
+        with self._lock:
+            self.stats.hits += 1
+            self.stats.restored_bytes += meta["size"]
+        return list(meta["files"]) + list(meta["symlinks"])
+
+    # ------------------------------------------------------------------ #
+    # 写入与淘汰
+    # ------------------------------------------------------------------ #
+    def store(self, key: str, base: Path, paths: Optional[Iterable[str]] = None, label: str = "") -> None:
+        """
+        保存 base 下的产物：paths 为空时保存整个目录树，否则只保存给定的相对路径。
+        条目先写入临时目录再整体改名，多个进程同时写入同一键时只保留先完成的一份。
+        """
+        staging = self.root / "tmp" / uuid.uuid4().hex
+        data = staging / "data"
+        data.mkdir(parents=True)
+        tree = paths is None
+        meta = {
+            "label": label, "created": time.time(), "size": 0, "tree": tree,
+            "dirs": {}, "symlinks": {}, "files": {},
+        }
+        try:
+            for rel in self._iter_paths(base, paths):
+                src = base / rel
+                out = data / rel
+                if src.is_symlink():
+                    meta["symlinks"][rel] = os.readlink(src)
+                elif src.is_dir():
+                    out.mkdir(parents=True, exist_ok=True)
+                    meta["dirs"][rel] = src.stat().st_mode & 0o7777
+                else:
+                    out.parent.mkdir(parents=True, exist_ok=True)
+                    _link_or_copy(src, out, _hardlink_allowed(rel, tree))
+                    st = out.stat()
+                    meta["files"][rel] = [st.st_size, st.st_mtime_ns]
+                    meta["size"] += st.st_size
+            self._write_json(staging / "meta.json", meta)
+
+            entry = self._entry_dir(key)
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.rename(staging, entry)
+            except OSError:
+                return
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        with self._lock:
+            self.stats.stores += 1
+        self.evict()
+
+    def evict(self) -> int:
+        """超过容量上限时按最近使用时间淘汰最旧的条目，返回淘汰数量"""
+        entries: List[Tuple[float, int, Path]] = []
+        for meta_path in self.root.glob("entries/*/*/meta.json"):
+            meta = self._read_meta(meta_path.parent)
+            if meta is None:
+                continue
+            entries.append((meta_path.stat().st_mtime, meta["size"], meta_path.parent))
+
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            evicted += 1
+        with self._lock:
+            self.stats.evictions += evicted
+        return evicted
+
+    # ------------------------------------------------------------------ #
+    def _entry_dir(self, key: str) -> Path:
+        return self.root / "entries" / key[:2] / key
+
+    def _iter_paths(self, base: Path, paths: Optional[Iterable[str]]) -> Iterable[str]:
+        if paths is not None:
+            yield from paths
+            return
+        for dirpath, dirnames, filenames in os.walk(base):
+            rel_dir = Path(dirpath).relative_to(base)
+            for name in dirnames + filenames:
+                yield (rel_dir / name).as_posix()
+
+    def _validate(self, entry: Path, meta: dict) -> bool:
+        data = entry / "data"
+        for rel, (size, mtime_ns) in meta["files"].items():
+            try:
+                st = (data / rel).stat()
+            except OSError:
+                return False
+            if st.st_size != size or st.st_mtime_ns != mtime_ns:
+                return False
+        return True
+
+    def _read_meta(self, entry: Path) -> Optional[dict]:
+        try:
+            with (entry / "meta.json").open("r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def _load_hash_memo(self) -> Dict[str, str]:
+        if self._hash_memo is None:
+            try:
+                with self._hash_memo_path.open("r", encoding="utf-8") as fh:
+                    self._hash_memo = json.load(fh)
+            except (OSError, ValueError):
+                self._hash_memo = {}
+        return self._hash_memo
+
+    def _write_json(self, path: Path, value: object) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            json.dump(value, fh, ensure_ascii=False)
+        os.replace(tmp, path)
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.erofs
+EROFS 镜像的只读解析（未压缩布局），用于按需浏览与单文件提取
+"""
+from __future__ import annotations
+
+import os
+import stat
+import struct
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .blockio import MappedFile, zero_chunks
+from .xattr import XATTR_PREFIXES
+
+EROFS_SUPERBLOCK_OFFSET = 1024
+EROFS_MAGIC = 0xE0F5E1E2
+EROFS_NULL_ADDR = 0xFFFFFFFF
+
+# i_format 中的数据布局（bit 1-3）
+EROFS_INODE_FLAT_PLAIN = 0
+EROFS_INODE_COMPRESSED_FULL = 1
+EROFS_INODE_FLAT_INLINE = 2
+EROFS_INODE_COMPRESSED_COMPACT = 3
+EROFS_INODE_CHUNK_BASED = 4
+
+EROFS_CHUNK_FORMAT_BLKBITS_MASK = 0x1F
+EROFS_CHUNK_FORMAT_INDEXES = 0x20
+
+SUPERBLOCK = struct.Struct("<IIIBBHQQIIII16s16sI")
+INODE_COMPACT = struct.Struct("<HHHHIIIIHHI")
+INODE_EXTENDED = struct.Struct("<HHHHQIIIIQII16x")
+DIR_ENTRY = struct.Struct("<QHBB")
+CHUNK_INDEX = struct.Struct("<HHI")
+XATTR_ENTRY = struct.Struct("<BBH")
+XATTR_IBODY_HEADER_SIZE = 12
+# e_name_index 最高位表示长名称前缀（记录在超级块的前缀表中）
+EROFS_XATTR_LONG_PREFIX = 0x80
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# (文件内偏移, 镜像内偏移, 长度)
+ByteRun = Tuple[int, int, int]
+
+
+class ErofsError(ValueError):
+    pass
+
+
+class ErofsInode(NamedTuple):
+    ino: int
+    mode: int
+    uid: int
+    gid: int
+    size: int
+    links: int
+    mtime_ns: int
+    layout: int
+    addr: int
+    xattr_size: int
+    # inode 与 inode 内扩展属性之后的位置：内联尾部数据或 chunk 索引从这里开始
+    tail_offset: int
+
+    @property
+    def is_dir(self) -> bool:
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_reg(self) -> bool:
+        return stat.S_ISREG(self.mode)
+
+    @property
+    def is_symlink(self) -> bool:
+        return stat.S_ISLNK(self.mode)
+
+    @property
+    def compressed(self) -> bool:
+        return self.layout in (EROFS_INODE_COMPRESSED_FULL, EROFS_INODE_COMPRESSED_COMPACT)
+
+
+class ErofsDirEntry(NamedTuple):
+    name: str
+    ino: int
+    file_type: int
+
+
+class ErofsImage:
+    """
+    只读的 EROFS 镜像，接口与 Ext4Image 对应（inode / listdir / lookup / read / copy_to / readlink / walk）。
+
+    支持紧凑与扩展 inode、FLAT_PLAIN / FLAT_INLINE / CHUNK_BASED 三种未压缩布局；
+    压缩文件（inode.compressed）只能列出，内容需交给 extract.erofs 解压。
+    与 Ext4Image 一样可传入任何提供 read_at(offset, size) 的 source，镜像关闭时一并关闭。
+    """
+
+    def __init__(self, path: Path, source=None) -> None:
+        self.path = Path(path)
+        if source is None:
+            try:
+                source = MappedFile(self.path)
+            except (OSError, ValueError):
+                raise ErofsError(f"无法映射镜像：{self.path.name}") from None
+        self._source = source
+        self._dir_cache: Dict[int, Dict[str, ErofsDirEntry]] = {}
+        try:
+            self._parse_superblock()
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+    def __enter__(self) -> "ErofsImage":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _read(self, offset: int, size: int) -> bytes:
+        """读取镜像内容；读到镜像末尾之外说明镜像被截断或元数据损坏"""
+        data = self._source.read_at(offset, size)
+        if len(data) < size:
+            raise ErofsError(f"读取越界（镜像被截断或元数据损坏）：偏移 {offset}，长度 {size}")
+        return data
+
+    # ------------------------------------------------------------------ #
+    # 超级块与 inode
+    # ------------------------------------------------------------------ #
+    def _parse_superblock(self) -> None:
+        sb = self._source.read_at(EROFS_SUPERBLOCK_OFFSET, SUPERBLOCK.size)
+        if len(sb) < SUPERBLOCK.size or struct.unpack_from("<I", sb, 0)[0] != EROFS_MAGIC:
+            raise ErofsError(f"不是 EROFS 镜像：{self.path.name}")
+        (_, _, _, blkszbits, _, self.root_nid, self.inodes_count, self.build_time, _,
+         self.blocks_count, meta_blkaddr, xattr_blkaddr, _, volume_name, _) = SUPERBLOCK.unpack(sb)
+        if not 9 <= blkszbits <= 16:
+            raise ErofsError(f"超级块无效：块大小 2^{blkszbits}")
+        self.block_size = 1 << blkszbits
+        self.volume_name = volume_name.split(b"\0", 1)[0].decode("utf-8", "replace")
+        self._meta_offset = meta_blkaddr * self.block_size
+        self._xattr_offset = xattr_blkaddr * self.block_size
+
+    def inode(self, nid: int) -> ErofsInode:
+        offset = self._meta_offset + (nid << 5)
+        raw = self._read(offset, INODE_COMPACT.size)
+        i_format = struct.unpack_from("<H", raw, 0)[0]
+        layout = (i_format >> 1) & 0x7
+        if i_format & 1:
+            raw = self._read(offset, INODE_EXTENDED.size)
+            (_, xattr_icount, mode, _, size, addr, _, uid, gid,
+             mtime, mtime_nsec, links) = INODE_EXTENDED.unpack(raw)
+            isize = INODE_EXTENDED.size
+            mtime_ns = mtime * 1_000_000_000 + mtime_nsec
+        else:
+            (_, xattr_icount, mode, links, size, mtime_delta, addr, _, uid, gid,
+             _) = INODE_COMPACT.unpack_from(raw, 0)
+            isize = INODE_COMPACT.size
+            # 紧凑 inode 的时间为构建时间（新版本在保留字段中记录相对偏移）
+            mtime_ns = (self.build_time + mtime_delta) * 1_000_000_000
+        xattr_size = XATTR_IBODY_HEADER_SIZE + (xattr_icount - 1) * 4 if xattr_icount else 0
+        return ErofsInode(
+            nid, mode, uid, gid, size, links, mtime_ns, layout, addr, xattr_size, offset + isize + xattr_size
+        )
+
+    # ------------------------------------------------------------------ #
+    # 数据映射
+    # ------------------------------------------------------------------ #
+    def byte_runs(self, inode: ErofsInode) -> Iterator[ByteRun]:
+        """按文件偏移顺序产出 (文件内偏移, 镜像内偏移, 长度)；chunk 空洞不产出"""
+        bs = self.block_size
+        size = inode.size
+        if not size:
+            return
+        if inode.compressed:
+            raise ErofsError(f"inode {inode.ino} 是压缩文件，需要 extract.erofs 解压")
+        if inode.layout == EROFS_INODE_FLAT_PLAIN:
+            yield 0, inode.addr * bs, size
+        elif inode.layout == EROFS_INODE_FLAT_INLINE:
+            # 最后一块（可能不满）紧跟在 inode 之后，其余块连续存放
+            head = (-(-size // bs) - 1) * bs
+            if head:
+                yield 0, inode.addr * bs, head
+            yield head, inode.tail_offset, size - head
+        elif inode.layout == EROFS_INODE_CHUNK_BASED:
+            yield from self._chunk_runs(inode)
+        else:
+            raise ErofsError(f"inode {inode.ino} 的数据布局未知：{inode.layout}")
+
+    def _chunk_runs(self, inode: ErofsInode) -> Iterator[ByteRun]:
+        chunk_format = inode.addr & 0xFFFF
+        chunk_size = self.block_size << (chunk_format & EROFS_CHUNK_FORMAT_BLKBITS_MASK)
+        count = -(-inode.size // chunk_size)
+        unit = CHUNK_INDEX.size if chunk_format & EROFS_CHUNK_FORMAT_INDEXES else 4
+        start = -(-inode.tail_offset // unit) * unit
+        table = self._read(start, count * unit)
+        for index in range(count):
+            if unit == 4:
+                blkaddr = struct.unpack_from("<I", table, index * 4)[0]
+            else:
+                _, device_id, blkaddr = CHUNK_INDEX.unpack_from(table, index * unit)
+                if device_id and blkaddr != EROFS_NULL_ADDR:
+                    raise ErofsError(f"inode {inode.ino} 的数据位于额外设备上，无法读取")
+            if blkaddr == EROFS_NULL_ADDR:
+                continue
+            logical = index * chunk_size
+            yield logical, blkaddr * self.block_size, min(chunk_size, inode.size - logical)
+
+    # ------------------------------------------------------------------ #
+    # 内容读取
+    # ------------------------------------------------------------------ #
+    def read(self, inode: ErofsInode) -> bytes:
+        data = bytearray(inode.size)
+        for logical, physical, length in self.byte_runs(inode):
+            data[logical:logical + length] = self._read(physical, length)
+        return bytes(data)
+
+    def copy_to(self, inode: ErofsInode, fh) -> int:
+        """把文件内容写入 fh，chunk 空洞保持为空洞；返回写入的字节数"""
+        read = getattr(self._source, "view", self._source.read_at)
+        written = 0
+        for logical, physical, length in self.byte_runs(inode):
+            # 先按镜像大小检查，不在持有映射区切片时抛出异常（否则关闭映射会失败）
+            if physical + length > self._source.size:
+                raise ErofsError(f"inode {inode.ino} 的数据超出镜像范围")
+            fh.seek(logical)
+            while length > 0:
+                step = min(COPY_CHUNK_SIZE, length)
+                fh.write(read(physical, step))
+                physical += step
+                length -= step
+                written += step
+        fh.truncate(inode.size)
+        return written
+
+    def iter_chunks(self, inode: ErofsInode) -> Iterator[bytes]:
+        """按顺序产出文件内容，空洞补零；用于写入不可 seek 的输出"""
+        pos = 0
+        for logical, physical, length in self.byte_runs(inode):
+            yield from zero_chunks(logical - pos, COPY_CHUNK_SIZE)
+            pos = logical + length
+            while length > 0:
+                step = min(COPY_CHUNK_SIZE, length)
+                yield self._read(physical, step)
+                physical += step
+                length -= step
+        yield from zero_chunks(inode.size - pos, COPY_CHUNK_SIZE)
+
+    def readlink(self, inode: ErofsInode) -> str:
+        return os.fsdecode(self.read(inode))
+
+    # ------------------------------------------------------------------ #
+    # 扩展属性
+    # ------------------------------------------------------------------ #
+    def xattrs(self, inode: ErofsInode) -> Dict[str, bytes]:
+        """inode 内的扩展属性与其引用的共享扩展属性；长名称前缀的条目不解析"""
+        result: Dict[str, bytes] = {}
+        if not inode.xattr_size:
+            return result
+        body = self._read(inode.tail_offset - inode.xattr_size, inode.xattr_size)
+        shared_count = body[4]
+        if XATTR_IBODY_HEADER_SIZE + shared_count * 4 > len(body):
+            raise ErofsError(f"inode {inode.ino} 的扩展属性头无效")
+        for index in range(shared_count):
+            xattr_id = struct.unpack_from("<I", body, XATTR_IBODY_HEADER_SIZE + index * 4)[0]
+            pos = self._xattr_offset + xattr_id * 4
+            name_len, _, value_size = XATTR_ENTRY.unpack(self._read(pos, XATTR_ENTRY.size))
+            self._parse_xattr_entry(self._read(pos, XATTR_ENTRY.size + name_len + value_size), 0, result)
+        pos = XATTR_IBODY_HEADER_SIZE + shared_count * 4
+        while pos + XATTR_ENTRY.size <= len(body):
+            pos = self._parse_xattr_entry(body, pos, result)
+        return result
+
+    def _parse_xattr_entry(self, data: bytes, pos: int, result: Dict[str, bytes]) -> int:
+        """解析 pos 处的一个条目，返回下一个条目的位置（按 4 字节对齐）"""
+        name_len, name_index, value_size = XATTR_ENTRY.unpack_from(data, pos)
+        start = pos + XATTR_ENTRY.size
+        if not name_index & EROFS_XATTR_LONG_PREFIX:
+            name = data[start:start + name_len].decode("utf-8", "replace")
+            result[XATTR_PREFIXES.get(name_index, "") + name] = bytes(data[start + name_len:start + name_len + value_size])
+        return pos + ((XATTR_ENTRY.size + name_len + value_size + 3) & ~3)
+
+    # ------------------------------------------------------------------ #
+    # 目录
+    # ------------------------------------------------------------------ #
+    def listdir(self, inode: ErofsInode) -> List[ErofsDirEntry]:
+        """目录项（不含 . 与 ..）；每个目录块开头是定长目录项数组，名称紧随其后"""
+        if not inode.is_dir:
+            raise ErofsError(f"inode {inode.ino} 不是目录")
+        entries: List[ErofsDirEntry] = []
+        bs = self.block_size
+        for logical, physical, length in self.byte_runs(inode):
+            data = self._read(physical, length)
+            for pos in range(0, length, bs):
+                self._parse_dirents(data[pos:pos + bs], entries)
+        return entries
+
+    def _parse_dirents(self, block: bytes, entries: List[ErofsDirEntry]) -> None:
+        if len(block) < DIR_ENTRY.size:
+            return
+        count = struct.unpack_from("<H", block, 8)[0] // DIR_ENTRY.size
+        if not count or count * DIR_ENTRY.size > len(block):
+            raise ErofsError("目录块无效")
+        items = [DIR_ENTRY.unpack_from(block, index * DIR_ENTRY.size) for index in range(count)]
+        for index, (nid, nameoff, file_type, _) in enumerate(items):
+            end = items[index + 1][1] if index + 1 < count else len(block)
+            if nameoff < count * DIR_ENTRY.size or end > len(block):
+                raise ErofsError("目录块无效：名称偏移越界")
+            name = block[nameoff:end]
+            if index + 1 == count:
+                name = name.split(b"\0", 1)[0]
+            # 名称来自镜像，提取时直接拼接到输出路径上，含路径分隔符或 NUL 的一律拒绝
+            if not name or b"/" in name or b"\0" in name:
+                raise ErofsError(f"目录项名称非法：{name!r}")
+            if name not in (b".", b".."):
+                entries.append(ErofsDirEntry(os.fsdecode(name), nid, file_type))
+
+    def lookup(self, path: str) -> ErofsInode:
+        """按镜像内路径解析 inode，只读取路径上各级目录的块；符号链接不跟随"""
+        stack = [self.inode(self.root_nid)]
+        names: List[str] = []
+        for part in path.split("/"):
+            if part in ("", "."):
+                continue
+            if part == "..":
+                if len(stack) > 1:
+                    stack.pop()
+                    names.pop()
+                continue
+            node = stack[-1]
+            if not node.is_dir:
+                raise ErofsError(f"不是目录：/{'/'.join(names)}")
+            children = self._dir_cache.get(node.ino)
+            if children is None:
+                children = {entry.name: entry for entry in self.listdir(node)}
+                self._dir_cache[node.ino] = children
+            entry = children.get(part)
+            if entry is None:
+                raise ErofsError(f"镜像中不存在：{path}")
+            stack.append(self.inode(entry.ino))
+            names.append(part)
+        return stack[-1]
+
+    def walk(self, top: Optional[ErofsInode] = None) -> Iterator[Tuple[str, ErofsInode]]:
+        """深度优先遍历，产出 (相对路径, inode)；起点的相对路径为空字符串"""
+        root = top or self.inode(self.root_nid)
+        yield "", root
+        stack = [("", root)]
+        # 正常镜像中目录不会有多个父目录；损坏的镜像里目录成环时不再重复进入
+        seen = {root.ino}
+        while stack:
+            prefix, directory = stack.pop()
+            names = set()
+            for entry in sorted(self.listdir(directory), key=lambda item: item.name):
+                if entry.name in names:
+                    raise ErofsError(f"目录中存在重复的目录项：{prefix}{entry.name}")
+                names.add(entry.name)
+                rel = f"{prefix}{entry.name}"
+                node = self.inode(entry.ino)
+                if node.is_dir and node.ino in seen:
+                    raise ErofsError(f"目录结构成环：{rel}")
+                yield rel, node
+                if node.is_dir:
+                    seen.add(node.ino)
+                    stack.append((rel + "/", node))
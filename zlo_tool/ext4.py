@@ -0,0 +1,658 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.ext4
+ext4 镜像的只读解析与提取（无需 debugfs / 7-Zip）
+"""
+from __future__ import annotations
+
+import os
+import re
+import stat
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .blockio import MappedFile, zero_chunks
+from .fstree import has_super_backup
+from .xattr import XATTR_PREFIXES, capabilities, selinux_context
+
+EXT4_SUPERBLOCK_OFFSET = 1024
+EXT4_MAGIC = 0xEF53
+EXT4_ROOT_INO = 2
+
+# s_feature_ro_compat / s_feature_incompat
+RO_COMPAT_SPARSE_SUPER = 0x1
+RO_COMPAT_SHARED_BLOCKS = 0x4000
+INCOMPAT_FILETYPE = 0x2
+INCOMPAT_JOURNAL_DEV = 0x8
+INCOMPAT_META_BG = 0x10
+INCOMPAT_64BIT = 0x80
+INCOMPAT_ENCRYPT = 0x10000
+
+# i_flags
+EXT4_INDEX_FL = 0x1000
+EXT4_EXTENTS_FL = 0x80000
+EXT4_EA_INODE_FL = 0x200000
+EXT4_INLINE_DATA_FL = 0x10000000
+EXT4_ENCRYPT_FL = 0x800
+
+EXT4_EXTENT_MAGIC = 0xF30A
+EXT4_EXTENT_INIT_MAX_LEN = 32768
+EXT4_XATTR_MAGIC = 0xEA020000
+EXT4_INLINE_DATA_SIZE = 60
+
+# 扩展属性名前缀（e_name_index）
+DIR_ENTRY = struct.Struct("<IHBB")
+EXTENT_HEADER = struct.Struct("<HHHHI")
+EXTENT_ENTRY = struct.Struct("<IHHI")
+EXTENT_INDEX = struct.Struct("<IIHH")
+XATTR_ENTRY = struct.Struct("<BBHIII")
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# 提取时每个线程池任务最多包含的文件数 / 字节数
+EXTRACT_BATCH_FILES = 64
+EXTRACT_BATCH_BYTES = 16 * 1024 * 1024
+
+# (逻辑块号, 物理块号, 块数)
+BlockRun = Tuple[int, int, int]
+
+
+class Ext4Error(ValueError):
+    pass
+
+
+class Ext4Inode(NamedTuple):
+    ino: int
+    mode: int
+    uid: int
+    gid: int
+    size: int
+    links: int
+    flags: int
+    mtime_ns: int
+    atime_ns: int
+    file_acl: int
+    block: bytes
+    raw: bytes
+
+    @property
+    def is_dir(self) -> bool:
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_reg(self) -> bool:
+        return stat.S_ISREG(self.mode)
+
+    @property
+    def is_symlink(self) -> bool:
+        return stat.S_ISLNK(self.mode)
+
+
+class Ext4DirEntry(NamedTuple):
+    name: str
+    ino: int
+    file_type: int
+
+
+class Ext4ExtractStats(NamedTuple):
+    files: int
+    dirs: int
+    symlinks: int
+    hardlinks: int
+    skipped: int
+    bytes: int
+
+
+def _signed32(value: int) -> int:
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+class Ext4Image:
+    """
+    只读的 ext4 镜像。
+
+    支持 extent 树与传统间接块映射、内联数据、快速/慢速符号链接、哈希目录（按线性目录读取）、
+    inode 内与独立块中的扩展属性（含 EA inode）；不支持加密目录与外部日志设备。
+    默认以 mmap 映射 RAW 镜像；也可传入任何提供 read_at(offset, size) 的 source（如 SparseImage），
+    只按需读取用到的块。所有读取均无共享游标，可在多个线程中并发使用；镜像关闭时一并关闭 source。
+    """
+
+    def __init__(self, path: Path, source=None) -> None:
+        self.path = Path(path)
+        if source is None:
+            try:
+                source = MappedFile(self.path)
+            except (OSError, ValueError):
+                raise Ext4Error(f"无法映射镜像：{self.path.name}") from None
+        self._source = source
+        # 目录 inode -> {名称: 目录项}，供 lookup 逐级解析路径时复用
+        self._dir_cache: Dict[int, Dict[str, Ext4DirEntry]] = {}
+        try:
+            self._parse_superblock()
+            self._parse_group_descriptors()
+        except BaseException:
+            self.close()
+            raise
+
+    # ------------------------------------------------------------------ #
+    def close(self) -> None:
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+    def __enter__(self) -> "Ext4Image":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _read(self, offset: int, size: int) -> bytes:
+        """读取镜像内容；读到镜像末尾之外说明镜像被截断或元数据损坏"""
+        data = self._source.read_at(offset, size)
+        if len(data) < size:
+            raise Ext4Error(f"读取越界（镜像被截断或元数据损坏）：偏移 {offset}，长度 {size}")
+        return data
+
+    # ------------------------------------------------------------------ #
+    # 超级块与组描述符
+    # ------------------------------------------------------------------ #
+    def _parse_superblock(self) -> None:
+        sb = self._source.read_at(EXT4_SUPERBLOCK_OFFSET, 1024)
+        if len(sb) < 1024 or struct.unpack_from("<H", sb, 0x38)[0] != EXT4_MAGIC:
+            raise Ext4Error(f"不是 ext2/3/4 镜像：{self.path.name}")
+        self.inodes_count, blocks_lo = struct.unpack_from("<II", sb, 0x0)
+        self.first_data_block, log_block_size = struct.unpack_from("<II", sb, 0x14)
+        if log_block_size > 6:
+            raise Ext4Error(f"超级块无效：块大小指数 {log_block_size}")
+        self.block_size = 1024 << log_block_size
+        self.blocks_per_group = struct.unpack_from("<I", sb, 0x20)[0]
+        self.inodes_per_group = struct.unpack_from("<I", sb, 0x28)[0]
+        rev_level = struct.unpack_from("<I", sb, 0x4C)[0]
+        self.inode_size = struct.unpack_from("<H", sb, 0x58)[0] if rev_level >= 1 else 128
+        self.feature_incompat, self.feature_ro_compat = struct.unpack_from("<II", sb, 0x60)
+        self.volume_name = sb[0x78:0x88].split(b"\0", 1)[0].decode("utf-8", "replace")
+        is_64bit = bool(self.feature_incompat & INCOMPAT_64BIT)
+        desc_size = struct.unpack_from("<H", sb, 0xFE)[0]
+        self.desc_size = desc_size if is_64bit and desc_size >= 64 else 32
+        self.first_meta_bg = struct.unpack_from("<I", sb, 0x104)[0]
+        blocks_hi = struct.unpack_from("<I", sb, 0x150)[0] if is_64bit else 0
+        self.blocks_count = blocks_lo | (blocks_hi << 32)
+
+        if self.feature_incompat & INCOMPAT_JOURNAL_DEV:
+            raise Ext4Error("镜像是外部日志设备，不含文件系统内容")
+        if not self.blocks_per_group or not self.inodes_per_group:
+            raise Ext4Error("超级块无效：每组块数或 inode 数为 0")
+        if self.inode_size < 128 or self.inode_size > self.block_size or self.inode_size & (self.inode_size - 1):
+            raise Ext4Error(f"超级块无效：inode 大小 {self.inode_size}")
+        self.group_count = -(-(self.blocks_count - self.first_data_block) // self.blocks_per_group)
+
+    def _parse_group_descriptors(self) -> None:
+        """只需要每组 inode 表的位置；meta_bg 时描述符分散在各元块组的首块中"""
+        per_block = self.block_size // self.desc_size
+        gdt_start = self.first_data_block + 1
+        self._inode_tables: List[int] = []
+        for group in range(self.group_count):
+            meta_group = group // per_block
+            if self.feature_incompat & INCOMPAT_META_BG and meta_group >= self.first_meta_bg:
+                first = meta_group * per_block
+                block = self.first_data_block + first * self.blocks_per_group + (1 if self._has_super(first) else 0)
+            else:
+                block = gdt_start + meta_group
+            offset = block * self.block_size + (group % per_block) * self.desc_size
+            desc = self._read(offset, self.desc_size)
+            table = struct.unpack_from("<I", desc, 0x8)[0]
+            if self.desc_size >= 64:
+                table |= struct.unpack_from("<I", desc, 0x28)[0] << 32
+            self._inode_tables.append(table)
+
+    def _has_super(self, group: int) -> bool:
+        return not self.feature_ro_compat & RO_COMPAT_SPARSE_SUPER or has_super_backup(group)
+
+    # ------------------------------------------------------------------ #
+    # inode
+    # ------------------------------------------------------------------ #
+    def inode(self, ino: int) -> Ext4Inode:
+        if not 1 <= ino <= self.inodes_count:
+            raise Ext4Error(f"inode 号越界：{ino}")
+        group, index = divmod(ino - 1, self.inodes_per_group)
+        if group >= len(self._inode_tables):
+            raise Ext4Error(f"inode {ino} 所在的块组不存在")
+        offset = self._inode_tables[group] * self.block_size + index * self.inode_size
+        raw = self._read(offset, self.inode_size)
+
+        mode, uid_lo, size_lo, atime, _, mtime = struct.unpack_from("<HHIIII", raw, 0)
+        gid_lo, links = struct.unpack_from("<HH", raw, 0x18)
+        flags = struct.unpack_from("<I", raw, 0x20)[0]
+        acl_lo, size_hi = struct.unpack_from("<II", raw, 0x68)
+        acl_hi, uid_hi, gid_hi = struct.unpack_from("<HHH", raw, 0x76)
+        mtime_ns = _signed32(mtime) * 1_000_000_000
+        atime_ns = _signed32(atime) * 1_000_000_000
+        if self.inode_size > 128:
+            extra_isize = struct.unpack_from("<H", raw, 0x80)[0]
+            if extra_isize >= 16:
+                mtime_extra, atime_extra = struct.unpack_from("<II", raw, 0x88)
+                mtime_ns += ((mtime_extra & 3) << 32) * 1_000_000_000 + (mtime_extra >> 2)
+                atime_ns += ((atime_extra & 3) << 32) * 1_000_000_000 + (atime_extra >> 2)
+        return Ext4Inode(
+            ino=ino,
+            mode=mode,
+            uid=uid_lo | (uid_hi << 16),
+            gid=gid_lo | (gid_hi << 16),
+            size=size_lo | (size_hi << 32),
+            links=links,
+            flags=flags,
+            mtime_ns=mtime_ns,
+            atime_ns=atime_ns,
+            file_acl=acl_lo | (acl_hi << 32),
+            block=raw[0x28:0x28 + EXT4_INLINE_DATA_SIZE],
+            raw=raw,
+        )
+
+    # ------------------------------------------------------------------ #
+    # 数据块映射
+    # ------------------------------------------------------------------ #
+    def block_runs(self, inode: Ext4Inode) -> Iterator[BlockRun]:
+        """按逻辑块顺序产出 (逻辑块号, 物理块号, 块数)；空洞与未初始化的 extent 不产出"""
+        if inode.flags & EXT4_EXTENTS_FL:
+            yield from self._extent_runs(inode.block, 0)
+        else:
+            yield from self._indirect_runs(inode.block)
+
+    def _extent_runs(self, node: bytes, depth_seen: int) -> Iterator[BlockRun]:
+        magic, entries, _, depth, _ = EXTENT_HEADER.unpack_from(node, 0)
+        if magic != EXT4_EXTENT_MAGIC:
+            raise Ext4Error("extent 头部无效")
+        if depth_seen > 5:
+            raise Ext4Error("extent 树过深")
+        if 12 + entries * 12 > len(node):
+            raise Ext4Error(f"extent 节点项数越界：{entries}")
+        for index in range(entries):
+            offset = 12 + index * 12
+            if depth == 0:
+                logical, length, start_hi, start_lo = EXTENT_ENTRY.unpack_from(node, offset)
+                if length > EXT4_EXTENT_INIT_MAX_LEN:
+                    continue  # 未初始化的 extent 读出来是 0，按空洞处理
+                yield logical, start_lo | (start_hi << 32), length
+            else:
+                _, leaf_lo, leaf_hi, _ = EXTENT_INDEX.unpack_from(node, offset)
+                child = self._block(leaf_lo | (leaf_hi << 32))
+                yield from self._extent_runs(child, depth_seen + 1)
+
+    def _indirect_runs(self, block: bytes) -> Iterator[BlockRun]:
+        """ext2/3 的间接块映射：12 个直接块 + 一/二/三级间接块，连续的物理块合并为一段"""
+        pointers = struct.unpack_from("<15I", block, 0)
+        per_block = self.block_size // 4
+        run: Optional[List[int]] = None
+
+        def visit(ptr: int, level: int, logical: int) -> Iterator[Tuple[int, int]]:
+            if level == 0:
+                yield logical, ptr
+                return
+            span = per_block ** (level - 1)
+            children = struct.unpack_from(f"<{per_block}I", self._read(ptr * self.block_size, self.block_size))
+            for index, child in enumerate(children):
+                if child:
+                    yield from visit(child, level - 1, logical + index * span)
+
+        def mapped() -> Iterator[Tuple[int, int]]:
+            for index in range(12):
+                if pointers[index]:
+                    yield index, pointers[index]
+            logical = 12
+            for level in (1, 2, 3):
+                if pointers[11 + level]:
+                    yield from visit(pointers[11 + level], level, logical)
+                logical += per_block ** level
+
+        for logical, physical in mapped():
+            if run and run[0] + run[2] == logical and run[1] + run[2] == physical:
+                run[2] += 1
+                continue
+            if run:
+                yield run[0], run[1], run[2]
+            run = [logical, physical, 1]
+        if run:
+            yield run[0], run[1], run[2]
+
+    def _block(self, block: int) -> bytes:
+        if block >= self.blocks_count:
+            raise Ext4Error(f"块号越界：{block}")
+        offset = block * self.block_size
+        return self._read(offset, self.block_size)
+
+    # ------------------------------------------------------------------ #
+    # 内容读取
+    # ------------------------------------------------------------------ #
+    def read(self, inode: Ext4Inode) -> bytes:
+        """读取整个文件内容（用于符号链接、目录、EA inode 等小对象）"""
+        if inode.flags & EXT4_INLINE_DATA_FL:
+            return self._inline_data(inode)[:inode.size]
+        data = bytearray(inode.size)
+        bs = self.block_size
+        for logical, physical, count in self.block_runs(inode):
+            start = logical * bs
+            if start >= inode.size:
+                break
+            length = min(count * bs, inode.size - start)
+            data[start:start + length] = self._read(physical * bs, length)
+        return bytes(data)
+
+    def copy_to(self, inode: Ext4Inode, fh) -> int:
+        """把文件内容写入 fh，空洞保持为空洞；返回写入的字节数"""
+        if inode.flags & EXT4_INLINE_DATA_FL:
+            data = self._inline_data(inode)[:inode.size]
+            fh.write(data)
+            return len(data)
+        written = 0
+        bs = self.block_size
+        # mmap 映射时直接写出映射区切片，否则按块读取
+        read = getattr(self._source, "view", self._source.read_at)
+        for logical, physical, count in self.block_runs(inode):
+            start = logical * bs
+            if start >= inode.size:
+                break
+            end = min(start + count * bs, inode.size)
+            src = physical * bs
+            # 先按镜像大小检查，不在持有映射区切片时抛出异常（否则关闭映射会失败）
+            if src + (end - start) > self._source.size:
+                raise Ext4Error(f"inode {inode.ino} 的数据块超出镜像范围")
+            fh.seek(start)
+            while start < end:
+                step = min(COPY_CHUNK_SIZE, end - start)
+                fh.write(read(src, step))
+                start += step
+                src += step
+                written += step
+        fh.truncate(inode.size)
+        return written
+
+    def iter_chunks(self, inode: Ext4Inode) -> Iterator[bytes]:
+        """按顺序产出文件内容，空洞补零；用于写入不可 seek 的输出（如标准输出）"""
+        if inode.flags & EXT4_INLINE_DATA_FL:
+            yield self._inline_data(inode)[:inode.size]
+            return
+        pos = 0
+        bs = self.block_size
+        for logical, physical, count in self.block_runs(inode):
+            start = logical * bs
+            if start >= inode.size:
+                break
+            yield from zero_chunks(start - pos, COPY_CHUNK_SIZE)
+            end = min(start + count * bs, inode.size)
+            src = physical * bs
+            while start < end:
+                step = min(COPY_CHUNK_SIZE, end - start)
+                yield self._read(src, step)
+                start += step
+                src += step
+            pos = end
+        yield from zero_chunks(inode.size - pos, COPY_CHUNK_SIZE)
+
+    def _inline_data(self, inode: Ext4Inode) -> bytes:
+        """内联数据：i_block 中的 60 字节 + system.data 扩展属性中的剩余部分"""
+        return inode.block + self.xattrs(inode).get("system.data", b"")
+
+    def readlink(self, inode: Ext4Inode) -> str:
+        if not inode.flags & EXT4_INLINE_DATA_FL and inode.size < EXT4_INLINE_DATA_SIZE and not self._has_data_blocks(inode):
+            return os.fsdecode(inode.block[:inode.size])
+        return os.fsdecode(self.read(inode))
+
+    def _has_data_blocks(self, inode: Ext4Inode) -> bool:
+        """快速符号链接没有数据块：i_blocks 只可能来自扩展属性块"""
+        blocks = struct.unpack_from("<I", inode.raw, 0x1C)[0]
+        if inode.file_acl:
+            blocks -= self.block_size // 512
+        return blocks > 0
+
+    # ------------------------------------------------------------------ #
+    # 目录
+    # ------------------------------------------------------------------ #
+    def listdir(self, inode: Ext4Inode) -> List[Ext4DirEntry]:
+        """目录项（不含 . 与 ..）；哈希目录的索引块伪装成空目录项，按线性目录读取即可"""
+        if not inode.is_dir:
+            raise Ext4Error(f"inode {inode.ino} 不是目录")
+        if inode.flags & EXT4_ENCRYPT_FL:
+            raise Ext4Error(f"inode {inode.ino} 是加密目录，无法读取")
+        entries: List[Ext4DirEntry] = []
+        if inode.flags & EXT4_INLINE_DATA_FL:
+            # 前 4 字节为父目录 inode，其后与 system.data 中均为普通目录项
+            self._parse_dirents(inode.block[4:], entries)
+            self._parse_dirents(self.xattrs(inode).get("system.data", b""), entries)
+            return entries
+        bs = self.block_size
+        for logical, physical, count in self.block_runs(inode):
+            count = min(count, -(-inode.size // bs) - logical)
+            if count <= 0:
+                break
+            data = self._read(physical * bs, count * bs)
+            for index in range(count):
+                self._parse_dirents(data[index * bs:(index + 1) * bs], entries)
+        return entries
+
+    def lookup(self, path: str) -> Ext4Inode:
+        """
+        按镜像内路径（"/" 分隔，可带前导 "/"）解析 inode，只读取路径上各级目录的块。
+        符号链接不跟随；解析过的目录项缓存在实例中，重复查找同一目录不再读盘。
+        """
+        stack = [self.inode(EXT4_ROOT_INO)]
+        names: List[str] = []
+        for part in path.split("/"):
+            if part in ("", "."):
+                continue
+            if part == "..":
+                if len(stack) > 1:
+                    stack.pop()
+                    names.pop()
+                continue
+            node = stack[-1]
+            if not node.is_dir:
+                raise Ext4Error(f"不是目录：/{'/'.join(names)}")
+            children = self._dir_cache.get(node.ino)
+            if children is None:
+                children = {entry.name: entry for entry in self.listdir(node)}
+                self._dir_cache[node.ino] = children
+            entry = children.get(part)
+            if entry is None:
+                raise Ext4Error(f"镜像中不存在：{path}")
+            stack.append(self.inode(entry.ino))
+            names.append(part)
+        return stack[-1]
+
+    def _parse_dirents(self, data: bytes, entries: List[Ext4DirEntry]) -> None:
+        has_type = bool(self.feature_incompat & INCOMPAT_FILETYPE)
+        pos = 0
+        while pos + DIR_ENTRY.size <= len(data):
+            ino, rec_len, name_len, file_type = DIR_ENTRY.unpack_from(data, pos)
+            if rec_len in (0, 65535) and len(data) >= 65536:
+                rec_len = 65536  # 64K 块的目录项长度编码
+            if rec_len < DIR_ENTRY.size:
+                break
+            if ino:
+                if not has_type:
+                    name_len |= file_type << 8
+                    file_type = 0
+                name = bytes(data[pos + 8:pos + 8 + name_len])
+                # 名称来自镜像，提取时直接拼接到输出路径上，含路径分隔符或 NUL 的一律拒绝
+                if not name or len(name) < name_len or b"/" in name or b"\0" in name:
+                    raise Ext4Error(f"目录项名称非法：{name!r}")
+                if name not in (b".", b".."):
+                    entries.append(Ext4DirEntry(os.fsdecode(name), ino, file_type))
+            pos += rec_len
+
+    # ------------------------------------------------------------------ #
+    # 扩展属性
+    # ------------------------------------------------------------------ #
+    def xattrs(self, inode: Ext4Inode) -> Dict[str, bytes]:
+        result: Dict[str, bytes] = {}
+        raw = inode.raw
+        if self.inode_size > 128:
+            extra_isize = struct.unpack_from("<H", raw, 0x80)[0]
+            header = 128 + extra_isize
+            if header + 4 <= len(raw) and struct.unpack_from("<I", raw, header)[0] == EXT4_XATTR_MAGIC:
+                self._parse_xattr_entries(raw, header + 4, header + 4, result)
+        if inode.file_acl:
+            block = self._block(inode.file_acl)
+            if struct.unpack_from("<I", block, 0)[0] == EXT4_XATTR_MAGIC:
+                self._parse_xattr_entries(block, 32, 0, result)
+        return result
+
+    def _parse_xattr_entries(self, data: bytes, pos: int, value_base: int, result: Dict[str, bytes]) -> None:
+        while pos + XATTR_ENTRY.size <= len(data) and struct.unpack_from("<I", data, pos)[0]:
+            name_len, name_index, value_offs, value_inum, value_size, _ = XATTR_ENTRY.unpack_from(data, pos)
+            name = data[pos + XATTR_ENTRY.size:pos + XATTR_ENTRY.size + name_len].decode("utf-8", "replace")
+            if value_inum:
+                value = self.read(self.inode(value_inum))[:value_size]
+            else:
+                start = value_base + value_offs
+                value = bytes(data[start:start + value_size])
+            result[XATTR_PREFIXES.get(name_index, "") + name] = value
+            pos += (XATTR_ENTRY.size + name_len + 3) & ~3
+
+    # ------------------------------------------------------------------ #
+    # 遍历
+    # ------------------------------------------------------------------ #
+    def walk(self, top: Optional[Ext4Inode] = None) -> Iterator[Tuple[str, Ext4Inode]]:
+        """深度优先遍历，产出 (相对路径, inode)；起点（默认根目录）的相对路径为空字符串"""
+        root = top or self.inode(EXT4_ROOT_INO)
+        yield "", root
+        stack = [("", root)]
+        # 正常镜像中目录不会有多个父目录；损坏的镜像里目录成环时不再重复进入
+        seen = {root.ino}
+        while stack:
+            prefix, directory = stack.pop()
+            names = set()
+            for entry in sorted(self.listdir(directory), key=lambda item: item.name):
+                if entry.name in names:
+                    raise Ext4Error(f"目录中存在重复的目录项：{prefix}{entry.name}")
+                names.add(entry.name)
+                rel = f"{prefix}{entry.name}"
+                node = self.inode(entry.ino)
+                if node.is_dir and node.ino in seen:
+                    raise Ext4Error(f"目录结构成环：{rel}")
+                yield rel, node
+                if node.is_dir:
+                    seen.add(node.ino)
+                    stack.append((rel + "/", node))
+
+
+# ---------------------------------------------------------------------- #
+# 提取
+# ---------------------------------------------------------------------- #
+def _remove(path: str) -> None:
+    """删除已存在的同名文件或符号链接（重复提取时覆盖）"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def extract_ext4(
+    image: Ext4Image,
+    out_dir: Path,
+    mount_point: str,
+    workers: int = 4,
+    log: Optional[Callable[[str], None]] = None,
+) -> Tuple[Ext4ExtractStats, List[str], List[str]]:
+    """
+    把镜像内容提取到 out_dir，返回 (统计, fs_config 行, file_contexts 行)。
+
+    目录与符号链接在遍历时依次创建，普通文件交给线程池写出（数据直接从映射区写入，空洞保留）；
+    权限与 mtime 写回文件，uid/gid、capabilities 与 SELinux 上下文记入返回的两份配置，
+    路径以 mount_point 为前缀（与 e2fsdroid -a 的约定一致）。以 root 运行时同时恢复属主。
+    """
+    log = log or (lambda msg: None)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    root = str(out_dir)
+    chown = hasattr(os, "geteuid") and os.geteuid() == 0
+    mount_point = mount_point.strip("/")
+    fs_config: List[str] = []
+    file_contexts: List[str] = []
+    dirs: List[Tuple[str, Ext4Inode]] = []
+    links: Dict[int, str] = {}
+    hardlinks: List[Tuple[str, str]] = []
+    counts = {"files": 0, "dirs": 0, "symlinks": 0, "hardlinks": 0, "skipped": 0}
+    written = [0]
+    lock = threading.Lock()
+
+    def apply_metadata(target: str, inode: Ext4Inode) -> None:
+        if chown:
+            os.chown(target, inode.uid, inode.gid, follow_symlinks=False)
+        os.chmod(target, stat.S_IMODE(inode.mode))
+        os.utime(target, ns=(inode.atime_ns, inode.mtime_ns))
+
+    def write_files(batch: List[Tuple[str, Ext4Inode]]) -> None:
+        count = 0
+        for target, inode in batch:
+            _remove(target)
+            with open(target, "wb") as fh:
+                count += image.copy_to(inode, fh)
+            apply_metadata(target, inode)
+        with lock:
+            written[0] += count
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = []
+        # 小文件按批提交，减少线程池调度开销
+        batch: List[Tuple[str, Ext4Inode]] = []
+        batch_bytes = 0
+        for rel, inode in image.walk():
+            target = os.path.join(root, rel) if rel else root
+            config_path = f"{mount_point}/{rel}".strip("/") if rel else mount_point
+            xattrs = image.xattrs(inode)
+            caps = capabilities(xattrs)
+            line = f"{config_path} {inode.uid} {inode.gid} {stat.S_IMODE(inode.mode):04o}"
+            fs_config.append(f"{line} capabilities=0x{caps:x}" if caps else line)
+            context = selinux_context(xattrs)
+            if context:
+                file_contexts.append(f"/{re.escape(config_path)} {context}")
+
+            if inode.is_dir:
+                os.makedirs(target, exist_ok=True)
+                dirs.append((target, inode))
+                counts["dirs"] += 1
+            elif inode.is_symlink:
+                _remove(target)
+                try:
+                    os.symlink(image.readlink(inode), target)
+                    if chown:
+                        os.chown(target, inode.uid, inode.gid, follow_symlinks=False)
+                    counts["symlinks"] += 1
+                except OSError:
+                    counts["skipped"] += 1
+            elif inode.is_reg:
+                if inode.links > 1 and inode.ino in links:
+                    hardlinks.append((links[inode.ino], target))
+                    continue
+                if inode.links > 1:
+                    links[inode.ino] = target
+                batch.append((target, inode))
+                batch_bytes += inode.size
+                counts["files"] += 1
+                if len(batch) >= EXTRACT_BATCH_FILES or batch_bytes >= EXTRACT_BATCH_BYTES:
+                    pending.append(pool.submit(write_files, batch))
+                    batch, batch_bytes = [], 0
+            else:
+                counts["skipped"] += 1
+        if batch:
+            pending.append(pool.submit(write_files, batch))
+        for future in pending:
+            future.result()
+
+    # 硬链接在源文件写完后再建立
+    for source, target in hardlinks:
+        _remove(target)
+        os.link(source, target)
+    counts["hardlinks"] = len(hardlinks)
+
+    # 目录属性最后设置（由深到浅），避免只读目录挡住其中文件的写入
+    for target, inode in reversed(dirs):
+        apply_metadata(target, inode)
+    if counts["skipped"]:
+        log(f"  跳过 {counts['skipped']} 个设备/管道文件或无法创建的符号链接（已记入 fs_config）")
+    stats = Ext4ExtractStats(
+        counts["files"], counts["dirs"], counts["symlinks"], counts["hardlinks"], counts["skipped"], written[0]
+    )
+    return stats, fs_config, file_contexts
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.fileindex
+项目级文件索引（SQLite）：记录各镜像中每个文件的属性与内容哈希，支持跨项目搜索
+"""
+from __future__ import annotations
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+INDEX_DB_NAME = "zlo_index.db"
+INDEX_SCHEMA_VERSION = 1
+SEARCH_DEFAULT_LIMIT = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    fs TEXT NOT NULL,
+    files INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mode INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    gid INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    link TEXT,
+    sha256 TEXT,
+    selinux TEXT,
+    capabilities INTEGER NOT NULL,
+    xattrs TEXT
+);
+CREATE INDEX IF NOT EXISTS files_path ON files(path);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files(sha256);
+CREATE INDEX IF NOT EXISTS files_image ON files(image_id);
+"""
+
+
+class IndexedFile(NamedTuple):
+    """镜像中的一项；path 为镜像内绝对路径，sha256 只对普通文件记录，xattrs 的值为十六进制"""
+
+    path: str
+    size: int
+    mode: int
+    uid: int
+    gid: int
+    mtime_ns: int
+    link: Optional[str]
+    sha256: Optional[str]
+    selinux: Optional[str]
+    capabilities: int
+    xattrs: Dict[str, str]
+
+
+class IndexedImage(NamedTuple):
+    name: str
+    sha256: str
+    size: int
+    mtime_ns: int
+    fs: str
+    files: int
+
+
+class SearchHit(NamedTuple):
+    project: str
+    image: str
+    path: str
+    size: int
+    mode: int
+    uid: int
+    gid: int
+    link: Optional[str]
+    sha256: Optional[str]
+    selinux: Optional[str]
+
+
+class FileIndex:
+    """
+    单个项目的索引数据库（<项目>/zlo_index.db）。
+
+    ``images`` 每个镜像一行，按镜像内容哈希判断是否需要重建；``files`` 每个文件一行。
+    一个镜像的所有行在同一事务中整体替换，中断时保留上一次的完整索引。
+    """
+
+    def __init__(self, db_path: Path, readonly: bool = False) -> None:
+        """
+        readonly=True 时以只读方式打开（跨项目搜索用）：不建表、不迁移也不丢弃旧索引，
+        调用方应先检查 version 是否等于 INDEX_SCHEMA_VERSION。
+        """
+        self.path = Path(db_path)
+        if readonly:
+            self._conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+            self.version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            return
+        self._conn = sqlite3.connect(str(self.path))
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, INDEX_SCHEMA_VERSION):
+            # 结构不兼容的旧索引直接丢弃，重新索引即可恢复
+            self._conn.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS images;")
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute(f"PRAGMA user_version = {INDEX_SCHEMA_VERSION}")
+        self.version = INDEX_SCHEMA_VERSION
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "FileIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # ------------------------------------------------------------------ #
+    # 镜像
+    # ------------------------------------------------------------------ #
+    def image(self, name: str) -> Optional[IndexedImage]:
+        row = self._conn.execute(
+            "SELECT name, sha256, size, mtime_ns, fs, files FROM images WHERE name = ?", (name,)
+        ).fetchone()
+        return IndexedImage(*row) if row else None
+
+    def images(self) -> List[IndexedImage]:
+        rows = self._conn.execute("SELECT name, sha256, size, mtime_ns, fs, files FROM images ORDER BY name")
+        return [IndexedImage(*row) for row in rows]
+
+    def touch_image(self, name: str, size: int, mtime_ns: int) -> None:
+        """镜像内容未变（哈希相同）但文件状态变化时，只更新记录的状态"""
+        with self._conn:
+            self._conn.execute("UPDATE images SET size = ?, mtime_ns = ? WHERE name = ?", (size, mtime_ns, name))
+
+    def replace_image(
+        self, name: str, sha256: str, size: int, mtime_ns: int, fs: str, entries: Iterable[IndexedFile]
+    ) -> int:
+        """在一个事务中替换镜像的全部文件记录，返回写入的行数"""
+        with self._conn:
+            self._conn.execute("DELETE FROM images WHERE name = ?", (name,))
+            cursor = self._conn.execute(
+                "INSERT INTO images (name, sha256, size, mtime_ns, fs, files, indexed_at) VALUES (?, ?, ?, ?, ?, 0, ?)",
+                (name, sha256, size, mtime_ns, fs, time.time()),
+            )
+            image_id = cursor.lastrowid
+            count = 0
+            batch = []
+            for entry in entries:
+                batch.append((
+                    image_id, entry.path, entry.size, entry.mode, entry.uid, entry.gid, entry.mtime_ns,
+                    entry.link, entry.sha256, entry.selinux, entry.capabilities,
+                    json.dumps(entry.xattrs, sort_keys=True) if entry.xattrs else None,
+                ))
+                if len(batch) >= 1000:
+                    self._insert_files(batch)
+                    count += len(batch)
+                    batch = []
+            self._insert_files(batch)
+            count += len(batch)
+            self._conn.execute("UPDATE images SET files = ? WHERE id = ?", (count, image_id))
+        return count
+
+    def remove_image(self, name: str) -> None:
+        with self._conn:
+            self._conn.execute("DELETE FROM images WHERE name = ?", (name,))
+
+    def _insert_files(self, rows: List[tuple]) -> None:
+        self._conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    # ------------------------------------------------------------------ #
+    # 查询
+    # ------------------------------------------------------------------ #
+    def search(
+        self, pattern: str = "", sha256: Optional[str] = None, limit: int = SEARCH_DEFAULT_LIMIT, project: str = ""
+    ) -> List[SearchHit]:
+        """
+        pattern 含 * ? [ 时按 GLOB 匹配完整路径，否则按子串匹配（不区分大小写）；
+        sha256 给出时只返回内容哈希相同的文件（可为前缀）。
+        """
+        clauses = []
+        params: List[object] = []
+        if pattern:
+            if any(ch in pattern for ch in "*?["):
+                clauses.append("f.path GLOB ?")
+                params.append(pattern)
+            else:
+                clauses.append("f.path LIKE ? ESCAPE '\\'")
+                escaped = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                params.append(f"%{escaped}%")
+        if sha256:
+            clauses.append("f.sha256 LIKE ?")
+            params.append(f"{sha256.lower()}%")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn.execute(
+            "SELECT i.name, f.path, f.size, f.mode, f.uid, f.gid, f.link, f.sha256, f.selinux "
+            f"FROM files f JOIN images i ON i.id = f.image_id {where} ORDER BY i.name, f.path LIMIT ?",
+            (*params, limit),
+        )
+        return [SearchHit(project, *row) for row in rows]
+
+
+def search_projects(
+    projects: Dict[str, Path], pattern: str = "", sha256: Optional[str] = None, limit: int = SEARCH_DEFAULT_LIMIT
+) -> List[SearchHit]:
+    """
+    在多个项目的索引中搜索（项目名 -> 项目目录）。索引以只读方式打开，不会修改其他项目；
+    未建立索引、结构版本不一致或无法读取的项目跳过（重新执行索引即可恢复）。
+    """
+    hits: List[SearchHit] = []
+    for name, project_dir in projects.items():
+        db_path = project_dir / INDEX_DB_NAME
+        if not db_path.is_file() or len(hits) >= limit:
+            continue
+        try:
+            with FileIndex(db_path, readonly=True) as index:
+                if index.version != INDEX_SCHEMA_VERSION:
+                    continue
+                hits.extend(index.search(pattern, sha256, limit - len(hits), project=name))
+        except sqlite3.DatabaseError:
+            continue
+    return hits
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.fstree
+分区目录的单次遍历与 ext4 镜像大小估算
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import stat
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+HASH_BUFFER_SIZE = 1024 * 1024
+
+EXT4_BLOCK_SIZE = 4096
+EXT4_INODE_SIZE = 256
+EXT4_BLOCKS_PER_GROUP = 8 * EXT4_BLOCK_SIZE
+# 前 11 个 inode 为保留 inode（根目录为 2 号），lost+found 为 11 号
+EXT4_FIRST_INO = 11
+# 256 字节 inode 中可用于扩展属性的空间：256 - 128（基础）- 32（i_extra_isize）- 4（魔数）
+EXT4_INLINE_XATTR_SPACE = EXT4_INODE_SIZE - 128 - 32 - 4
+EXT4_FAST_SYMLINK_MAX = 60
+# 单个 extent 最多覆盖 32768 个块，inode 内可直接存放 4 个 extent
+EXT4_EXTENT_MAX_BLOCKS = 32768
+EXT4_INODE_EXTENTS = 4
+EXT4_EXTENTS_PER_BLOCK = (EXT4_BLOCK_SIZE - 12) // 12
+EXT4_LOST_FOUND_BLOCKS = 4
+
+# 相对路径 -> [大小, mtime_ns, mode, 符号链接目标或内容哈希]
+TreeEntries = Dict[str, List[Any]]
+
+
+class TreeUsage:
+    """遍历过程中累计的 ext4 空间占用（以块计），硬链接只计一次"""
+
+    def __init__(self) -> None:
+        self.files = 0
+        self.dirs = 0
+        self.symlinks = 0
+        self.others = 0
+        self.apparent_bytes = 0
+        self.data_blocks = 0
+        self.extent_blocks = 0
+        self.dir_blocks = 0
+        self.symlink_blocks = 0
+        self.xattr_blocks = 0
+        self._seen_inodes: Set[Tuple[int, int]] = set()
+        # 目录 -> 目录项占用的字节数（"." 与 ".." 各 12 字节）
+        self._dirent_bytes: Dict[str, int] = {}
+
+    @property
+    def inodes(self) -> int:
+        return self.files + self.dirs + self.symlinks + self.others
+
+    @property
+    def blocks(self) -> int:
+        return self.data_blocks + self.extent_blocks + self.dir_blocks + self.symlink_blocks + self.xattr_blocks
+
+    def add_dir(self, path: str) -> None:
+        self.dirs += 1
+        self._dirent_bytes[path] = 24
+
+    def add_entry(self, parent: str, name: str, st: os.stat_result, link_target: Optional[str], xattr_bytes: int) -> None:
+        self._dirent_bytes[parent] += (8 + len(os.fsencode(name)) + 3) // 4 * 4
+        if stat.S_ISDIR(st.st_mode):
+            return
+        if st.st_nlink > 1:
+            key = (st.st_dev, st.st_ino)
+            if key in self._seen_inodes:
+                return
+            self._seen_inodes.add(key)
+        if xattr_bytes > EXT4_INLINE_XATTR_SPACE:
+            self.xattr_blocks += 1
+        if stat.S_ISREG(st.st_mode):
+            self.files += 1
+            self.apparent_bytes += st.st_size
+            blocks = -(-st.st_size // EXT4_BLOCK_SIZE)
+            self.data_blocks += blocks
+            extents = -(-blocks // EXT4_EXTENT_MAX_BLOCKS)
+            if extents > EXT4_INODE_EXTENTS:
+                self.extent_blocks += -(-extents // EXT4_EXTENTS_PER_BLOCK)
+        elif stat.S_ISLNK(st.st_mode):
+            self.symlinks += 1
+            if len(os.fsencode(link_target or "")) >= EXT4_FAST_SYMLINK_MAX:
+                self.symlink_blocks += 1
+        else:
+            self.others += 1
+
+    def finish(self) -> None:
+        """目录项全部累计完后换算目录块：超过一个块的目录还需要一个 htree 索引块"""
+        usable = EXT4_BLOCK_SIZE - 12  # 每块末尾的校验项
+        self.dir_blocks = 0
+        for size in self._dirent_bytes.values():
+            blocks = -(-size // usable)
+            self.dir_blocks += blocks + (1 if blocks > 1 else 0)
+
+
+class TreeScan(NamedTuple):
+    entries: TreeEntries
+    usage: TreeUsage
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while True:
+            chunk = fh.read(HASH_BUFFER_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _xattr_bytes(path: str) -> int:
+    """扩展属性在 inode 中占用的字节数；平台不支持时为 0"""
+    if not hasattr(os, "listxattr"):
+        return 0
+    try:
+        total = 0
+        for name in os.listxattr(path, follow_symlinks=False):
+            value = os.getxattr(path, name, follow_symlinks=False)
+            total += 16 + (len(name) + 3) // 4 * 4 + (len(value) + 3) // 4 * 4
+        return total
+    except OSError:
+        return 0
+
+
+def scan_tree(root: Path, hash_files: bool = False, xattrs: bool = True) -> TreeScan:
+    """
+    用 os.scandir 单次遍历目录树。
+
+    每一项记录大小、mtime 与权限（符号链接另记目标，hash_files=True 时普通文件另记内容哈希），
+    同一次 stat 的结果同时用于累计 ext4 空间占用，供增量打包与大小估算共用。
+    """
+    entries: TreeEntries = {}
+    usage = TreeUsage()
+    usage.add_dir("")
+    stack = [(str(root), "")]
+    while stack:
+        path, prefix = stack.pop()
+        with os.scandir(path) as it:
+            for entry in it:
+                rel = prefix + entry.name
+                st = entry.stat(follow_symlinks=False)
+                extra: Optional[str] = None
+                if stat.S_ISDIR(st.st_mode):
+                    stack.append((entry.path, rel + "/"))
+                    usage.add_dir(rel)
+                elif stat.S_ISLNK(st.st_mode):
+                    extra = os.readlink(entry.path)
+                elif hash_files and stat.S_ISREG(st.st_mode):
+                    extra = file_hash(entry.path)
+                xattr_bytes = _xattr_bytes(entry.path) if xattrs else 0
+                usage.add_entry(prefix.rstrip("/"), entry.name, st, extra if stat.S_ISLNK(st.st_mode) else None, xattr_bytes)
+                entries[rel] = [st.st_size, st.st_mtime_ns, st.st_mode, extra]
+    usage.finish()
+    return TreeScan(entries, usage)
+
+
+# ---------------------------------------------------------------------- #
+# ext4 大小估算
+# ---------------------------------------------------------------------- #
+class Ext4Estimate(NamedTuple):
+    """min_bytes 为放得下内容的最小镜像，size_bytes 为加上余量后的建议大小（均按 1MB 对齐）"""
+
+    min_bytes: int
+    size_bytes: int
+    inodes: int
+    data_blocks: int
+    metadata_blocks: int
+    journal_blocks: int
+
+
+def ext4_journal_blocks(total_blocks: int) -> int:
+    """与 e2fsprogs ext2fs_default_journal_size() 一致的默认日志大小"""
+    if total_blocks < 2048:
+        return 0
+    if total_blocks < 32768:
+        return 1024
+    if total_blocks < 256 * 1024:
+        return 4096
+    if total_blocks < 512 * 1024:
+        return 8192
+    if total_blocks < 4096 * 1024:
+        return 16384
+    if total_blocks < 8192 * 1024:
+        return 32768
+    return 65536
+
+
+def has_super_backup(group: int) -> bool:
+    """sparse_super：0、1 以及 3/5/7 的幂次组保存超级块备份"""
+    if group <= 1:
+        return True
+    for base in (3, 5, 7):
+        value = base
+        while value < group:
+            value *= base
+        if value == group:
+            return True
+    return False
+
+
+def ext4_overhead(total_blocks: int, inodes: int, journal: bool, resize_inode: bool = True) -> Tuple[int, int]:
+    """给定总块数与 inode 数，返回 (元数据块数, 日志块数)；resize_inode=False 时不预留扩容用的 GDT 块"""
+    groups = max(1, -(-total_blocks // EXT4_BLOCKS_PER_GROUP))
+    inodes_per_block = EXT4_BLOCK_SIZE // EXT4_INODE_SIZE
+    per_group = -(-inodes // groups)
+    per_group = -(-per_group // inodes_per_block) * inodes_per_block
+    table_blocks = per_group // inodes_per_block
+
+    desc_per_block = EXT4_BLOCK_SIZE // 64
+    gdt_blocks = -(-groups // desc_per_block)
+    # 为在线扩容预留的 GDT 块（可扩展到 1024 倍），上限为每块的地址数
+    max_groups = -(-min(total_blocks * 1024, 2 ** 32 - 1) // EXT4_BLOCKS_PER_GROUP)
+    reserved_gdt = min(max(-(-max_groups // desc_per_block) - gdt_blocks, 0), EXT4_BLOCK_SIZE // 4) if resize_inode else 0
+
+    backups = sum(1 for group in range(groups) if has_super_backup(group))
+    metadata = backups * (1 + gdt_blocks + reserved_gdt) + groups * (2 + table_blocks)
+    journal_blocks = ext4_journal_blocks(total_blocks) if journal else 0
+    return metadata, journal_blocks
+
+
+def estimate_ext4(
+    usage: TreeUsage, headroom: float = 0.1, journal: bool = True, resize_inode: bool = True
+) -> Ext4Estimate:
+    """
+    估算容纳目录内容所需的 ext4 镜像大小。
+
+    数据块、目录块、扩展属性块、extent 索引块来自遍历时的累计值；
+    超级块备份、组描述符、位图、inode 表与日志随镜像大小变化，迭代到收敛。
+    headroom 为在最小值之上追加的比例（同时作用于块数与 inode 数）；
+    只读镜像不带日志与 resize_inode 时分别传入 journal=False、resize_inode=False。
+    """
+    content_blocks = usage.blocks + EXT4_LOST_FOUND_BLOCKS
+    inodes = usage.inodes + EXT4_FIRST_INO
+
+    def fit(blocks_needed: int, inode_count: int) -> Tuple[int, int, int]:
+        total = blocks_needed
+        while True:
+            metadata, journal_blocks = ext4_overhead(total, inode_count, journal, resize_inode)
+            required = blocks_needed + metadata + journal_blocks
+            if required <= total:
+                return total, metadata, journal_blocks
+            total = required
+
+    mb_blocks = 1024 * 1024 // EXT4_BLOCK_SIZE
+    min_total, metadata, journal_blocks = fit(content_blocks, inodes)
+    min_total = -(-min_total // mb_blocks) * mb_blocks
+
+    want_inodes = math.ceil(inodes * (1 + headroom))
+    size_total, _, _ = fit(math.ceil(content_blocks * (1 + headroom)), want_inodes)
+    size_total = max(-(-size_total // mb_blocks) * mb_blocks, min_total)
+
+    return Ext4Estimate(
+        min_bytes=min_total * EXT4_BLOCK_SIZE,
+        size_bytes=size_total * EXT4_BLOCK_SIZE,
+        inodes=want_inodes,
+        data_blocks=content_blocks,
+        metadata_blocks=metadata,
+        journal_blocks=journal_blocks,
+    )
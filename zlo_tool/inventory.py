@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.inventory
+项目输入清单：单次遍历项目目录，按魔数识别镜像类型并缓存识别结果
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from .blockio import (
+    CHUNK_TYPE_DONT_CARE,
+    CHUNK_TYPE_FILL,
+    CHUNK_TYPE_RAW,
+    SPARSE_CHUNK_HEADER,
+    SPARSE_HEADER,
+    SPARSE_MAGIC,
+)
+from .lpmeta import LP_METADATA_GEOMETRY_MAGIC, LP_PARTITION_RESERVED_BYTES
+from .payload import PAYLOAD_MAGIC
+
+# 识别需要的镜像头部长度：文件系统超级块在前 4KB，LP geometry 紧随其后
+INVENTORY_HEAD_SIZE = 8192
+# 分解/打包的输出目录（zlo_out、zlo_pack 等）不属于项目输入
+OUTPUT_DIR_PREFIX = "zlo_"
+
+FS_KINDS = ("ext4", "erofs", "f2fs", "squashfs")
+# super 与无法识别的 *.img 也按镜像处理
+IMAGE_KINDS = FS_KINDS + ("super", "image")
+
+
+class InventoryEntry(NamedTuple):
+    """
+    项目中的一个输入文件。
+
+    kind 为内容类型：ext4 / erofs / f2fs / squashfs / super / image（未识别的 *.img）/
+    payload / dat（*.new.dat）/ brotli（*.br）/ transfer_list / other；
+    sparse 表示外层为 Android 稀疏格式；pair 为 dat 与 dat.br 对应的 transfer.list（存在时）。
+    """
+
+    path: Path
+    kind: str
+    sparse: bool
+    size: int
+    pair: Optional[Path]
+
+    @property
+    def fs(self) -> Optional[str]:
+        return self.kind if self.kind in FS_KINDS else None
+
+
+# (st_dev, st_ino, 大小, mtime_ns) -> (kind, sparse)；清单之外单独识别的文件（如显式指定的路径）在进程内共享
+_classify_cache: Dict[Tuple[int, int, int, int], Tuple[str, bool]] = {}
+_classify_lock = threading.Lock()
+
+
+def filesystem_from_header(header: bytes) -> Optional[str]:
+    """根据镜像前 4KB 中的魔数判断文件系统类型"""
+    # EROFS magic: 0xE0F5E1E2 at offset 1024
+    if len(header) >= 1028:
+        erofs_magic = int.from_bytes(header[1024:1028], "little")
+        if erofs_magic == 0xE0F5E1E2:
+            return "erofs"
+
+    # EXT4 magic: 0xEF53 at offset 0x438 (1080)
+    if len(header) >= 1082:
+        ext_magic = int.from_bytes(header[1080:1082], "little")
+        if ext_magic == 0xEF53:
+            return "ext4"
+
+    # F2FS magic: 0xF2F52010 at offset 0x400 (1024)
+    if len(header) >= 1028:
+        f2fs_magic = int.from_bytes(header[1024:1028], "little")
+        if f2fs_magic == 0xF2F52010:
+            return "f2fs"
+
+    # SquashFS magic: "hsqs" at offset 0
+    if header[:4] == b"hsqs" or header[:4] == b"sqsh":
+        return "squashfs"
+    return None
+
+
+def _sparse_head(fh: BinaryIO, header: bytes, length: int) -> bytes:
+    """按 chunk 顺序拼出稀疏镜像展开后的前 length 字节，只读取用到的 chunk"""
+    _magic, _major, _minor, file_hdr_sz, chunk_hdr_sz, blk_sz, _blocks, total_chunks, _crc = (
+        SPARSE_HEADER.unpack_from(header)
+    )
+    parts: List[bytes] = []
+    have = 0
+    pos = file_hdr_sz
+    for _ in range(total_chunks):
+        if have >= length:
+            break
+        fh.seek(pos)
+        raw = fh.read(SPARSE_CHUNK_HEADER.size)
+        if len(raw) < SPARSE_CHUNK_HEADER.size:
+            break
+        chunk_type, _reserved, chunk_blocks, total_sz = SPARSE_CHUNK_HEADER.unpack(raw)
+        want = min(chunk_blocks * blk_sz, length - have)
+        fh.seek(pos + chunk_hdr_sz)
+        if chunk_type == CHUNK_TYPE_RAW:
+            data = fh.read(want)
+        elif chunk_type == CHUNK_TYPE_FILL:
+            data = (fh.read(4) * (want // 4 + 1))[:want]
+        elif chunk_type == CHUNK_TYPE_DONT_CARE:
+            data = bytes(want)
+        else:
+            data = b""
+        parts.append(data)
+        have += len(data)
+        pos += total_sz
+    return b"".join(parts)
+
+
+def _classify_content(path: Path) -> Tuple[str, bool]:
+    """读取文件头部识别内容类型，返回 (kind, sparse)"""
+    try:
+        with path.open("rb") as fh:
+            head = fh.read(INVENTORY_HEAD_SIZE)
+            if head[:4] == PAYLOAD_MAGIC:
+                return "payload", False
+            sparse = len(head) >= SPARSE_HEADER.size and int.from_bytes(head[:4], "little") == SPARSE_MAGIC
+            if sparse:
+                head = _sparse_head(fh, head, INVENTORY_HEAD_SIZE)
+    except OSError:
+        return "other", False
+
+    fs_type = filesystem_from_header(head)
+    if fs_type:
+        return fs_type, sparse
+    geometry = head[LP_PARTITION_RESERVED_BYTES:LP_PARTITION_RESERVED_BYTES + 4]
+    if len(geometry) == 4 and int.from_bytes(geometry, "little") == LP_METADATA_GEOMETRY_MAGIC:
+        return "super", sparse
+    if sparse or path.suffix.lower() == ".img":
+        return "image", sparse
+    return "other", False
+
+
+def _stat_key(st: os.stat_result) -> str:
+    """持久化缓存的键：(inode, 大小, mtime_ns)"""
+    return f"{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def classify(
+    path: Path,
+    st: Optional[os.stat_result] = None,
+    known: Optional[Dict[str, List]] = None,
+) -> InventoryEntry:
+    """
+    识别单个文件；按名称即可确定的类型不读取内容，其余按 (inode, 大小, mtime) 缓存魔数识别结果。
+    known 为 ProjectInventory 的识别缓存，未给出时使用进程内缓存。
+    """
+    path = Path(path)
+    st = st or path.stat()
+    name = path.name.lower()
+    pair: Optional[Path] = None
+    if name.endswith(".br"):
+        kind, sparse = "brotli", False
+        if name.endswith(".new.dat.br"):
+            pair = path.with_name(f"{path.name[: -len('.new.dat.br')]}.transfer.list")
+    elif name.endswith(".new.dat"):
+        kind, sparse = "dat", False
+        pair = path.with_name(f"{path.name[: -len('.new.dat')]}.transfer.list")
+    elif name.endswith(".transfer.list"):
+        kind, sparse = "transfer_list", False
+    elif known is not None:
+        stat_key = _stat_key(st)
+        cached = known.get(stat_key)
+        if cached is None:
+            cached = known[stat_key] = list(_classify_content(path))
+        kind, sparse = cached
+    else:
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with _classify_lock:
+            cached = _classify_cache.get(key)
+        if cached is None:
+            cached = _classify_content(path)
+            with _classify_lock:
+                _classify_cache[key] = cached
+        kind, sparse = cached
+    if pair is not None and not pair.is_file():
+        pair = None
+    return InventoryEntry(path, kind, sparse, st.st_size, pair)
+
+
+class ProjectInventory:
+    """
+    项目目录的输入清单。
+
+    用 os.scandir 遍历目录树，跳过 zlo_* 输出目录与符号链接目录；各操作从同一份清单中按类型取目标，
+    不再各自 rglob。recursive=False 时只扫描根目录这一层。
+    魔数识别结果按 (inode, 大小, mtime) 缓存；给出 cache_path 时持久化到该文件（位于结果缓存目录下，
+    不在被扫描的目录中写入任何文件）。refresh() 只重新列出 mtime 变化的目录、只重新识别 stat 变化的文件，
+    供 runner 在多次操作间复用同一份清单。
+    """
+
+    def __init__(self, root: Path, recursive: bool = True, cache_path: Optional[Path] = None) -> None:
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._entries: Dict[Path, InventoryEntry] = {}
+        # 文件路径 -> 识别时的 stat 键；目录 -> (扫描时的 mtime_ns, 子目录)
+        self._stat_keys: Dict[Path, str] = {}
+        self._dirs: Dict[Path, Tuple[int, List[Path]]] = {}
+        self._cache_path = cache_path
+        self._known = self._load_known()
+        self._saved = dict(self._known)
+        self.refresh(recursive)
+
+    def refresh(self, recursive: bool = True) -> None:
+        """与磁盘同步；recursive=False 时只同步根目录这一层"""
+        with self._lock:
+            visited: List[Path] = []
+            stack = [self.root]
+            while stack:
+                current = stack.pop()
+                try:
+                    mtime_ns = os.stat(current).st_mtime_ns
+                except OSError:
+                    continue
+                scanned = self._dirs.get(current)
+                if scanned is None or scanned[0] != mtime_ns:
+                    subdirs = self._scan_dir(current, mtime_ns)
+                else:
+                    subdirs = scanned[1]
+                    self._restat_files(current)
+                visited.append(current)
+                if recursive:
+                    stack.extend(subdirs)
+            if recursive:
+                self._forget_dirs(set(self._dirs) - set(visited))
+            self._save_known(prune=recursive)
+
+    def _scan_dir(self, current: Path, mtime_ns: int) -> List[Path]:
+        for path in [path for path in self._entries if path.parent == current]:
+            self._drop(path)
+        subdirs: List[Path] = []
+        try:
+            with os.scandir(current) as it:
+                for item in it:
+                    if item.is_dir(follow_symlinks=False):
+                        if not item.name.startswith(OUTPUT_DIR_PREFIX):
+                            subdirs.append(Path(item.path))
+                    elif item.is_file():
+                        try:
+                            self._add(Path(item.path), item.stat())
+                        except OSError:
+                            continue
+        except OSError:
+            pass
+        self._dirs[current] = (mtime_ns, subdirs)
+        return subdirs
+
+    def _restat_files(self, current: Path) -> None:
+        """目录未变化时文件仍可能被原地改写：stat 键不同的文件重新识别"""
+        for path in [path for path in self._entries if path.parent == current]:
+            try:
+                st = path.stat()
+            except OSError:
+                self._drop(path)
+                continue
+            if _stat_key(st) != self._stat_keys.get(path):
+                self._add(path, st)
+
+    def _add(self, path: Path, st: os.stat_result) -> None:
+        self._entries[path] = classify(path, st, self._known)
+        self._stat_keys[path] = _stat_key(st)
+
+    def _drop(self, path: Path) -> None:
+        self._entries.pop(path, None)
+        self._stat_keys.pop(path, None)
+
+    def _forget_dirs(self, gone: Iterable[Path]) -> None:
+        for directory in gone:
+            del self._dirs[directory]
+            for path in [path for path in self._entries if path.parent == directory]:
+                self._drop(path)
+
+    def _load_known(self) -> Dict[str, List]:
+        if self._cache_path is None:
+            return {}
+        try:
+            with self._cache_path.open("r", encoding="utf-8") as fh:
+                known = json.load(fh)
+            return known if isinstance(known, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_known(self, prune: bool) -> None:
+        """识别结果有变化时写回；完整扫描后只保留仍存在的文件"""
+        current = {key: self._known[key] for key in self._stat_keys.values() if key in self._known}
+        known = current if prune else {**self._known, **current}
+        self._known = known
+        if self._cache_path is None or known == self._saved:
+            return
+        tmp = self._cache_path.with_name(f".{self._cache_path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            tmp.parent.mkdir(parents=True, exist_ok=True)
+            with tmp.open("w", encoding="utf-8") as fh:
+                json.dump(known, fh)
+            os.replace(tmp, self._cache_path)
+            self._saved = dict(known)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+
+    def get(self, path: Path) -> InventoryEntry:
+        """取清单中的条目；不在清单中（例如显式指定的项目外文件）时单独识别"""
+        path = Path(path)
+        entry = self._entries.get(path)
+        return entry if entry is not None else classify(path)
+
+    def entries(self, *kinds: str, top_level: bool = False) -> List[InventoryEntry]:
+        """按类型筛选，按路径排序；top_level=True 时只取项目根目录下的文件"""
+        return sorted(
+            (
+                entry for entry in self._entries.values()
+                if entry.kind in kinds and (not top_level or entry.path.parent == self.root)
+            ),
+            key=lambda entry: entry.path,
+        )
+
+    def images(self, top_level: bool = False) -> List[InventoryEntry]:
+        return self.entries(*IMAGE_KINDS, top_level=top_level)
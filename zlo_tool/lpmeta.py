@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.lpmeta
+super 动态分区（liblp）元数据解析与生成
+"""
+from __future__ import annotations
+
+import hashlib
+import struct
+from typing import BinaryIO, Dict, List, NamedTuple, Optional
+
+LP_SECTOR_SIZE = 512
+LP_PARTITION_RESERVED_BYTES = 4096
+LP_METADATA_GEOMETRY_SIZE = 4096
+LP_METADATA_GEOMETRY_MAGIC = 0x616C4467
+LP_METADATA_HEADER_MAGIC = 0x414C5030
+
+LP_TARGET_TYPE_LINEAR = 0
+LP_TARGET_TYPE_ZERO = 1
+
+LP_PARTITION_ATTR_READONLY = 1 << 0
+
+GEOMETRY = struct.Struct("<II32sIII")
+TABLE_DESCRIPTOR = struct.Struct("<III")
+# magic, major, minor, header_size, header_checksum, tables_size, tables_checksum
+HEADER_PREFIX = struct.Struct("<IHHI32sI32s")
+PARTITION_ENTRY = struct.Struct("<36sIIII")
+EXTENT_ENTRY = struct.Struct("<QIQI")
+GROUP_ENTRY = struct.Struct("<36sIQ")
+BLOCK_DEVICE_ENTRY = struct.Struct("<QIIQ36sI")
+
+
+class LpMetadataError(ValueError):
+    pass
+
+
+class LpGeometry(NamedTuple):
+    metadata_max_size: int
+    metadata_slot_count: int
+    logical_block_size: int
+
+
+class LpExtent(NamedTuple):
+    num_sectors: int
+    target_type: int
+    target_data: int
+    target_source: int
+
+    @property
+    def size(self) -> int:
+        return self.num_sectors * LP_SECTOR_SIZE
+
+
+class LpGroup(NamedTuple):
+    name: str
+    flags: int
+    maximum_size: int
+
+
+class LpBlockDevice(NamedTuple):
+    first_logical_sector: int
+    alignment: int
+    alignment_offset: int
+    size: int
+    partition_name: str
+    flags: int
+
+
+class LpPartition(NamedTuple):
+    name: str
+    attributes: int
+    group: str
+    extents: List[LpExtent]
+
+    @property
+    def size(self) -> int:
+        return sum(ext.size for ext in self.extents)
+
+
+def _cstr(raw: bytes) -> str:
+    return raw.split(b"\0", 1)[0].decode("utf-8", errors="replace")
+
+
+def _read_at(fh: BinaryIO, offset: int, size: int) -> bytes:
+    fh.seek(offset)
+    data = fh.read(size)
+    if len(data) < size:
+        raise LpMetadataError("super 镜像被截断")
+    return data
+
+
+class LpMetadata:
+    """
+    super 镜像中的 LP 元数据（默认读取 slot 0）。
+
+    ``fh`` 只需支持 seek/read，RAW 文件与 ``SparseImage`` 均可直接传入，
+    只会读取头部几个 4K 块。
+    """
+
+    def __init__(self, fh: BinaryIO, slot: int = 0) -> None:
+        self.geometry = self._read_geometry(fh)
+        if slot >= self.geometry.metadata_slot_count:
+            raise LpMetadataError(f"slot {slot} 超出范围（共 {self.geometry.metadata_slot_count} 个）")
+        self.header_version = (0, 0)
+        self.header_flags = 0
+        self.partitions: List[LpPartition] = []
+        self.groups: List[LpGroup] = []
+        self.block_devices: List[LpBlockDevice] = []
+        self._read_metadata(fh, slot)
+
+    # ------------------------------------------------------------------ #
+    def _read_geometry(self, fh: BinaryIO) -> LpGeometry:
+        # 主 geometry 校验失败时退回备份
+        for offset in (LP_PARTITION_RESERVED_BYTES, LP_PARTITION_RESERVED_BYTES + LP_METADATA_GEOMETRY_SIZE):
+            raw = _read_at(fh, offset, GEOMETRY.size)
+            magic, struct_size, checksum, max_size, slot_count, block_size = GEOMETRY.unpack(raw)
+            if magic != LP_METADATA_GEOMETRY_MAGIC or struct_size != GEOMETRY.size:
+                continue
+            zeroed = raw[:8] + bytes(32) + raw[40:]
+            if hashlib.sha256(zeroed).digest() != checksum:
+                continue
+            return LpGeometry(max_size, slot_count, block_size)
+        raise LpMetadataError("未找到有效的 LP geometry（不是 super 镜像？）")
+
+    def _metadata_offsets(self, slot: int) -> List[int]:
+        base = LP_PARTITION_RESERVED_BYTES + 2 * LP_METADATA_GEOMETRY_SIZE
+        primary = base + slot * self.geometry.metadata_max_size
+        backup = base + (self.geometry.metadata_slot_count + slot) * self.geometry.metadata_max_size
+        return [primary, backup]
+
+    def _read_metadata(self, fh: BinaryIO, slot: int) -> None:
+        error = "LP 元数据头无效"
+        for offset in self._metadata_offsets(slot):
+            prefix = _read_at(fh, offset, HEADER_PREFIX.size)
+            magic, major, minor, header_size, header_sum, tables_size, tables_sum = HEADER_PREFIX.unpack(prefix)
+            if magic != LP_METADATA_HEADER_MAGIC or major != 10:
+                continue
+            header = _read_at(fh, offset, header_size)
+            zeroed = header[:12] + bytes(32) + header[44:]
+            if hashlib.sha256(zeroed).digest() != header_sum:
+                error = "LP 元数据头校验失败"
+                continue
+            tables = _read_at(fh, offset + header_size, tables_size)
+            if hashlib.sha256(tables).digest() != tables_sum:
+                error = "LP 元数据表校验失败"
+                continue
+            self.header_version = (major, minor)
+            descriptors = [
+                TABLE_DESCRIPTOR.unpack_from(header, HEADER_PREFIX.size + i * TABLE_DESCRIPTOR.size) for i in range(4)
+            ]
+            if header_size >= HEADER_PREFIX.size + 4 * TABLE_DESCRIPTOR.size + 4:
+                (self.header_flags,) = struct.unpack_from("<I", header, HEADER_PREFIX.size + 4 * TABLE_DESCRIPTOR.size)
+            self._parse_tables(tables, descriptors)
+            return
+        raise LpMetadataError(error)
+
+    def _parse_tables(self, tables: bytes, descriptors: List[tuple]) -> None:
+        def entries(index: int, layout: struct.Struct) -> List[tuple]:
+            offset, count, entry_size = descriptors[index]
+            if count and entry_size < layout.size:
+                raise LpMetadataError("LP 元数据表项长度异常")
+            return [layout.unpack_from(tables, offset + i * entry_size) for i in range(count)]
+
+        extents = [LpExtent(*row) for row in entries(1, EXTENT_ENTRY)]
+        self.groups = [LpGroup(_cstr(name), flags, max_size) for name, flags, max_size in entries(2, GROUP_ENTRY)]
+        self.block_devices = [
+            LpBlockDevice(first, align, align_off, size, _cstr(name), flags)
+            for first, align, align_off, size, name, flags in entries(3, BLOCK_DEVICE_ENTRY)
+        ]
+        for name, attrs, first_extent, num_extents, group_index in entries(0, PARTITION_ENTRY):
+            if first_extent + num_extents > len(extents) or group_index >= len(self.groups):
+                raise LpMetadataError(f"分区 {_cstr(name)} 的表项越界")
+            self.partitions.append(LpPartition(
+                _cstr(name), attrs, self.groups[group_index].name, extents[first_extent:first_extent + num_extents],
+            ))
+
+    # ------------------------------------------------------------------ #
+    @property
+    def device_size(self) -> int:
+        return sum(dev.size for dev in self.block_devices)
+
+    def partition_map(self) -> Dict[str, LpPartition]:
+        return {part.name: part for part in self.partitions}
+
+    def find(self, name: str) -> Optional[LpPartition]:
+        return self.partition_map().get(name)
+
+
+# ---------------------------------------------------------------------- #
+# 元数据生成（与 lpmake 默认输出一致：v10.0 头部，所有 slot 内容相同）
+# ---------------------------------------------------------------------- #
+LP_DEFAULT_PARTITION_ALIGNMENT = 1024 * 1024
+LP_HEADER_SIZE_V1_0 = 128
+
+
+class LpPartitionSpec(NamedTuple):
+    name: str
+    size: int
+    group: str = "default"
+    attributes: int = LP_PARTITION_ATTR_READONLY
+
+
+class LpPlacement(NamedTuple):
+    """分区在 super 中的位置（字节）"""
+
+    name: str
+    offset: int
+    size: int
+
+
+def _align_up(value: int, alignment: int) -> int:
+    return (value + alignment - 1) // alignment * alignment
+
+
+def metadata_region_size(metadata_max_size: int, slot_count: int) -> int:
+    """super 头部保留区 + 两份 geometry + 主/备元数据的总字节数"""
+    return LP_PARTITION_RESERVED_BYTES + 2 * (LP_METADATA_GEOMETRY_SIZE + metadata_max_size * slot_count)
+
+
+class LpBuilder:
+    """
+    生成 super 的 LP 元数据并为分区分配 extent。
+
+    分区按加入顺序依次放置，每个分区的起点按 alignment 对齐；
+    ``header_region()`` 返回从偏移 0 开始需要写入的全部元数据字节。
+    """
+
+    def __init__(
+        self,
+        device_size: int,
+        metadata_max_size: int = 65536,
+        slot_count: int = 2,
+        alignment: int = LP_DEFAULT_PARTITION_ALIGNMENT,
+        block_size: int = 4096,
+        super_name: str = "super",
+    ) -> None:
+        self.device_size = device_size
+        self.metadata_max_size = metadata_max_size
+        self.slot_count = slot_count
+        self.alignment = alignment
+        self.block_size = block_size
+        self.super_name = super_name
+        self.groups: List[LpGroup] = [LpGroup("default", 0, 0)]
+        self.partitions: List[LpPartitionSpec] = []
+
+        reserved = metadata_region_size(metadata_max_size, slot_count)
+        self.first_logical_sector = _align_up(reserved, alignment) // LP_SECTOR_SIZE
+        # device_size 为 0 表示稍后由 fit_device_size() 确定
+        if device_size and self.first_logical_sector * LP_SECTOR_SIZE >= device_size:
+            raise LpMetadataError("设备大小不足以容纳 LP 元数据")
+
+    @property
+    def first_logical_offset(self) -> int:
+        return self.first_logical_sector * LP_SECTOR_SIZE
+
+    def add_group(self, name: str, maximum_size: int = 0) -> None:
+        if any(group.name == name for group in self.groups):
+            raise LpMetadataError(f"分区组重复：{name}")
+        self.groups.append(LpGroup(name, 0, maximum_size))
+
+    def add_partition(self, spec: LpPartitionSpec) -> None:
+        if any(part.name == spec.name for part in self.partitions):
+            raise LpMetadataError(f"分区重复：{spec.name}")
+        if not any(group.name == spec.group for group in self.groups):
+            raise LpMetadataError(f"分区 {spec.name} 所属组不存在：{spec.group}")
+        self.partitions.append(spec._replace(size=_align_up(spec.size, self.block_size)))
+
+    # ------------------------------------------------------------------ #
+    def layout(self) -> List[LpPlacement]:
+        placements: List[LpPlacement] = []
+        cursor = self.first_logical_offset
+        for part in self.partitions:
+            if not part.size:
+                placements.append(LpPlacement(part.name, 0, 0))
+                continue
+            start = _align_up(cursor, self.alignment)
+            if self.device_size and start + part.size > self.device_size:
+                raise LpMetadataError(f"设备空间不足：分区 {part.name} 需要到 {start + part.size} 字节")
+            placements.append(LpPlacement(part.name, start, part.size))
+            cursor = start + part.size
+        usage = self.group_usage()
+        for group in self.groups:
+            if group.maximum_size and usage[group.name] > group.maximum_size:
+                raise LpMetadataError(f"分区组 {group.name} 超出上限：{usage[group.name]} > {group.maximum_size}")
+        if self.device_size:
+            budgets = sum(group.maximum_size for group in self.groups)
+            if self.first_logical_offset + budgets > self.device_size:
+                raise LpMetadataError(f"分区组上限之和 {budgets} 字节超出设备可用空间")
+        return placements
+
+    def group_usage(self) -> Dict[str, int]:
+        usage = {group.name: 0 for group in self.groups}
+        for part in self.partitions:
+            usage[part.group] += part.size
+        return usage
+
+    def minimum_device_size(self) -> int:
+        """
+        容纳当前布局所需的最小设备大小（块对齐）。
+
+        除了最后一个分区的结束位置，还要保证所有组的上限之和能放进设备，
+        A/B 布局中 _b 组此时虽为空，也需预留与上限相同的空间。
+        """
+        placements = self.layout()
+        end = max((p.offset + p.size for p in placements if p.size), default=self.first_logical_offset)
+        usage = self.group_usage()
+        budgets = sum(max(group.maximum_size, usage[group.name]) for group in self.groups)
+        return _align_up(max(end, self.first_logical_offset + budgets), self.block_size)
+
+    def fit_device_size(self) -> int:
+        self.device_size = self.minimum_device_size()
+        return self.device_size
+
+    def serialize_metadata(self) -> bytes:
+        if not self.device_size:
+            raise LpMetadataError("尚未确定设备大小")
+        placements = {p.name: p for p in self.layout()}
+        group_index = {group.name: i for i, group in enumerate(self.groups)}
+
+        partition_table = bytearray()
+        extent_table = bytearray()
+        extent_count = 0
+        for part in self.partitions:
+            place = placements[part.name]
+            num_extents = 1 if place.size else 0
+            partition_table += PARTITION_ENTRY.pack(
+                part.name.encode("utf-8"), part.attributes, extent_count, num_extents, group_index[part.group],
+            )
+            if num_extents:
+                extent_table += EXTENT_ENTRY.pack(
+                    place.size // LP_SECTOR_SIZE, LP_TARGET_TYPE_LINEAR, place.offset // LP_SECTOR_SIZE, 0,
+                )
+                extent_count += 1
+        group_table = b"".join(
+            GROUP_ENTRY.pack(group.name.encode("utf-8"), group.flags, group.maximum_size) for group in self.groups
+        )
+        device_table = BLOCK_DEVICE_ENTRY.pack(
+            self.first_logical_sector, self.alignment, 0, self.device_size, self.super_name.encode("utf-8"), 0,
+        )
+
+        tables = bytes(partition_table) + bytes(extent_table) + group_table + device_table
+        descriptors = b""
+        offset = 0
+        for table, layout, count in (
+            (partition_table, PARTITION_ENTRY, len(self.partitions)),
+            (extent_table, EXTENT_ENTRY, extent_count),
+            (group_table, GROUP_ENTRY, len(self.groups)),
+            (device_table, BLOCK_DEVICE_ENTRY, 1),
+        ):
+            descriptors += TABLE_DESCRIPTOR.pack(offset, count, layout.size)
+            offset += len(table)
+
+        def header(checksum: bytes) -> bytes:
+            return HEADER_PREFIX.pack(
+                LP_METADATA_HEADER_MAGIC, 10, 0, LP_HEADER_SIZE_V1_0, checksum,
+                len(tables), hashlib.sha256(tables).digest(),
+            ) + descriptors
+
+        blob = header(hashlib.sha256(header(bytes(32))).digest()) + tables
+        if len(blob) > self.metadata_max_size:
+            raise LpMetadataError(f"元数据 {len(blob)} 字节超过 metadata-size {self.metadata_max_size}")
+        return blob
+
+    def serialize_geometry(self) -> bytes:
+        def pack(checksum: bytes) -> bytes:
+            return GEOMETRY.pack(
+                LP_METADATA_GEOMETRY_MAGIC, GEOMETRY.size, checksum,
+                self.metadata_max_size, self.slot_count, self.block_size,
+            )
+
+        raw = pack(hashlib.sha256(pack(bytes(32))).digest())
+        return raw + bytes(LP_METADATA_GEOMETRY_SIZE - len(raw))
+
+    def header_region(self) -> bytes:
+        """偏移 0 起的保留区、geometry 与全部 slot 的主/备元数据"""
+        geometry = self.serialize_geometry()
+        blob = self.serialize_metadata()
+        slot = blob + bytes(self.metadata_max_size - len(blob))
+        return bytes(LP_PARTITION_RESERVED_BYTES) + geometry * 2 + slot * (2 * self.slot_count)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.manifest
+分区目录清单：记录打包时的文件状态，用于增量打包
+"""
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .fstree import TreeEntries
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+class PackManifest:
+    """
+    单个分区的打包清单，保存为 zlo_pack/<分区名>.manifest.json。
+
+    ``options`` 记录影响镜像内容的打包参数，``output`` 记录生成的镜像及其状态；
+    目录内容、参数与镜像本身均未变化时可直接复用上次的镜像。
+    """
+
+    def __init__(self, options: Dict[str, Any], entries: TreeEntries, output: str = "", output_stat: Any = None):
+        self.options = options
+        self.entries = entries
+        self.output = output
+        self.output_stat = output_stat
+
+    @staticmethod
+    def path_for(pack_dir: Path, part_name: str) -> Path:
+        return pack_dir / f"{part_name}{MANIFEST_SUFFIX}"
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["PackManifest"]:
+        try:
+            with path.open("r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+        return cls(data["options"], data["entries"], data["output"], data["output_stat"])
+
+    def save(self, path: Path) -> None:
+        tmp = path.with_name(f".{path.name}.tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "options": self.options,
+                "output": self.output,
+                "output_stat": self.output_stat,
+                "entries": self.entries,
+            }, fh, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def record_output(self, image: Path) -> None:
+        st = image.stat()
+        self.output = image.name
+        self.output_stat = [st.st_size, st.st_mtime_ns]
+
+    def output_intact(self, pack_dir: Path) -> bool:
+        """上次生成的镜像仍在且未被改动"""
+        if not self.output:
+            return False
+        try:
+            st = (pack_dir / self.output).stat()
+        except OSError:
+            return False
+        return [st.st_size, st.st_mtime_ns] == self.output_stat
+
+    def diff(self, entries: TreeEntries) -> List[str]:
+        """与当前目录状态比较，返回发生变化的相对路径（新增、删除或修改）"""
+        changed = [rel for rel, item in entries.items() if self.entries.get(rel) != item]
+        changed += [rel for rel in self.entries if rel not in entries]
+        return sorted(changed)
@@ -4,24 +4,195 @@
 zlo_tool.ops
 镜像操作调度模块 - 跨平台封装各类分解/打包流程
 """
+import collections
+import contextlib
+import hashlib
+import io
+import json
+import lzma
 import os
 import re
 import shutil
+import stat
 import subprocess
 import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Callable, Dict, Iterable, List, Optional, Tuple
-
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, TypeVar
+
+try:
+    import brotli as brotli_lib
+except ImportError:  # 可选依赖：未安装时改用 brotli 命令行
+    brotli_lib = None
+
+from .blockio import (
+    CHUNK_TYPE_DONT_CARE,
+    CHUNK_TYPE_FILL,
+    COPY_BUFFER_SIZE,
+    SPARSE_MAGIC,
+    MappedFile,
+    clone_file,
+    copy_range,
+    disk_usage,
+    pread,
+    write_nonzero,
+)
+from .cache import ResultCache
 from .env import ToolEnvironment
+from .erofs import ErofsError, ErofsImage
+from .ext4 import RO_COMPAT_SHARED_BLOCKS, Ext4Error, Ext4Image, extract_ext4
+from .fileindex import INDEX_DB_NAME, FileIndex, IndexedFile
+from .fstree import EXT4_BLOCK_SIZE, Ext4Estimate, TreeScan, estimate_ext4, ext4_overhead, file_hash, scan_tree
+from .inventory import FS_KINDS, ProjectInventory, classify, filesystem_from_header
+from .lpmeta import (
+    LP_DEFAULT_PARTITION_ALIGNMENT,
+    LP_SECTOR_SIZE,
+    LP_TARGET_TYPE_LINEAR,
+    LP_TARGET_TYPE_ZERO,
+    LpBuilder,
+    LpMetadata,
+    LpMetadataError,
+    LpPartition,
+    LpPartitionSpec,
+    LpPlacement,
+)
+from .manifest import PackManifest
+from .payload import InstallOperation, Payload, PayloadError, apply_operations, batch_operations, partition_sizes
+from .sdat import ANDROID_VERSIONS, BLOCK_SIZE as SDAT_BLOCK_SIZE, NewDataEncoder, TransferList, TransferListError
+from .sparse import SPARSE_MAX_RAW_CHUNK, BlockRun, SparseError, SparseImage, SparseWriter, append_run, scan_sparse_blocks
+from .xattr import capabilities, selinux_context
 
 LogFunc = Callable[[str], None]
 ProgressFunc = Callable[[float, str], None]
-
-SPARSE_MAGIC = 0xED26FF3A
+T = TypeVar("T")
+R = TypeVar("R")
+
+# 原生 img2simg 并行扫描时每个任务负责的区段长度
+SPARSE_SCAN_SEGMENT = 256 * 1024 * 1024
+
+# 解包工具只读访问镜像的文件系统：RAW 镜像可直接交给提取器，无需私有副本
+READONLY_EXTRACT_FS = {"ext4", "erofs", "squashfs"}
+# 检测文件系统时读取的头部长度（覆盖 ext4 / EROFS / F2FS 超级块）
+FS_HEADER_SIZE = 4096
+# 从 .new.dat.br 检测文件系统时最多解压丢弃的数据量，首块更靠后时不检测
+DAT_DETECT_MAX_SKIP = 64 * 1024 * 1024
+
+# --minimal 打包时按估算最小值构建失败后的最大尝试次数（每次放大约 2%）
+MINIMAL_PACK_ATTEMPTS = 5
+# mkfs.ext4 / make_ext4fs / e2fsdroid 在块或 inode 用尽时的输出（小写），只有这类失败才放大重试
+EXT4_NO_SPACE_MARKERS = (
+    "no space left", "no free space", "could not allocate", "failed to allocate",
+    "out of space", "not enough space", "enospc",
+)
+# 外部命令失败时附在 OperationError.output 中的输出行数（流式输出时）
+RUN_OUTPUT_TAIL_LINES = 50
+
+# pack_img 的构建配置：readonly 面向只读分区，去掉日志、保留块与 resize_inode，并共享重复块
+PACK_PROFILES = ("default", "readonly")
+READONLY_EXT4_FEATURES = "^has_journal,^resize_inode"
+# mke2fs 默认为 root 保留的块比例
+EXT4_DEFAULT_RESERVED_RATIO = 0.05
+
+# pack_img 可输出的文件系统；auto 表示沿用分解时检测到的文件系统（未知时为 ext4）
+PACK_FILESYSTEMS = ("auto", "ext4", "erofs")
+# 分解时记录的各分区原文件系统：zlo_out/.source_fs.json
+SOURCE_FS_FILE = ".source_fs.json"
+# mkfs.erofs 支持的压缩算法及其可用级别（None 表示不支持设置级别）
+EROFS_COMPRESSORS: Dict[str, Optional[Sequence[int]]] = {
+    "lz4": None,
+    "lz4hc": range(0, 13),
+    "lzma": [*range(0, 10), *range(100, 110)],
+}
+
+# 内置 ext4 解析器写出文件的线程数
+EXT4_EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+# 分解时写入 config/ 的属性配置：<分区名>_fs_config、<分区名>_file_contexts
+FS_CONFIG_SUFFIXES = ("_fs_config", "_file_contexts")
+
+# 分解操作的缓存版本：输出格式或提取逻辑变化时递增，使旧缓存失效
+CACHE_VERSIONS = {"unpack_img": 2, "unpack_super": 1, "unpack_dat": 1, "unpack_datbr": 1, "unpack_bin": 1}
 
 
 class OperationError(RuntimeError):
-    pass
+    """操作失败；外部命令失败时 output 为命令输出（流式输出时为最后若干行）"""
+
+    def __init__(self, message: str = "", output: str = "") -> None:
+        super().__init__(message)
+        self.output = output
+
+
+class ErofsOptions(NamedTuple):
+    """
+    mkfs.erofs 的压缩参数：level 为 None 时使用算法默认级别；
+    cluster_size 为物理簇字节数（0 表示 mkfs.erofs 默认值）；workers 为压缩线程数（0 表示由 mkfs.erofs 决定）
+    """
+
+    compressor: str = "lz4hc"
+    level: Optional[int] = None
+    cluster_size: int = 0
+    workers: int = 0
+
+
+def _size_summary(path: Path) -> str:
+    """表观大小与实际磁盘占用（st_blocks），空洞不计入占用"""
+    return f"{path.stat().st_size // (1024*1024)} MB，磁盘占用 {disk_usage(path) // (1024*1024)} MB"
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    """从流中读满 size 字节；流提前结束时返回实际读到的数据"""
+    parts = []
+    while size > 0:
+        data = stream.read(size)
+        if not data:
+            break
+        parts.append(data)
+        size -= len(data)
+    return b"".join(parts)
+
+
+@contextlib.contextmanager
+def _image_io_errors() -> Iterator[None]:
+    """稀疏镜像格式错误与源数据不足（blockio/sparse 的底层异常）转换为 OperationError"""
+    try:
+        yield
+    except (SparseError, EOFError) as exc:
+        raise OperationError(str(exc)) from exc
+
+
+class _BrotliReader(io.RawIOBase):
+    """基于 Python brotli 模块的流式解压读取器"""
+
+    def __init__(self, fh: BinaryIO) -> None:
+        super().__init__()
+        self._fh = fh
+        self._decompressor = brotli_lib.Decompressor()
+        # brotli >= 1.1 支持限制单次输出，高压缩比数据也不会一次性展开到内存
+        self._bounded = hasattr(self._decompressor, "can_accept_more_data")
+        self._buffer = bytearray()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            if self._bounded and not self._decompressor.can_accept_more_data():
+                self._buffer += self._decompressor.process(b"", output_buffer_limit=COPY_BUFFER_SIZE)
+                continue
+            data = self._fh.read(1024 * 1024)
+            if not data:
+                if not self._decompressor.is_finished():
+                    raise OperationError("Brotli 数据不完整")
+                return 0
+            if self._bounded:
+                self._buffer += self._decompressor.process(data, output_buffer_limit=COPY_BUFFER_SIZE)
+            else:
+                self._buffer += self._decompressor.process(data)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        return size
 
 
 class OperationRunner:
@@ -34,22 +205,55 @@ class OperationRunner:
         env: ToolEnvironment,
         logger: Optional[LogFunc] = None,
         progress: Optional[ProgressFunc] = None,
+        cache: Optional[ResultCache] = None,
     ) -> None:
         self.env = env
         self.logger: LogFunc = logger or (lambda msg: None)
         self.progress_cb: ProgressFunc = progress or (lambda fraction, message: None)
+        # 分解结果缓存，None 表示不启用
+        self.cache = cache
+        # 并行任务中每个工作线程的日志前缀
+        self._local = threading.local()
+        # mkfs.erofs 路径 -> 是否支持 --workers
+        self._erofs_workers_support: Dict[Path, bool] = {}
+        # 目录 -> 输入清单，多次操作复用同一份
+        self._inventories: Dict[Path, ProjectInventory] = {}
+        self._inventory_lock = threading.Lock()
 
     # ------------------------------------------------------------------ #
     # 公共工具方法
     # ------------------------------------------------------------------ #
     def _log(self, message: str) -> None:
-        self.logger(message.rstrip())
+        prefix = getattr(self._local, "prefix", "")
+        self.logger(f"{prefix}{message.rstrip()}")
+
+    def _inventory(self, root: Path, top_level: bool = False) -> ProjectInventory:
+        """
+        取目录的输入清单：同一 runner 内复用，每次取用时按 stat 与磁盘同步；
+        top_level=True 只同步根目录这一层。启用结果缓存时识别结果持久化到缓存目录。
+        """
+        root = Path(root)
+        with self._inventory_lock:
+            inventory = self._inventories.get(root)
+            if inventory is None:
+                cache_path = self.cache.inventory_path(root) if self.cache is not None else None
+                inventory = self._inventories[root] = ProjectInventory(root, not top_level, cache_path)
+                return inventory
+        inventory.refresh(recursive=not top_level)
+        return inventory
 
     def _update_progress(self, fraction: float, message: str = "") -> None:
         clamped = max(0.0, min(1.0, fraction))
         self.progress_cb(clamped, message)
 
-    def _run(self, cmd: List[str], *, cwd: Optional[Path] = None, capture_output: bool = False) -> str:
+    def _run(
+        self,
+        cmd: List[str],
+        *,
+        cwd: Optional[Path] = None,
+        capture_output: bool = False,
+        ok_returncodes: Sequence[int] = (0,),
+    ) -> str:
         env = self.env.prepare_subprocess_env()
         self._log(f"$ {' '.join(cmd)}")
         if capture_output:
@@ -61,8 +265,8 @@ class OperationRunner:
                 stderr=subprocess.STDOUT,
                 text=True,
             )
-            if result.returncode != 0:
-                raise OperationError(f"命令执行失败，退出码：{result.returncode}\n{result.stdout}")
+            if result.returncode not in ok_returncodes:
+                raise OperationError(f"命令执行失败，退出码：{result.returncode}\n{result.stdout}", result.stdout)
             return result.stdout
         else:
             process = subprocess.Popen(
@@ -75,13 +279,73 @@ class OperationRunner:
                 bufsize=1,
             )
             assert process.stdout is not None
+            tail: collections.deque = collections.deque(maxlen=RUN_OUTPUT_TAIL_LINES)
             for line in process.stdout:
                 self._log(line.rstrip())
+                tail.append(line)
             ret = process.wait()
-            if ret != 0:
-                raise OperationError(f"命令执行失败，退出码：{ret}")
+            if ret not in ok_returncodes:
+                raise OperationError(f"命令执行失败，退出码：{ret}", "".join(tail))
             return ""
 
+    def _map_parallel(
+        self,
+        items: Sequence[T],
+        func: Callable[[T], R],
+        jobs: int,
+        name_of: Callable[[T], str],
+        done_message: str,
+    ) -> List[R]:
+        """
+        在有界线程池中对 items 逐个执行 func，结果按输入顺序返回。
+
+        每个任务的日志带 ``[名称]`` 前缀；进度按已完成任务数汇总。
+        任一任务抛出异常时，等待其余任务结束后按输入顺序抛出第一个异常。
+        """
+        total = len(items)
+        done = 0
+        lock = threading.Lock()
+
+        def worker(item: T) -> R:
+            nonlocal done
+            name = name_of(item)
+            self._local.prefix = f"[{name}] "
+            try:
+                return func(item)
+            finally:
+                self._local.prefix = ""
+                with lock:
+                    done += 1
+                    self._update_progress(done / total, f"{name} {done_message}（{done}/{total}）")
+
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, total))) as pool:
+            futures = [pool.submit(worker, item) for item in items]
+        return [future.result() for future in futures]
+
+    def _cache_key(self, inputs: Sequence[Path], operation: str, params: str = "") -> Optional[str]:
+        if self.cache is None:
+            return None
+        return self.cache.key(inputs, operation, CACHE_VERSIONS[operation], params)
+
+    def _cache_restore(self, key: Optional[str], dest: Path, label: str, clear: bool = False) -> bool:
+        """缓存命中时恢复产物并返回 True"""
+        if key is None:
+            return False
+        restored = self.cache.restore(key, dest, clear=clear)
+        if restored is None:
+            self._log(f"  缓存未命中：{label}")
+            return False
+        self._log(f"  缓存命中：{label}，恢复 {len(restored)} 个文件")
+        return True
+
+    def _cache_store(self, key: Optional[str], base: Path, paths: Optional[Sequence[str]], label: str) -> None:
+        if key is not None:
+            self.cache.store(key, base, paths, label=label)
+
+    def _log_cache_stats(self) -> None:
+        if self.cache is not None:
+            self._log(f"缓存统计：{self.cache.stats.summary()}")
+
     def _ensure_project(self, project_dir: Path) -> Path:
         if not project_dir.exists():
             raise FileNotFoundError(f"项目目录不存在：{project_dir}")
@@ -90,10 +354,13 @@ class OperationRunner:
     # ================================================================== #
     # IMG 操作
     # ================================================================== #
-    def unpack_img(self, project_dir: Path, targets: Optional[Iterable[Path]] = None) -> None:
-        """分解普通 IMG 镜像到 zlo_out/<分区名>/ 目录"""
+    def unpack_img(
+        self, project_dir: Path, targets: Optional[Iterable[Path]] = None, jobs: int = 1, index: bool = False
+    ) -> None:
+        """分解普通 IMG 镜像到 zlo_out/<分区名>/ 目录；jobs > 1 时多分区并行，index=True 时分解后更新文件索引"""
         project_dir = self._ensure_project(project_dir)
-        images = list(targets) if targets else sorted(project_dir.glob("*.img"))
+        inventory = self._inventory(project_dir, top_level=True)
+        images = list(targets) if targets else [entry.path for entry in inventory.images(top_level=True)]
         if not images:
             raise OperationError("项目中未找到 *.img 文件")
 
@@ -101,7 +368,7 @@ class OperationRunner:
         for img_path in images:
             if not img_path.is_file():
                 continue
-            if self._is_super_image(img_path.name):
+            if self._is_super_image(img_path.name) or inventory.get(img_path).kind == "super":
                 self._log(f"跳过 super 镜像：{img_path.name} （请使用分解 super 功能）")
                 continue
             normal_images.append(img_path)
@@ -109,56 +376,149 @@ class OperationRunner:
         if not normal_images:
             raise OperationError("未找到可分解的普通 IMG 镜像")
 
-        simg2img = self.env.find_binary("simg2img")
-        if simg2img is None:
-            raise OperationError("未找到 simg2img，请确认 bin 目录或 PATH 中存在该命令")
+        # 展开之前先从镜像头部（稀疏镜像按 chunk 映射读取）检测文件系统，没有可用解包方式的镜像直接排除
+        self._log("文件系统检测：")
+        detected: Dict[Path, Optional[str]] = {}
+        for img_path in list(normal_images):
+            entry = inventory.get(img_path)
+            fs_type = entry.fs
+            kind = "稀疏" if entry.sparse else "RAW"
+            extractors = self._fs_extractors(fs_type)
+            if img_path.stat().st_size == 0:
+                self._log(f"  {img_path.name}：空文件，跳过")
+            elif not extractors:
+                self._log(f"  {img_path.name}：{kind}，{fs_type or '未知文件系统'} → ⚠️ 没有可用的解包方式，跳过")
+            else:
+                self._log(f"  {img_path.name}：{kind}，{fs_type or '未知文件系统'} → {' / '.join(extractors)}")
+                detected[img_path] = fs_type
+                continue
+            normal_images.remove(img_path)
+        if not normal_images:
+            raise OperationError("没有可以解包的镜像")
 
         out_root = project_dir / "zlo_out"
         out_root.mkdir(parents=True, exist_ok=True)
 
         total = len(normal_images)
         self._update_progress(0.0, f"准备分解 {total} 个镜像")
+        source_fs: Dict[str, str] = {}
 
         with tempfile.TemporaryDirectory() as tmp_dir:
             tmp_dir_path = Path(tmp_dir)
-            for index, img_path in enumerate(normal_images, start=1):
-                self._log(f"[{index}/{total}] 开始分解：{img_path.name}")
-                
-                # 检查文件大小
-                img_size = img_path.stat().st_size
-                if img_size == 0:
-                    self._log(f"  ⚠️ 跳过空镜像（0 字节）")
-                    self._update_progress(index / total, f"{img_path.name} 已跳过（空文件）")
-                    continue
-                
-                self._log(f"  镜像大小：{img_size // (1024*1024)} MB")
-                
-                raw_path = tmp_dir_path / f"{img_path.stem}.raw.img"
-                if self._is_sparse_image(img_path):
-                    self._log("  检测到稀疏镜像，转换为 RAW ...")
-                    self._run([str(simg2img), str(img_path), str(raw_path)])
-                else:
-                    self._log("  已是 RAW 镜像，直接复制")
-                    shutil.copyfile(img_path, raw_path)
-
-                extract_dir = out_root / img_path.stem
-                extract_dir.mkdir(parents=True, exist_ok=True)
-
-                if not self._extract_fs(raw_path, extract_dir):
-                    self._log(f"  ❌ 无法解包 {img_path.name}，请检查：")
-                    self._log(f"     1. 是否已安装 7-Zip 并添加到 PATH")
-                    self._log(f"     2. 文件系统类型是否支持")
-                    self._log(f"     3. 镜像文件是否完整")
-                    # 不中断整个流程，继续处理下一个
-                    continue
-
-                self._log(f"  ✅ 完成：输出目录 {extract_dir.relative_to(project_dir)}")
-                self._update_progress(index / total, f"{img_path.name} 分解完成")
 
+            def unpack_one(img_path: Path) -> str:
+                return self._unpack_single_img(
+                    project_dir, img_path, out_root, tmp_dir_path, source_fs, detected[img_path]
+                )
+
+            if jobs <= 1:
+                results = []
+                for idx, img_path in enumerate(normal_images, start=1):
+                    self._log(f"[{idx}/{total}] 开始分解：{img_path.name}")
+                    status = unpack_one(img_path)
+                    results.append(status)
+                    self._update_progress(idx / total, f"{img_path.name} {status}")
+            else:
+                self._log(f"并行分解 {total} 个镜像：{min(jobs, total)} 个工作线程")
+                results = self._map_parallel(normal_images, unpack_one, jobs, lambda p: p.stem, "已处理")
+                self._log("分解结果：")
+                for img_path, status in zip(normal_images, results):
+                    self._log(f"  {img_path.name}：{status}")
+
+        self._save_source_fs(out_root, source_fs)
+        self._log_cache_stats()
         self._update_progress(1.0, "所有 IMG 分解完成")
+        if index:
+            unpacked = [img for img, status in zip(normal_images, results) if status.startswith("分解完成")]
+            if unpacked:
+                self.index_img(project_dir, unpacked, extract_root=out_root)
 
-    def pack_img(self, project_dir: Path, partitions: Optional[List[str]] = None, sparse: bool = False) -> None:
-        """打包 zlo_out/<分区名>/ 为 IMG，输出到 zlo_pack/"""
+    def _unpack_single_img(
+        self,
+        project_dir: Path,
+        img_path: Path,
+        out_root: Path,
+        tmp_dir_path: Path,
+        source_fs: Dict[str, str],
+        fs_type: Optional[str],
+    ) -> str:
+        """分解单个镜像，返回结果描述（供进度与汇总使用）；fs_type 为预先检测的文件系统，记入 source_fs"""
+        self._log(f"  镜像大小：{_size_summary(img_path)}")
+        if fs_type:
+            source_fs[img_path.stem] = fs_type
+
+        extract_dir = out_root / img_path.stem
+        config_dir = project_dir / "config"
+        config_names = [f"{img_path.stem}{suffix}" for suffix in FS_CONFIG_SUFFIXES]
+        cache_key = self._cache_key([img_path], "unpack_img")
+        config_key = self._cache_key([img_path], "unpack_img", "config")
+        if self._cache_restore(cache_key, extract_dir, img_path.name, clear=True):
+            if fs_type in (None, "ext4"):
+                self._cache_restore(config_key, config_dir, f"{img_path.name} 属性配置")
+            self._log(f"  ✅ 完成：输出目录 {extract_dir.relative_to(project_dir)}")
+            return "分解完成（缓存）"
+
+        raw_path = tmp_dir_path / f"{img_path.stem}.raw.img"
+        if self._is_sparse_image(img_path):
+            self._log("  检测到稀疏镜像，转换为 RAW ...")
+            self._desparse(img_path, raw_path)
+        else:
+            raw_path = self._prepare_raw_input(img_path, raw_path)
+
+        extract_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            if not self._extract_fs(raw_path, extract_dir, config_dir):
+                self._log(f"  ❌ 无法解包 {img_path.name}，请检查：")
+                self._log(f"     1. 是否已安装 7-Zip 并添加到 PATH")
+                self._log(f"     2. 文件系统类型是否支持")
+                self._log(f"     3. 镜像文件是否完整")
+                # 不中断整个流程，继续处理下一个
+                return "分解失败"
+        finally:
+            # 尽早释放临时 RAW，并行时不让多个展开副本同时堆积
+            if raw_path != img_path:
+                raw_path.unlink(missing_ok=True)
+
+        self._cache_store(cache_key, extract_dir, None, img_path.name)
+        if all((config_dir / name).is_file() for name in config_names):
+            self._cache_store(config_key, config_dir, config_names, f"{img_path.name} 属性配置")
+        self._log(f"  ✅ 完成：输出目录 {extract_dir.relative_to(project_dir)}")
+        return "分解完成"
+
+    def pack_img(
+        self,
+        project_dir: Path,
+        partitions: Optional[List[str]] = None,
+        sparse: bool = False,
+        jobs: int = 1,
+        *,
+        force: bool = False,
+        hash_files: bool = False,
+        headroom: float = 0.1,
+        minimal: bool = False,
+        profile: str = "default",
+        fs: str = "auto",
+        erofs: Optional[ErofsOptions] = None,
+    ) -> List[str]:
+        """
+        打包 zlo_out/<分区名>/ 为 IMG，输出到 zlo_pack/；jobs > 1 时多分区并行
+
+        每个分区打包后在 zlo_pack 中保存清单（<分区名>.manifest.json），目录内容、打包参数
+        与上次的镜像均未变化时直接复用；force=True 时全部重建。返回实际重建的分区名。
+        镜像大小按目录内容精确估算，headroom 为在最小值之上追加的比例；
+        minimal=True 时按最小值构建并再收缩到文件系统实际占用（shrink-to-fit）。
+        profile="readonly" 时构建只读优化的镜像（无日志、无保留块、inode 数按文件数确定），
+        有 e2fsdroid 时用 -s 让内容相同的文件共享数据块，并报告相对默认配置节省的空间。
+        fs 选择输出的文件系统：auto 时每个分区沿用分解时的文件系统；erofs 分区按 erofs 的压缩参数
+        用 mkfs.erofs 构建（headroom / minimal / profile 只作用于 ext4 分区）。
+        """
+        if profile not in PACK_PROFILES:
+            raise OperationError(f"未知的打包配置：{profile}（可选：{', '.join(PACK_PROFILES)}）")
+        if fs not in PACK_FILESYSTEMS:
+            raise OperationError(f"未知的文件系统：{fs}（可选：{', '.join(PACK_FILESYSTEMS)}）")
+        erofs = erofs or ErofsOptions()
+        self._check_erofs_options(erofs)
+        read_only = profile == "readonly"
         project_dir = self._ensure_project(project_dir)
         zlo_out = project_dir / "zlo_out"
         if not zlo_out.exists():
@@ -179,89 +539,872 @@ class OperationRunner:
         pack_dir = project_dir / "zlo_pack"
         pack_dir.mkdir(parents=True, exist_ok=True)
 
+        source_fs = self._load_source_fs(zlo_out) if fs == "auto" else {}
+        fs_types = {d.name: self._resolve_pack_fs(d.name, fs, source_fs) for d in targets}
+
         # 检测打包工具
-        backend = self._detect_img_pack_backend()
-        if not backend:
-            raise OperationError("未找到可用的 EXT4 打包工具：mkfs.ext4 / make_ext4fs / mke2fs+e2fsdroid")
+        backend = ""
+        if "ext4" in fs_types.values():
+            backend = self._detect_img_pack_backend(prefer_e2fsdroid=read_only) or ""
+            if not backend:
+                raise OperationError("未找到可用的 EXT4 打包工具：mkfs.ext4 / make_ext4fs / mke2fs+e2fsdroid")
+            if read_only and backend != "mke2fs+e2fsdroid":
+                self._log(f"警告：未找到 mke2fs+e2fsdroid，使用 {backend} 构建只读镜像，不做共享块去重")
+        if "erofs" in fs_types.values() and not self.env.find_binary("mkfs.erofs"):
+            raise OperationError("未找到 EROFS 打包工具：mkfs.erofs")
+
+        part_options: Dict[str, Dict[str, Any]] = {}
+        for name, fs_type in fs_types.items():
+            if fs_type == "erofs":
+                part_options[name] = {
+                    "fs": "erofs",
+                    "sparse": sparse,
+                    "erofs": [erofs.compressor, erofs.level, erofs.cluster_size],
+                }
+            else:
+                part_options[name] = {
+                    "fs": "ext4", "backend": backend, "sparse": sparse, "headroom": headroom,
+                    "minimal": minimal, "profile": profile,
+                }
+        scans: Dict[str, TreeScan] = {}
+        stale: List[Path] = []
+        for part_dir in targets:
+            name = part_dir.name
+            scans[name] = scan_tree(part_dir, hash_files)
+            if force or not self._pack_up_to_date(pack_dir, name, part_options[name], scans[name].entries):
+                stale.append(part_dir)
+        if not stale:
+            self._log("所有分区均未变化，无需重新打包")
+            self._update_progress(1.0, "所有 IMG 打包完成")
+            return []
+        targets = stale
+
+        def finalize(raw_img: Path) -> None:
+            final_img = raw_img.with_name(f"{raw_img.stem}.sparse.img") if sparse else raw_img
+            self._save_pack_manifest(
+                pack_dir, raw_img.stem, part_options[raw_img.stem], scans[raw_img.stem].entries, final_img
+            )
 
         total = len(targets)
         self._update_progress(0.0, f"准备打包 {total} 个分区")
+        started = time.monotonic()
+        stage_times: List[float] = []
+
+        if jobs <= 1:
+            for index, part_dir in enumerate(targets, start=1):
+                part_name = part_dir.name
+                self._log(f"[{index}/{total}] 打包：{part_name}")
+                raw_img, elapsed = self._pack_single_img(
+                    part_dir, pack_dir, backend, scans[part_name], headroom, minimal, read_only,
+                    fs_types[part_name], erofs,
+                )
+                stage_times.append(elapsed)
+                if sparse:
+                    stage_times.append(self._convert_to_sparse(project_dir, raw_img, os.cpu_count() or 1))
+                else:
+                    self._log(f"  完成：{raw_img.relative_to(project_dir)}")
+                finalize(raw_img)
+                self._update_progress(index / total, f"{part_name} 打包完成")
+        else:
+            workers = min(jobs, total)
+            self._log(f"并行打包 {total} 个分区：{workers} 个工作线程")
+            # 稀疏转换放到独立线程池，构建线程可立即开始下一个分区的 mkfs；
+            # 多个分区已并行转换，单个转换内不再启动扫描进程
+            with ThreadPoolExecutor(max_workers=workers) as sparse_pool:
+
+                def convert(raw_img: Path) -> float:
+                    self._local.prefix = f"[{raw_img.stem}] "
+                    try:
+                        return self._convert_to_sparse(project_dir, raw_img, 1)
+                    finally:
+                        self._local.prefix = ""
+
+                def build(part_dir: Path) -> Tuple[Path, float, Any]:
+                    raw_img, elapsed = self._pack_single_img(
+                        part_dir, pack_dir, backend, scans[part_dir.name], headroom, minimal, read_only,
+                        fs_types[part_dir.name], erofs,
+                    )
+                    pending = sparse_pool.submit(convert, raw_img) if sparse else None
+                    if pending is None:
+                        self._log(f"  完成：{raw_img.relative_to(project_dir)}")
+                    return raw_img, elapsed, pending
+
+                built = self._map_parallel(targets, build, jobs, lambda d: d.name, "构建完成")
+                for raw_img, elapsed, pending in built:
+                    stage_times.append(elapsed)
+                    if pending is not None:
+                        stage_times.append(pending.result())
+                    finalize(raw_img)
+
+        wall = time.monotonic() - started
+        serial = sum(stage_times)
+        speedup = serial / wall if wall > 0 else 1.0
+        self._log(f"打包耗时：{wall:.1f}s（各步骤串行累计 {serial:.1f}s，加速 {speedup:.2f}×）")
+        self._update_progress(1.0, "所有 IMG 打包完成")
+        return [part_dir.name for part_dir in targets]
 
-        for index, part_dir in enumerate(targets, start=1):
-            part_name = part_dir.name
-            self._log(f"[{index}/{total}] 打包：{part_name}")
+    def watch_img(
+        self,
+        project_dir: Path,
+        partitions: Optional[List[str]] = None,
+        sparse: bool = False,
+        jobs: int = 1,
+        *,
+        interval: float = 2.0,
+        hash_files: bool = False,
+        headroom: float = 0.1,
+        minimal: bool = False,
+        profile: str = "default",
+        fs: str = "auto",
+        erofs: Optional[ErofsOptions] = None,
+    ) -> None:
+        """
+        监视 zlo_out 下的分区目录，内容变化后只重新打包变化的分区，直到被中断。
 
-            size_mb = self._estimate_partition_size(part_dir)
-            self._log(f"  预分配大小：{size_mb} MB")
+        目录状态需在连续两次轮询中保持一致才会触发打包，避免在文件写入过程中打包。
+        打包失败只记录日志并继续监视，失败的分区在内容再次变化后才重试。
+        """
+        project_dir = self._ensure_project(project_dir)
+        self.pack_img(
+            project_dir, partitions, sparse, jobs,
+            hash_files=hash_files, headroom=headroom, minimal=minimal, profile=profile,
+            fs=fs, erofs=erofs,
+        )
+        zlo_out = project_dir / "zlo_out"
+        pack_dir = project_dir / "zlo_pack"
+        self._log(f"监视 {zlo_out.relative_to(project_dir)}，每 {interval:g}s 检查一次（Ctrl+C 退出）")
+
+        previous: Dict[str, Dict[str, Any]] = {}
+        # 打包失败时的目录状态，内容不变就不再重复尝试
+        failed: Dict[str, Dict[str, Any]] = {}
+        while True:
+            time.sleep(interval)
+            ready: List[str] = []
+            for part_dir in sorted(zlo_out.iterdir()):
+                name = part_dir.name
+                if not part_dir.is_dir() or (partitions and name not in partitions):
+                    continue
+                entries = scan_tree(part_dir, hash_files, xattrs=False).entries
+                manifest = PackManifest.load(PackManifest.path_for(pack_dir, name))
+                if (
+                    entries and (manifest is None or manifest.entries != entries)
+                    and previous.get(name) == entries and failed.get(name) != entries
+                ):
+                    ready.append(name)
+                previous[name] = entries
+            if ready:
+                self._log(f"检测到变化：{', '.join(ready)}")
+                try:
+                    self.pack_img(
+                        project_dir, ready, sparse, jobs,
+                        hash_files=hash_files, headroom=headroom, minimal=minimal, profile=profile,
+                        fs=fs, erofs=erofs,
+                    )
+                except OperationError as exc:
+                    self._log(f"❌ 打包失败：{exc}；修改内容后将再次尝试，继续监视")
+                    for name in ready:
+                        failed[name] = previous[name]
+
+    def _pack_up_to_date(
+        self, pack_dir: Path, part_name: str, options: Dict[str, Any], entries: Dict[str, Any]
+    ) -> bool:
+        """比较分区清单：参数、目录内容与上次的镜像都未变化时返回 True"""
+        manifest = PackManifest.load(PackManifest.path_for(pack_dir, part_name))
+        if manifest is None:
+            return False
+        if manifest.options != options:
+            self._log(f"{part_name}：打包参数已变化，重新打包")
+            return False
+        if not manifest.output_intact(pack_dir):
+            self._log(f"{part_name}：上次的镜像缺失或已被修改，重新打包")
+            return False
+        changed = manifest.diff(entries)
+        if changed:
+            sample = "，".join(changed[:3]) + (" ..." if len(changed) > 3 else "")
+            self._log(f"{part_name}：{len(changed)} 项变化（{sample}），重新打包")
+            return False
+        self._log(f"{part_name}：内容未变化，复用 {manifest.output}")
+        return True
 
-            raw_img = pack_dir / f"{part_name}.img"
-            self._pack_ext4_image(part_dir, raw_img, part_name, size_mb, backend)
+    def _save_pack_manifest(
+        self, pack_dir: Path, part_name: str, options: Dict[str, Any], entries: Dict[str, Any], image: Path
+    ) -> None:
+        manifest = PackManifest(options, entries)
+        manifest.record_output(image)
+        manifest.save(PackManifest.path_for(pack_dir, part_name))
+
+    def _pack_single_img(
+        self,
+        part_dir: Path,
+        pack_dir: Path,
+        backend: str,
+        scan: TreeScan,
+        headroom: float,
+        minimal: bool = False,
+        read_only: bool = False,
+        fs_type: str = "ext4",
+        erofs: Optional[ErofsOptions] = None,
+    ) -> Tuple[Path, float]:
+        """构建单个分区镜像，返回 (镜像路径, 耗时)；先写入私有临时文件，成功后再改名"""
+        started = time.monotonic()
+        part_name = part_dir.name
+        raw_img = pack_dir / f"{part_name}.img"
+        tmp_img = pack_dir / f".{part_name}.img.tmp"
+        tmp_img.unlink(missing_ok=True)
+
+        if fs_type == "erofs":
+            try:
+                self._pack_erofs_image(part_dir, tmp_img, part_name, erofs or ErofsOptions())
+            except BaseException:
+                tmp_img.unlink(missing_ok=True)
+                raise
+            os.replace(tmp_img, raw_img)
+            mb = 1024 * 1024
+            content = scan.usage.apparent_bytes
+            size = raw_img.stat().st_size
+            self._log(
+                f"  EROFS：{size / mb:.1f} MB（内容 {content / mb:.1f} MB，"
+                f"为原大小的 {size / content if content else 0:.0%}）"
+            )
+            return raw_img, time.monotonic() - started
+
+        estimate = self._estimate_partition_size(scan, 0.0 if minimal else headroom, read_only)
+        size_mb = (estimate.min_bytes if minimal else estimate.size_bytes) // (1024 * 1024)
+
+        try:
+            if minimal:
+                self._pack_ext4_minimal(part_dir, tmp_img, part_name, size_mb, backend, estimate.inodes, read_only)
+            else:
+                self._pack_ext4_image(part_dir, tmp_img, part_name, size_mb, backend, estimate.inodes, read_only)
+        except BaseException:
+            tmp_img.unlink(missing_ok=True)
+            raise
+        os.replace(tmp_img, raw_img)
+        if read_only:
+            shared = backend == "mke2fs+e2fsdroid"
+            self._report_readonly_savings(raw_img, scan, estimate, 0.0 if minimal else headroom, minimal, shared)
+        return raw_img, time.monotonic() - started
+
+    def _pack_ext4_minimal(
+        self, src_dir: Path, out_img: Path, label: str, size_mb: int, backend: str, inodes: int, read_only: bool = False
+    ) -> None:
+        """
+        shrink-to-fit：先按估算的最小值构建，空间或 inode 不足时逐步放大重试（其他失败直接抛出）；
+        有 resize2fs 时再收缩到文件系统的实际最小值。
+        resize2fs 不支持共享块（e2fsdroid -s）的镜像，此时按实际占用的块数重建一次。
+        """
+        for attempt in range(1, MINIMAL_PACK_ATTEMPTS + 1):
+            try:
+                self._pack_ext4_image(src_dir, out_img, label, size_mb, backend, inodes, read_only)
+                break
+            except OperationError as exc:
+                out_img.unlink(missing_ok=True)
+                output = exc.output.lower()
+                if attempt == MINIMAL_PACK_ATTEMPTS or not any(marker in output for marker in EXT4_NO_SPACE_MARKERS):
+                    raise
+                size_mb += max(1, size_mb // 50)
+                self._log(f"  空间或 inode 不足，放大到 {size_mb} MB 重试（第 {attempt + 1} 次）")
+
+        if read_only and backend == "mke2fs+e2fsdroid":
+            self._repack_to_used_size(src_dir, out_img, label, size_mb, backend, inodes)
+            return
+        if not (self.env.find_binary("e2fsck") and self.env.find_binary("resize2fs")):
+            self._log(f"  未找到 resize2fs，保持迭代构建的大小：{size_mb} MB")
+            return
+        before = out_img.stat().st_size
+        try:
+            after = self._shrink_ext4_image(out_img)
+        except OperationError as exc:
+            self._log(f"  收缩失败，保持 {size_mb} MB（{exc}）")
+            return
+        self._log(f"  收缩：{before / (1024*1024):.1f} MB -> {after / (1024*1024):.1f} MB")
+
+    def _pack_erofs_image(self, src_dir: Path, out_img: Path, label: str, erofs: ErofsOptions) -> None:
+        """使用 mkfs.erofs 打包 EROFS 镜像"""
+        mkfs_erofs = self.env.find_binary("mkfs.erofs")
+        assert mkfs_erofs
+        compressor = erofs.compressor if erofs.level is None else f"{erofs.compressor},{erofs.level}"
+        cmd = [str(mkfs_erofs), f"-z{compressor}"]
+        if erofs.cluster_size:
+            cmd.append(f"-C{erofs.cluster_size}")
+        if erofs.workers:
+            if self._erofs_supports_workers(mkfs_erofs):
+                cmd.append(f"--workers={erofs.workers}")
+            else:
+                self._log("  当前 mkfs.erofs 不支持 --workers，单线程压缩（可用 --jobs 让多个分区并行）")
+        cmd += ["-L", label[:16], f"--mount-point=/{label}", str(out_img), str(src_dir)]
+        self._run(cmd)
+
+    def _erofs_supports_workers(self, mkfs_erofs: Path) -> bool:
+        """mkfs.erofs 1.8 起支持多线程压缩（--workers）；按帮助输出判断，结果按路径记忆"""
+        cached = self._erofs_workers_support.get(mkfs_erofs)
+        if cached is None:
+            try:
+                result = subprocess.run(
+                    [str(mkfs_erofs), "--help"],
+                    env=self.env.prepare_subprocess_env(),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                )
+                cached = "--workers" in result.stdout
+            except OSError:
+                cached = False
+            self._erofs_workers_support[mkfs_erofs] = cached
+        return cached
+
+    def _check_erofs_options(self, erofs: ErofsOptions) -> None:
+        if erofs.compressor not in EROFS_COMPRESSORS:
+            raise OperationError(f"未知的 EROFS 压缩算法：{erofs.compressor}（可选：{', '.join(EROFS_COMPRESSORS)}）")
+        levels = EROFS_COMPRESSORS[erofs.compressor]
+        if erofs.level is not None and (levels is None or erofs.level not in levels):
+            raise OperationError(f"{erofs.compressor} 不支持压缩级别 {erofs.level}")
+        if erofs.cluster_size < 0 or erofs.cluster_size % 4096:
+            raise OperationError(f"EROFS 物理簇大小必须是 4096 的倍数：{erofs.cluster_size}")
+        if erofs.workers < 0:
+            raise OperationError(f"无效的压缩线程数：{erofs.workers}")
+
+    def _load_source_fs(self, zlo_out: Path) -> Dict[str, str]:
+        """读取分解时记录的各分区原文件系统"""
+        try:
+            with (zlo_out / SOURCE_FS_FILE).open("r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_source_fs(self, zlo_out: Path, source_fs: Dict[str, str]) -> None:
+        if not source_fs:
+            return
+        merged = self._load_source_fs(zlo_out)
+        merged.update(source_fs)
+        path = zlo_out / SOURCE_FS_FILE
+        tmp = path.with_name(f".{path.name}.tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            json.dump(merged, fh, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+
+    def _resolve_pack_fs(self, part_name: str, fs: str, source_fs: Dict[str, str]) -> str:
+        """确定分区的输出文件系统：显式指定时直接使用，auto 时沿用原文件系统"""
+        if fs != "auto":
+            return fs
+        original = source_fs.get(part_name)
+        if original in ("ext4", "erofs"):
+            self._log(f"{part_name}：沿用原文件系统 {original}")
+            return original
+        if original:
+            self._log(f"{part_name}：原文件系统 {original} 不支持重新打包，改用 ext4")
+        return "ext4"
+
+    def _repack_to_used_size(
+        self, src_dir: Path, out_img: Path, label: str, size_mb: int, backend: str, inodes: int
+    ) -> None:
+        """按已构建镜像实际占用的块数重建一次；重建失败时保留原镜像"""
+        block_size, blocks, free = self._ext4_block_counts(out_img)
+        used_mb = -(-(blocks - free) * block_size // (1024 * 1024))
+        if used_mb >= size_mb:
+            return
+        trial = out_img.with_name(f"{out_img.name}.fit")
+        try:
+            self._pack_ext4_image(src_dir, trial, label, used_mb, backend, inodes, True)
+        except OperationError:
+            trial.unlink(missing_ok=True)
+            self._log(f"  按实际占用 {used_mb} MB 重建失败，保持 {size_mb} MB")
+            return
+        os.replace(trial, out_img)
+        self._log(f"  按实际占用重建：{size_mb} MB -> {used_mb} MB")
+
+    def _report_readonly_savings(
+        self, raw_img: Path, scan: TreeScan, estimate: Ext4Estimate, headroom: float, minimal: bool, shared: bool
+    ) -> None:
+        """与默认配置（带日志、5% 保留块、resize_inode，不共享块）的同一分区比较，报告节省的空间"""
+        mb = 1024 * 1024
+        default = estimate_ext4(scan.usage, headroom)
+        default_bytes = default.min_bytes if minimal else default.size_bytes
+        actual_bytes = raw_img.stat().st_size
+
+        shared_bytes = 0
+        if shared:
+            # 共享块节省 ≈ 按文件逐一计算的占用 - 超级块记录的实际占用
+            block_size, blocks, free = self._ext4_block_counts(raw_img)
+            metadata, _ = ext4_overhead(blocks, estimate.inodes, journal=False, resize_inode=False)
+            shared_bytes = max(0, estimate.data_blocks + metadata - (blocks - free)) * block_size
+        reserved_bytes = int(actual_bytes * EXT4_DEFAULT_RESERVED_RATIO)
+        details = [
+            f"日志 {default.journal_blocks * EXT4_BLOCK_SIZE / mb:.1f} MB",
+            f"预留 GDT {(default.metadata_blocks - estimate.metadata_blocks) * EXT4_BLOCK_SIZE / mb:.1f} MB",
+        ]
+        if shared:
+            details.append(f"共享重复块约 {shared_bytes / mb:.1f} MB")
+        self._log(
+            f"  只读配置：{actual_bytes / mb:.1f} MB，默认配置约 {default_bytes / mb:.1f} MB，"
+            f"节省 {(default_bytes - actual_bytes) / mb:.1f} MB（{'，'.join(details)}）；"
+            f"不再为 root 保留 {reserved_bytes / mb:.1f} MB"
+        )
+
+    def _convert_to_sparse(self, project_dir: Path, raw_img: Path, jobs: int) -> float:
+        """RAW 镜像转换为 <分区名>.sparse.img 并删除 RAW，返回耗时"""
+        started = time.monotonic()
+        sparse_img = raw_img.with_name(f"{raw_img.stem}.sparse.img")
+        tmp_sparse = raw_img.with_name(f".{raw_img.stem}.sparse.img.tmp")
+        self._log(f"  转换为稀疏镜像：{sparse_img.name}")
+        try:
+            chunks = self._img2simg(raw_img, tmp_sparse, jobs)
+        except BaseException:
+            tmp_sparse.unlink(missing_ok=True)
+            raise
+        os.replace(tmp_sparse, sparse_img)
+        raw_img.unlink()
+        elapsed = time.monotonic() - started
+        self._log(f"  完成：{sparse_img.relative_to(project_dir)}（{chunks} 个 chunk，{_size_summary(sparse_img)}，{elapsed:.1f}s）")
+        return elapsed
+
+    @_image_io_errors()
+    def _img2simg(self, raw_img: Path, out_path: Path, jobs: int, block_size: int = 4096) -> int:
+        """
+        原生 img2simg：输出与 img2simg（默认模式）逐字节一致，返回 chunk 数。
+
+        镜像按 SPARSE_SCAN_SEGMENT 分段，jobs > 1 时在进程池中并行分类；空洞不读取，
+        RAW 数据由 SparseWriter 经 copy_file_range 直接从 RAW 镜像复制。
+        """
+        size = raw_img.stat().st_size
+        offsets = list(range(0, size, SPARSE_SCAN_SEGMENT))
+        lengths = [min(SPARSE_SCAN_SEGMENT, size - offset) for offset in offsets]
+        workers = max(1, min(jobs, len(offsets)))
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(
+                    scan_sparse_blocks, [str(raw_img)] * len(offsets), offsets, lengths, [block_size] * len(offsets)
+                ))
+        else:
+            parts = [scan_sparse_blocks(str(raw_img), offset, length, block_size) for offset, length in zip(offsets, lengths)]
+
+        max_blocks = SPARSE_MAX_RAW_CHUNK // block_size
+        with raw_img.open("rb") as src, out_path.open("wb") as out:
+            writer = SparseWriter(out, block_size)
+            runs: List[BlockRun] = []
+            for part in parts:
+                for run in part:
+                    append_run(runs, *run)
+            for block, count, fill in runs:
+                offset = block * block_size
+                if fill is not None:
+                    while count > 0:
+                        step = min(count, max_blocks)
+                        writer.add_fill(fill, step)
+                        count -= step
+                    continue
+                length = min(count * block_size, size - offset)
+                aligned = length - length % block_size
+                if aligned:
+                    writer.add_raw_from(src, offset, aligned)
+                if aligned < length:
+                    # 末尾不足一块：与 img2simg 一样补零成整块
+                    tail = pread(src, length - aligned, offset + aligned)
+                    writer.add_raw(tail + bytes(block_size - len(tail)))
+            writer.finish()
+            return writer.total_chunks
 
-            if sparse:
-                img2simg = self.env.find_binary("img2simg")
-                if img2simg:
-                    sparse_img = pack_dir / f"{part_name}.sparse.img"
-                    self._log(f"  转换为稀疏镜像：{sparse_img.name}")
-                    self._run([str(img2simg), str(raw_img), str(sparse_img)])
-                    raw_img.unlink()
-                    self._log(f"  完成：{sparse_img.relative_to(project_dir)}")
+    # ================================================================== #
+    # 镜像浏览（不解包）
+    # ================================================================== #
+    def list_img(self, project_dir: Path, image: str, path: str = "/", recursive: bool = False) -> List[str]:
+        """
+        列出镜像内目录的内容（ls -l 风格），path 为文件时只列出它本身。
+        只读取路径上的目录块与 inode，RAW 与稀疏镜像均不展开。
+        """
+        img_path = self._resolve_browse_image(project_dir, image)
+        with self._open_fs_image(img_path) as fs:
+            node = fs.lookup(path)
+            if not node.is_dir:
+                return [self._format_listing(fs, path.strip("/").rsplit("/", 1)[-1], node)]
+            if recursive:
+                items = [(rel, child) for rel, child in fs.walk(node) if rel]
+            else:
+                items = [(entry.name, fs.inode(entry.ino)) for entry in sorted(fs.listdir(node), key=lambda e: e.name)]
+            return [self._format_listing(fs, rel, child) for rel, child in items]
+
+    def cat_img(self, project_dir: Path, image: str, path: str, out: BinaryIO) -> int:
+        """把镜像内单个文件的内容写入 out（可为不可 seek 的流），返回字节数"""
+        img_path = self._resolve_browse_image(project_dir, image)
+        with self._open_fs_image(img_path) as fs:
+            node = fs.lookup(path)
+            if node.is_dir:
+                raise OperationError(f"是目录，无法输出内容：{path}")
+            if isinstance(fs, ErofsImage) and node.compressed:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    extracted = self._extract_erofs_path(img_path, path, Path(tmp_dir))
+                    with extracted.open("rb") as fh:
+                        shutil.copyfileobj(fh, out, COPY_BUFFER_SIZE)
+                return node.size
+            if node.is_symlink:
+                data = os.fsencode(fs.readlink(node))
+                out.write(data)
+                return len(data)
+            written = 0
+            for chunk in fs.iter_chunks(node):
+                out.write(chunk)
+                written += len(chunk)
+            return written
+
+    def extract_from_img(
+        self, project_dir: Path, image: str, paths: Sequence[str], out_dir: Optional[Path] = None
+    ) -> List[Path]:
+        """
+        只提取镜像中的指定文件或目录，默认输出到 zlo_out/<分区名>/ 下的相同路径。
+        按路径解析 inode 后直接读取对应数据块，其余内容不读取；返回各路径的输出位置。
+        """
+        img_path = self._resolve_browse_image(project_dir, image)
+        out_dir = out_dir or project_dir / "zlo_out" / img_path.stem.split(".")[0]
+        outputs: List[Path] = []
+        with self._open_fs_image(img_path) as fs:
+            for path in paths:
+                node = fs.lookup(path)
+                rel = path.strip("/")
+                dest = out_dir / rel if rel else out_dir
+                started = time.monotonic()
+                nodes = list(fs.walk(node)) if node.is_dir else [("", node)]
+                if isinstance(fs, ErofsImage) and any(item.compressed for _, item in nodes):
+                    self._log(f"  {path} 含压缩文件，交给 extract.erofs 解压")
+                    # 临时目录与输出放在同一文件系统，解压结果直接改名过去
+                    out_dir.parent.mkdir(parents=True, exist_ok=True)
+                    with tempfile.TemporaryDirectory(dir=out_dir.parent) as tmp_dir:
+                        extracted = self._extract_erofs_path(img_path, path, Path(tmp_dir))
+                        dest.parent.mkdir(parents=True, exist_ok=True)
+                        if dest.is_dir() and not dest.is_symlink():
+                            shutil.rmtree(dest)
+                        elif os.path.lexists(dest):
+                            dest.unlink()
+                        shutil.move(str(extracted), str(dest))
                 else:
-                    self._log("  警告：未找到 img2simg，输出 RAW 镜像")
-                    self._log(f"  完成：{raw_img.relative_to(project_dir)}")
+                    copied = self._copy_fs_nodes(fs, nodes, dest)
+                    elapsed = time.monotonic() - started
+                    self._log(f"  {path} -> {dest}（{len(nodes)} 项，{copied / (1024 * 1024):.1f} MB，{elapsed:.2f}s）")
+                outputs.append(dest)
+        return outputs
+
+    def _copy_fs_nodes(self, fs: Any, nodes: List[Tuple[str, Any]], dest: Path) -> int:
+        """把 walk 得到的 (相对路径, inode) 写到 dest 下，目录属性最后设置；返回写入的字节数"""
+        dirs: List[Tuple[Path, Any]] = []
+        written = 0
+        for rel, node in nodes:
+            target = dest / rel if rel else dest
+            if node.is_dir:
+                target.mkdir(parents=True, exist_ok=True)
+                dirs.append((target, node))
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if os.path.lexists(target) and not target.is_dir():
+                target.unlink()
+            if node.is_symlink:
+                os.symlink(fs.readlink(node), target)
+            elif node.is_reg:
+                with target.open("wb") as fh:
+                    written += fs.copy_to(node, fh)
+                os.chmod(target, stat.S_IMODE(node.mode))
+                os.utime(target, ns=(node.mtime_ns, node.mtime_ns))
             else:
-                self._log(f"  完成：{raw_img.relative_to(project_dir)}")
+                self._log(f"  跳过设备/管道文件：{rel or target.name}")
+        for target, node in reversed(dirs):
+            os.chmod(target, stat.S_IMODE(node.mode))
+            os.utime(target, ns=(node.mtime_ns, node.mtime_ns))
+        return written
+
+    def _extract_erofs_path(self, img_path: Path, path: str, tmp_dir: Path) -> Path:
+        """用 extract.erofs 解压镜像中的单个路径到 tmp_dir，返回解压结果；稀疏镜像先展开"""
+        extract_erofs = self.env.find_binary("extract.erofs")
+        if not extract_erofs:
+            raise OperationError("压缩的 EROFS 文件需要 extract.erofs 工具解压，但未找到该工具")
+        stem = img_path.stem.split(".")[0]
+        raw_path = img_path
+        if self._is_sparse_image(img_path):
+            raw_path = tmp_dir / f"{stem}.img"
+            self._log("  稀疏镜像先展开为 RAW 再交给 extract.erofs")
+            self._desparse(img_path, raw_path)
+        rel = path.strip("/")
+        out = tmp_dir / "out"
+        # extract.erofs -X 提取单个文件时不会创建上级目录
+        (out / raw_path.stem / rel).parent.mkdir(parents=True, exist_ok=True)
+        self._run(
+            [str(extract_erofs), "-i", str(raw_path), "-o", str(out), "-X", f"/{rel}", "-f"], capture_output=True
+        )
+        extracted = out / raw_path.stem / rel
+        if not os.path.lexists(extracted):
+            raise OperationError(f"extract.erofs 未能提取：{path}")
+        return extracted
+
+    def _format_listing(self, fs: Any, name: str, node: Any) -> str:
+        mtime = time.strftime("%Y-%m-%d %H:%M", time.localtime(node.mtime_ns // 1_000_000_000))
+        if node.is_symlink:
+            try:
+                name = f"{name} -> {fs.readlink(node)}"
+            except (Ext4Error, ErofsError):
+                name = f"{name} -> ?"
+        return f"{stat.filemode(node.mode)} {node.uid:>5} {node.gid:>5} {node.size:>12} {mtime} {name}"
 
-            self._update_progress(index / total, f"{part_name} 打包完成")
+    def _resolve_browse_image(self, project_dir: Path, image: str) -> Path:
+        """镜像可以是绝对路径、相对项目目录的路径，或省略 .img 后缀的分区名"""
+        project_dir = self._ensure_project(project_dir)
+        candidate = Path(image)
+        if not candidate.is_absolute():
+            candidate = project_dir / candidate
+        if not candidate.is_file() and candidate.suffix != ".img":
+            candidate = candidate.with_name(f"{candidate.name}.img")
+        if not candidate.is_file():
+            raise FileNotFoundError(f"镜像不存在：{image}")
+        return candidate
+
+    @contextlib.contextmanager
+    def _open_fs_image(self, img_path: Path) -> Iterator[Any]:
+        """
+        打开镜像中的文件系统供按需读取：稀疏镜像经 SparseImage 只读取用到的块，
+        RAW 镜像以 mmap 映射，都不展开也不解包；解析错误统一转换为 OperationError。
+        """
+        sparse = self._is_sparse_image(img_path)
+        try:
+            source = SparseImage(img_path) if sparse else MappedFile(img_path)
+        except (OSError, ValueError) as exc:
+            raise OperationError(f"无法打开镜像 {img_path.name}：{exc}") from None
+        fs_type = filesystem_from_header(source.read_at(0, 4096))
+        try:
+            if fs_type == "ext4":
+                fs = Ext4Image(img_path, source)
+            elif fs_type == "erofs":
+                fs = ErofsImage(img_path, source)
+            else:
+                source.close()
+                raise OperationError(f"{img_path.name} 的文件系统（{fs_type or '未知'}）不支持按需浏览，请先分解")
+            self._log(f"{img_path.name}：{fs_type}{'（稀疏镜像）' if sparse else ''}，块大小 {fs.block_size}")
+            with fs:
+                yield fs
+        except (Ext4Error, ErofsError, SparseError) as exc:
+            raise OperationError(str(exc)) from None
 
-        self._update_progress(1.0, "所有 IMG 打包完成")
+    # ================================================================== #
+    # 文件索引
+    # ================================================================== #
+    def index_img(
+        self,
+        project_dir: Path,
+        targets: Optional[Iterable[Path]] = None,
+        force: bool = False,
+        extract_root: Optional[Path] = None,
+    ) -> None:
+        """
+        为镜像建立文件索引（<项目>/zlo_index.db）：路径、大小、权限、属主、扩展属性与内容哈希。
+
+        直接读取镜像（RAW 或稀疏），不依赖分解结果。以镜像内容哈希为键增量更新：
+        文件状态未变的镜像直接跳过，哈希未变的只更新状态；已不在项目中的镜像的记录一并删除。
+        extract_root 指向刚分解出的 zlo_out 时，压缩的 EROFS 文件从分解结果计算哈希，
+        否则临时交给 extract.erofs 解压。
+        """
+        project_dir = self._ensure_project(project_dir)
+        project_images = [
+            entry.path for entry in self._inventory(project_dir, top_level=True).entries(*FS_KINDS, top_level=True)
+        ]
+        images = list(targets) if targets else project_images
+        if not images:
+            raise OperationError("项目中未找到可索引的 *.img 文件")
+
+        started = time.monotonic()
+        total = len(images)
+        self._update_progress(0.0, f"准备索引 {total} 个镜像")
+        with FileIndex(project_dir / INDEX_DB_NAME) as index:
+            for idx, img_path in enumerate(images, start=1):
+                self._log(f"[{idx}/{total}] 索引：{img_path.name}")
+                extracted = extract_root / img_path.stem if extract_root else None
+                status = self._index_single_img(index, img_path, force, extracted)
+                self._update_progress(idx / total, f"{img_path.name} {status}")
+            current = {path.name for path in project_images} | {path.name for path in images}
+            for stale in index.images():
+                if stale.name not in current:
+                    index.remove_image(stale.name)
+                    self._log(f"移除已不在项目中的镜像的索引：{stale.name}（{stale.files} 项）")
+        self._log(f"索引完成：{INDEX_DB_NAME}，耗时 {time.monotonic() - started:.1f}s")
+
+    def _index_single_img(self, index: FileIndex, img_path: Path, force: bool, extracted: Optional[Path]) -> str:
+        st = img_path.stat()
+        known = index.image(img_path.name)
+        if known and not force and (known.size, known.mtime_ns) == (st.st_size, st.st_mtime_ns):
+            self._log(f"  镜像未变化，沿用已有索引（{known.files} 项）")
+            return "未变化"
+        image_hash = self.cache.file_hash(img_path) if self.cache is not None else file_hash(str(img_path))
+        if known and not force and known.sha256 == image_hash:
+            index.touch_image(img_path.name, st.st_size, st.st_mtime_ns)
+            self._log(f"  镜像内容未变化（哈希相同），沿用已有索引（{known.files} 项）")
+            return "未变化"
+
+        started = time.monotonic()
+        try:
+            with contextlib.ExitStack() as stack:
+                fs = stack.enter_context(self._open_fs_image(img_path))
+                fs_type = "erofs" if isinstance(fs, ErofsImage) else "ext4"
+                fallback: List[Optional[Path]] = []
+
+                def compressed_root() -> Optional[Path]:
+                    # 第一次遇到压缩文件时才决定哈希来源，全部未压缩的镜像不会触发解压
+                    if not fallback:
+                        if extracted is not None and extracted.is_dir():
+                            fallback.append(extracted)
+                        else:
+                            self._log("  镜像含压缩文件，临时用 extract.erofs 解压以计算哈希")
+                            tmp_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+                            fallback.append(self._extract_erofs_path(img_path, "/", tmp_dir))
+                    return fallback[0]
+
+                count = index.replace_image(
+                    img_path.name, image_hash, st.st_size, st.st_mtime_ns, fs_type,
+                    self._index_entries(fs, compressed_root),
+                )
+        except OperationError as exc:
+            self._log(f"  ⚠️ 无法索引：{exc}")
+            return "已跳过"
+        self._log(f"  已索引 {count} 项，耗时 {time.monotonic() - started:.1f}s")
+        return "索引完成"
+
+    def _index_entries(self, fs: Any, compressed_root: Callable[[], Optional[Path]]) -> Iterator[IndexedFile]:
+        """遍历镜像产出索引记录；硬链接只计算一次哈希"""
+        link_hashes: Dict[int, Optional[str]] = {}
+        for rel, node in fs.walk():
+            digest: Optional[str] = None
+            if node.is_reg:
+                if node.ino in link_hashes:
+                    digest = link_hashes[node.ino]
+                elif isinstance(fs, ErofsImage) and node.compressed:
+                    root = compressed_root()
+                    source = root / rel if root is not None else None
+                    digest = file_hash(str(source)) if source is not None and source.is_file() else None
+                else:
+                    hasher = hashlib.sha256()
+                    for chunk in fs.iter_chunks(node):
+                        hasher.update(chunk)
+                    digest = hasher.hexdigest()
+                if node.links > 1:
+                    link_hashes[node.ino] = digest
+            # system.data 是 ext4 内联数据的存放位置，不是真正的属性
+            xattrs = {name: value for name, value in fs.xattrs(node).items() if name != "system.data"}
+            yield IndexedFile(
+                path=f"/{rel}",
+                size=node.size,
+                mode=node.mode,
+                uid=node.uid,
+                gid=node.gid,
+                mtime_ns=node.mtime_ns,
+                link=fs.readlink(node) if node.is_symlink else None,
+                sha256=digest,
+                selinux=selinux_context(xattrs),
+                capabilities=capabilities(xattrs),
+                xattrs={name: value.hex() for name, value in xattrs.items()},
+            )
 
     # ================================================================== #
     # SUPER 操作
     # ================================================================== #
-    def unpack_super(self, project_dir: Path) -> None:
-        """分解 super 镜像到项目根目录"""
+    def unpack_super(
+        self,
+        project_dir: Path,
+        only: Optional[List[str]] = None,
+        jobs: Optional[int] = None,
+    ) -> None:
+        """
+        分解 super 镜像到项目根目录。
+
+        直接读取 LP 元数据，只复制所选分区的 extent；稀疏 super 按 chunk 映射读取，
+        无需先展开。only 为空时提取全部分区，多个分区按 jobs 并行。
+        """
         project_dir = self._ensure_project(project_dir)
 
         super_img = self._locate_super_image(project_dir)
         if super_img is None:
             raise OperationError("未在项目中找到 super 镜像")
 
-        simg2img = self.env.find_binary("simg2img")
-        lpunpack = self.env.find_binary("lpunpack")
+        self._update_progress(0.0, "准备分解 super 镜像")
 
-        if lpunpack is None:
-            raise OperationError("缺少 lpunpack，请确认已放入 bin 目录或安装在 PATH 中")
+        with self._open_image(super_img) as source:
+            try:
+                metadata = LpMetadata(source)
+            except LpMetadataError as exc:
+                raise OperationError(f"{super_img.name}：{exc}") from exc
+
+            self._log_lp_metadata(metadata)
+            if any(ext.target_source != 0 for part in metadata.partitions for ext in part.extents):
+                raise OperationError("暂不支持多块设备（retrofit）的 super 镜像")
+
+            by_name = metadata.partition_map()
+            if only:
+                missing = [name for name in only if name not in by_name]
+                if missing:
+                    raise OperationError(f"super 中不存在分区：{', '.join(missing)}（可选：{', '.join(by_name)}）")
+                selected = [by_name[name] for name in only]
+            else:
+                selected = list(metadata.partitions)
+
+            empty = [part.name for part in selected if not part.extents]
+            if empty:
+                self._log(f"跳过空分区：{', '.join(empty)}")
+            selected = [part for part in selected if part.extents]
+            if not selected:
+                raise OperationError("没有需要提取的分区")
+
+            # 直接按 extent 读取各分区头部检测文件系统，提取前统一报告
+            self._log("分区文件系统：")
+            for part in selected:
+                fs_type = filesystem_from_header(self._read_lp_range(source, part, 0, FS_HEADER_SIZE))
+                self._log(f"  {part.name}：{fs_type or '未知'}")
+
+            outputs = [f"{part.name}.img" for part in selected]
+            cache_key = self._cache_key([super_img], "unpack_super", ",".join(sorted(outputs)))
+            if self._cache_restore(cache_key, project_dir, super_img.name):
+                self._log_cache_stats()
+                self._update_progress(1.0, "super 镜像分解完成")
+                return
+
+            workers = min(jobs or os.cpu_count() or 1, len(selected))
+            self._log(f"提取 {len(selected)} 个分区到：{project_dir}（{workers} 个工作线程）")
+
+            # 无 os.pread 的平台上多个线程共享同一文件句柄，需要加锁
+            source_lock = threading.Lock()
+
+            def extract(part: LpPartition) -> None:
+                out_img = project_dir / f"{part.name}.img"
+                self._log(f"  提取：{part.name}（{part.size // (1024*1024)} MB，{len(part.extents)} 个 extent）")
+                self._extract_lp_partition(source, part, out_img, source_lock)
+                self._log(f"  完成：{out_img.name}（{_size_summary(out_img)}）")
+
+            self._map_parallel(selected, extract, workers, lambda part: part.name, "提取完成")
+
+        self._cache_store(cache_key, project_dir, outputs, super_img.name)
+        self._log_cache_stats()
+        self._log("完成 super 镜像分解")
+        self._update_progress(1.0, "super 镜像分解完成")
+
+    def pack_super(
+        self,
+        project_dir: Path,
+        partitions: Optional[List[str]] = None,
+        sparse: bool = False,
+        *,
+        device_size: Optional[int] = None,
+        ab: bool = False,
+        shrink: bool = False,
+        alignment: int = LP_DEFAULT_PARTITION_ALIGNMENT,
+        plan_only: bool = False,
+    ) -> None:
+        """
+        打包多个分区镜像为 super.img，输出到 zlo_super/
 
-        self._update_progress(0.0, "准备分解 super 镜像")
+        原生写入 LP 元数据并按 extent 布局分区；稀疏输入按 chunk 映射直接读取，
+        不再展开到临时目录。sparse=True 时输出稀疏 super，空白区域记为 DONT_CARE 不落盘。
 
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            tmp_dir_path = Path(tmp_dir)
-            raw_path = super_img
-
-            if self._is_sparse_image(super_img):
-                if simg2img is None:
-                    raise OperationError("缺少 simg2img，无法处理稀疏 super 镜像")
-                raw_path = tmp_dir_path / f"{super_img.stem}.raw.img"
-                self._log("检测到稀疏 super 镜像，正在转换为 RAW ...")
-                self._run([str(simg2img), str(super_img), str(raw_path)])
-                self._update_progress(0.4, "稀疏镜像转换完成")
-
-            self._log(f"使用 lpunpack 解包到：{project_dir}")
-            self._run([str(lpunpack), str(raw_path), str(project_dir)])
-            self._log("完成 super 镜像分解")
-            self._update_progress(1.0, "super 镜像分解完成")
-
-    def pack_super(self, project_dir: Path, partitions: Optional[List[str]] = None) -> None:
-        """打包多个分区镜像为 super.img，输出到 zlo_super/"""
+        未指定 device_size 时取容纳布局的最小值；ab=True 时按 _a/_b 分组并为 _b 槽预留同等空间；
+        shrink=True 时把 RAW ext4 输入的私有副本收缩到最小后再布局，zlo_pack 中的镜像保持不变。
+        构建前输出布局规划与浪费的字节数，
+        plan_only=True 时只输出规划。
+        """
         project_dir = self._ensure_project(project_dir)
         pack_dir = project_dir / "zlo_pack"
         if not pack_dir.exists():
             raise OperationError("未找到 zlo_pack 目录，请先打包分区镜像")
 
-        lpmake = self.env.find_binary("lpmake")
-        if not lpmake:
-            raise OperationError("缺少 lpmake 工具")
-
         # 收集候选分区（优先 RAW .img）
         candidates = self._collect_super_partitions(pack_dir)
         if not candidates:
@@ -277,85 +1420,64 @@ class OperationRunner:
 
         self._update_progress(0.0, f"准备打包 {len(selected)} 个分区到 super")
 
-        # 处理稀疏镜像
-        simg2img = self.env.find_binary("simg2img")
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            tmp_dir_path = Path(tmp_dir)
-            raw_images: Dict[str, Path] = {}
-            total_size = 0
-
+        out_dir = project_dir / "zlo_super"
+        with contextlib.ExitStack() as stack:
+            if shrink and not plan_only:
+                # 副本与输出放在同一文件系统，便于 reflink
+                out_dir.mkdir(parents=True, exist_ok=True)
+                work_dir = Path(stack.enter_context(tempfile.TemporaryDirectory(dir=out_dir)))
+                selected = {
+                    name: self._shrink_super_input(name, src_path, work_dir) for name, src_path in selected.items()
+                }
+
+            sources: Dict[str, BinaryIO] = {}
+            sizes: Dict[str, int] = {}
             for idx, (name, src_path) in enumerate(selected.items(), start=1):
-                self._log(f"[{idx}/{len(selected)}] 处理分区：{name}")
-                if self._is_sparse_image(src_path):
-                    if not simg2img:
-                        raise OperationError(f"分区 {name} 是稀疏镜像，但缺少 simg2img")
-                    raw_path = tmp_dir_path / f"{name}.raw.img"
-                    self._log(f"  解稀疏：{src_path.name} -> {raw_path.name}")
-                    self._run([str(simg2img), str(src_path), str(raw_path)])
-                    raw_images[name] = raw_path
-                else:
-                    raw_images[name] = src_path
+                source = stack.enter_context(self._open_image(src_path))
+                size = source.size if isinstance(source, SparseImage) else src_path.stat().st_size
+                kind = "稀疏" if isinstance(source, SparseImage) else "RAW"
+                self._log(f"[{idx}/{len(selected)}] 分区 {name}：{src_path.name}（{kind}，{size // (1024*1024)} MB）")
+                lp_name = self._super_slot_name(name) if ab else name
+                sources[lp_name] = source
+                sizes[lp_name] = size
 
-                size = raw_images[name].stat().st_size
-                total_size += size
-                self._log(f"  大小：{size // (1024*1024)} MB")
-
-            # 计算 device-size（+15% 余量，4MB 对齐，最小 1GB）
-            margin = int(total_size * 0.15)
-            device_size = total_size + margin
-            align = 4 * 1024 * 1024
-            device_size = ((device_size + align - 1) // align) * align
-            device_size = max(device_size, 1024 * 1024 * 1024)
-
-            self._log(f"原始大小：{total_size // (1024*1024)} MB")
-            self._log(f"设备大小（含余量）：{device_size // (1024*1024)} MB")
+            try:
+                builder = self._plan_super_layout(sizes, ab=ab, device_size=device_size, alignment=alignment)
+                placements = builder.layout()
+                header = builder.header_region()
+            except LpMetadataError as exc:
+                raise OperationError(f"super 布局失败：{exc}") from exc
+            self._log_super_plan(builder, placements, sizes)
+            if plan_only:
+                return
 
-            # 组装 lpmake 参数
-            out_dir = project_dir / "zlo_super"
             out_dir.mkdir(parents=True, exist_ok=True)
             out_super = out_dir / "super.img"
+            tmp_super = out_dir / ".super.img.tmp"
 
-            args = [
-                str(lpmake),
-                "--metadata-size", "65536",
-                "--super-name", "super",
-                "--device-size", str(device_size),
-            ]
-
-            for name, raw_path in raw_images.items():
-                size = raw_path.stat().st_size
-                args.extend([
-                    "--partition", f"{name}:readonly",
-                    "--image", f"{name}={raw_path}",
-                    "--partition-size", f"{name}:{size}",
-                ])
-
-            args.extend(["--output", str(out_super)])
+            with tmp_super.open("wb") as out:
+                if sparse:
+                    self._write_sparse_super(out, header, placements, sources, sizes, builder.device_size)
+                else:
+                    self._write_raw_super(out, header, placements, sources, sizes, builder.device_size)
+                written = out.tell() if sparse else sum(sizes.values()) + len(header)
+            os.replace(tmp_super, out_super)
 
-            self._log("执行 lpmake ...")
-            self._run(args)
-            self._log(f"完成：{out_super.relative_to(project_dir)}")
-            self._update_progress(1.0, "super 镜像打包完成")
+        self._log(f"实际写入：{written // (1024*1024)} MB / 设备大小：{builder.device_size // (1024*1024)} MB")
+        self._log(f"完成：{out_super.relative_to(project_dir)}")
+        self._update_progress(1.0, "super 镜像打包完成")
 
     # ================================================================== #
     # DAT 操作 (system.new.dat)
     # ================================================================== #
-    def unpack_dat(self, project_dir: Path, dat_files: Optional[List[Path]] = None) -> None:
-        """分解 .new.dat + .transfer.list 到 IMG"""
+    def unpack_dat(self, project_dir: Path, dat_files: Optional[List[Path]] = None, sparse: bool = False) -> None:
+        """分解 .new.dat + .transfer.list 到 IMG；sparse=True 时直接输出稀疏镜像"""
         project_dir = self._ensure_project(project_dir)
 
-        sdat2img_py = self._find_sdat2img_script()
-        if not sdat2img_py:
-            raise OperationError("缺少 sdat2img.py 脚本，请放入 bin/Linux 或 bin/windows_x86 目录")
-
-        python = shutil.which("python3") or shutil.which("python")
-        if not python:
-            raise OperationError("未找到 Python 解释器")
-
         if dat_files:
             targets = dat_files
         else:
-            targets = list(project_dir.rglob("*.new.dat"))
+            targets = [entry.path for entry in self._inventory(project_dir).entries("dat")]
 
         if not targets:
             raise OperationError("未找到 .new.dat 文件")
@@ -374,31 +1496,96 @@ class OperationRunner:
                 continue
 
             base_name = dat_path.stem.replace(".new", "")
-            out_img = out_dir / f"{base_name}.img"
+            out_img = out_dir / (f"{base_name}.sparse.img" if sparse else f"{base_name}.img")
+
+            cache_key = self._cache_key([dat_path, transfer_list], "unpack_dat", f"sparse={sparse}")
+            if self._cache_restore(cache_key, out_dir, dat_path.name):
+                self._update_progress(idx / total, f"{dat_path.name} 分解完成")
+                continue
 
-            cmd = [python, str(sdat2img_py), str(transfer_list), str(dat_path), str(out_img)]
-            self._run(cmd)
-            self._log(f"  完成：{out_img.relative_to(project_dir)}")
+            try:
+                tlist = TransferList.parse(transfer_list)
+            except TransferListError as exc:
+                raise OperationError(f"{transfer_list.name} 解析失败：{exc}") from exc
+            self._log(f"  transfer.list v{tlist.version}（{tlist.version_name}）")
+            fs_type = self._detect_dat_filesystem(tlist, lambda: dat_path.open("rb"), seekable=True)
+            self._log(f"  文件系统：{fs_type or '未知'}")
+
+            def report(fraction: float, name: str = dat_path.name, base: int = idx - 1) -> None:
+                self._update_progress((base + fraction) / total, f"{name} 写入中 {fraction * 100:.0f}%")
+
+            with dat_path.open("rb") as src:
+                self._write_transfer_image(tlist, src, out_img, sparse, report)
+            self._cache_store(cache_key, out_dir, [out_img.name], dat_path.name)
+            self._log(f"  完成：{out_img.relative_to(project_dir)}（{_size_summary(out_img)}）")
             self._update_progress(idx / total, f"{dat_path.name} 分解完成")
 
+        self._log_cache_stats()
         self._update_progress(1.0, "DAT 文件分解完成")
 
-    def pack_dat(self, project_dir: Path, img_files: Optional[List[Path]] = None) -> None:
-        """打包 IMG 为 .new.dat 格式"""
+    def unpack_datbr(self, project_dir: Path, files: Optional[List[Path]] = None) -> None:
+        """.new.dat.br 边解压边写入 IMG，中间的 .new.dat 不落盘"""
         project_dir = self._ensure_project(project_dir)
 
-        img2sdat_py = self._find_img2sdat_script()
-        if not img2sdat_py:
-            raise OperationError("缺少 img2sdat.py 脚本，请放入 bin/Linux 或 bin/windows_x86 目录")
+        targets = files if files else [
+            entry.path for entry in self._inventory(project_dir).entries("brotli")
+            if entry.path.name.endswith(".new.dat.br")
+        ]
+        if not targets:
+            raise OperationError("未找到 .new.dat.br 文件")
+
+        out_dir = project_dir / "zlo_pack"
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        total = len(targets)
+        self._update_progress(0.0, f"准备分解 {total} 个 DAT.BR 文件")
+
+        for idx, br_path in enumerate(targets, start=1):
+            self._log(f"[{idx}/{total}] 分解：{br_path.name}")
+            base_name = br_path.name[: -len(".new.dat.br")]
+            transfer_list = br_path.parent / f"{base_name}.transfer.list"
+            if not transfer_list.exists():
+                self._log(f"  警告：缺少 {transfer_list.name}，跳过")
+                continue
+
+            try:
+                tlist = TransferList.parse(transfer_list)
+            except TransferListError as exc:
+                raise OperationError(f"{transfer_list.name} 解析失败：{exc}") from exc
+            self._log(f"  transfer.list v{tlist.version}（{tlist.version_name}）")
+
+            def report(fraction: float, name: str = br_path.name, base: int = idx - 1) -> None:
+                self._update_progress((base + fraction) / total, f"{name} 写入中 {fraction * 100:.0f}%")
+
+            out_img = out_dir / f"{base_name}.img"
+            cache_key = self._cache_key([br_path, transfer_list], "unpack_datbr")
+            if self._cache_restore(cache_key, out_dir, br_path.name):
+                self._update_progress(idx / total, f"{br_path.name} 分解完成")
+                continue
+            fs_type = self._detect_dat_filesystem(
+                tlist, lambda path=br_path: self._open_brotli_stream(path), seekable=False
+            )
+            self._log(f"  文件系统：{fs_type or '未知'}")
+
+            with self._open_brotli_stream(br_path) as stream:
+                self._write_transfer_stream(tlist, stream, out_img, report)
+            self._cache_store(cache_key, out_dir, [out_img.name], br_path.name)
+            self._log(f"  完成：{out_img.relative_to(project_dir)}（{_size_summary(out_img)}）")
+            self._update_progress(idx / total, f"{br_path.name} 分解完成")
 
-        python = shutil.which("python3") or shutil.which("python")
-        if not python:
-            raise OperationError("未找到 Python 解释器")
+        self._log_cache_stats()
+        self._update_progress(1.0, "DAT.BR 文件分解完成")
+
+    def pack_dat(self, project_dir: Path, img_files: Optional[List[Path]] = None, version: int = 4) -> None:
+        """打包 IMG（RAW 或稀疏）为全量 OTA 的 .new.dat + .transfer.list + .patch.dat"""
+        project_dir = self._ensure_project(project_dir)
+        if version not in ANDROID_VERSIONS:
+            raise OperationError(f"不支持的 transfer.list 版本：{version}（可选 1~4）")
 
         if img_files:
             targets = img_files
         else:
-            targets = list(project_dir.rglob("*.img"))
+            targets = [entry.path for entry in self._inventory(project_dir).images()]
 
         if not targets:
             raise OperationError("未找到 .img 文件")
@@ -412,11 +1599,15 @@ class OperationRunner:
         for idx, img_path in enumerate(targets, start=1):
             self._log(f"[{idx}/{total}] 打包：{img_path.name}")
             part_name = img_path.stem
+            if part_name.endswith(".sparse"):
+                part_name = part_name[: -len(".sparse")]
             part_out = out_dir / part_name
             part_out.mkdir(parents=True, exist_ok=True)
 
-            cmd = [python, str(img2sdat_py), str(img_path), "-o", str(part_out), "-v", "4", "-p", part_name]
-            self._run(cmd)
+            def report(fraction: float, name: str = img_path.name, base: int = idx - 1) -> None:
+                self._update_progress((base + fraction) / total, f"{name} 编码中 {fraction * 100:.0f}%")
+
+            self._encode_new_dat(img_path, part_out, part_name, version, report)
             self._log(f"  完成：{part_out.relative_to(project_dir)}")
             self._update_progress(idx / total, f"{img_path.name} 打包完成")
 
@@ -425,77 +1616,62 @@ class OperationRunner:
     # ================================================================== #
     # BR 操作 (Brotli)
     # ================================================================== #
-    def unpack_br(self, project_dir: Path, files: Optional[Iterable[Path]] = None) -> None:
-        """解压 .br 文件"""
+    def unpack_br(self, project_dir: Path, files: Optional[Iterable[Path]] = None, jobs: Optional[int] = None) -> None:
+        """解压 .br 文件；多个文件按 jobs（默认 CPU 核数）并行"""
         project_dir = self._ensure_project(project_dir)
-        brotli = self.env.find_binary("brotli")
-        if brotli is None:
-            raise OperationError("缺少 brotli 工具")
+        self._require_brotli_backend()
 
-        targets = list(files) if files else sorted(project_dir.rglob("*.br"))
+        targets = list(files) if files else [entry.path for entry in self._inventory(project_dir).entries("brotli")]
+        targets = [p for p in targets if p.is_file()]
         if not targets:
             raise OperationError("未找到 .br 文件")
 
-        total = len(targets)
-        self._update_progress(0.0, f"准备解压 {total} 个文件")
-
-        for index, br_path in enumerate(targets, start=1):
-            if not br_path.is_file():
-                continue
-            out_path = br_path.with_suffix("")
-            self._log(f"[{index}/{total}] 解压：{br_path.name} -> {out_path.name}")
-            self._run([str(brotli), "-d", "-f", "-o", str(out_path), str(br_path)])
-            self._update_progress(index / total, f"{br_path.name} 解压完成")
-
+        self._run_brotli_jobs(targets, decompress=True, quality=0, jobs=jobs)
         self._update_progress(1.0, "Brotli 文件解压完成")
 
-    def pack_br(self, project_dir: Path, files: Optional[Iterable[Path]] = None, quality: int = 5) -> None:
-        """压缩文件为 .br 格式"""
+    def pack_br(
+        self,
+        project_dir: Path,
+        files: Optional[Iterable[Path]] = None,
+        quality: int = 5,
+        jobs: Optional[int] = None,
+    ) -> None:
+        """压缩文件为 .br 格式；多个文件按 jobs（默认 CPU 核数）并行"""
         project_dir = self._ensure_project(project_dir)
-        brotli = self.env.find_binary("brotli")
-        if brotli is None:
-            raise OperationError("缺少 brotli 工具")
+        self._require_brotli_backend()
 
         if files:
             targets = list(files)
         else:
-            # 默认打包 .dat 文件
-            targets = sorted(project_dir.rglob("*.dat"))
+            # 默认打包项目中与 pack_dat 输出（zlo_pack）中的 .new.dat
+            targets = [entry.path for entry in self._inventory(project_dir).entries("dat")]
+            pack_dir = project_dir / "zlo_pack"
+            if pack_dir.is_dir():
+                targets += [entry.path for entry in self._inventory(pack_dir).entries("dat")]
 
         if not targets:
             raise OperationError("未找到可打包的文件")
 
-        total = len(targets)
-        self._update_progress(0.0, f"准备压缩 {total} 个文件")
-
-        for index, input_path in enumerate(targets, start=1):
-            out_path = Path(str(input_path) + ".br")
-            self._log(f"[{index}/{total}] 压缩：{input_path.name} -> {out_path.name} (quality={quality})")
-            self._run([str(brotli), "-q", str(quality), "-f", "-o", str(out_path), str(input_path)])
-            self._update_progress(index / total, f"{out_path.name} 打包完成")
-
+        self._run_brotli_jobs(targets, decompress=False, quality=quality, jobs=jobs)
         self._update_progress(1.0, "Brotli 文件打包完成")
 
     # ================================================================== #
     # BIN 操作 (payload.bin)
     # ================================================================== #
-    def unpack_bin(self, project_dir: Path, payload_bin: Optional[Path] = None) -> None:
-        """分解 payload.bin"""
+    def unpack_bin(self, project_dir: Path, payload_bin: Optional[Path] = None, jobs: Optional[int] = None) -> None:
+        """分解 payload.bin（全量 OTA）；manifest 只解析一次，操作在进程池中并行解码"""
         project_dir = self._ensure_project(project_dir)
 
         if payload_bin is None:
-            candidates = list(project_dir.rglob("payload.bin"))
+            candidates = self._inventory(project_dir).entries("payload")
             if not candidates:
                 raise OperationError("未找到 payload.bin")
-            payload_bin = candidates[0]
+            # 同时存在多个时优先名为 payload.bin 的文件
+            payload_bin = min(candidates, key=lambda entry: (entry.path.name != "payload.bin", entry.path)).path
 
         if not payload_bin.exists():
             raise OperationError(f"payload.bin 不存在：{payload_bin}")
 
-        pdg = self.env.find_binary("payload-dumper-go")
-        if not pdg:
-            raise OperationError("缺少 payload-dumper-go 工具，请下载并放入 bin 目录")
-
         out_dir = project_dir / "zlo_pack"
         out_dir.mkdir(parents=True, exist_ok=True)
 
@@ -503,22 +1679,71 @@ class OperationRunner:
         self._log(f"分解：{payload_bin.name}")
         self._log(f"输出：{out_dir.relative_to(project_dir)}")
 
-        # 列出分区
-        partitions_raw = self._run([str(pdg), "-l", str(payload_bin)], capture_output=True)
-        partitions = [p.strip() for p in partitions_raw.split(",") if p.strip()]
+        cache_key = self._cache_key([payload_bin], "unpack_bin")
+        if self._cache_restore(cache_key, out_dir, payload_bin.name):
+            self._log_cache_stats()
+            self._update_progress(1.0, "payload.bin 分解完成")
+            return
 
-        if not partitions:
-            raise OperationError("未能列出 payload.bin 中的分区")
+        try:
+            payload = Payload(payload_bin)
+            for part in payload.partitions:
+                payload.check_full_ota(part)
+        except PayloadError as exc:
+            raise OperationError(str(exc)) from exc
 
-        self._log(f"检测到 {len(partitions)} 个分区")
+        if not payload.partitions:
+            raise OperationError("未能列出 payload.bin 中的分区")
 
-        # 逐个解包
-        total = len(partitions)
-        for idx, part in enumerate(partitions, start=1):
-            self._log(f"[{idx}/{total}] 解包分区：{part}")
-            self._run([str(pdg), "-p", part, "-o", str(out_dir), str(payload_bin)], cwd=out_dir)
-            self._update_progress(idx / total, f"{part} 解包完成")
+        sizes = partition_sizes(payload)
+        self._log(f"检测到 {len(payload.partitions)} 个分区（payload v{payload.version}）")
+        for part in payload.partitions:
+            self._log(f"  {part.name}：{sizes[part.name] // (1024*1024)} MB，{len(part.operations)} 个操作")
+
+        # 预先创建并截断输出文件，未写区域（ZERO/DISCARD）保持为空洞
+        tasks: List[Tuple[str, Tuple[InstallOperation, ...]]] = []
+        for part in payload.partitions:
+            out_img = out_dir / f"{part.name}.img"
+            # 可能是指向缓存条目的硬链接，先解除再写入
+            out_img.unlink(missing_ok=True)
+            with out_img.open("wb") as fh:
+                fh.truncate(sizes[part.name])
+            for batch in batch_operations(part.operations, payload.block_size):
+                tasks.append((part.name, batch))
+
+        workers = max(1, min(jobs or os.cpu_count() or 1, len(tasks) or 1))
+        self._log(f"解码 {len(tasks)} 个任务：{workers} 个工作进程")
+        total_bytes = sum(op.dst_blocks for _, batch in tasks for op in batch) * payload.block_size or 1
+        done_bytes = 0
+
+        def task_args(name: str, batch: Tuple[InstallOperation, ...]) -> Tuple[Any, ...]:
+            out_img = out_dir / f"{name}.img"
+            return str(payload_bin), payload.data_offset, payload.block_size, str(out_img), batch
 
+        try:
+            if workers == 1:
+                for name, batch in tasks:
+                    apply_operations(*task_args(name, batch))
+                    done_bytes += sum(op.dst_blocks for op in batch) * payload.block_size
+                    self._update_progress(done_bytes / total_bytes, f"{name} 解码中")
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = {
+                        pool.submit(apply_operations, *task_args(name, batch)): (name, batch) for name, batch in tasks
+                    }
+                    for future in as_completed(futures):
+                        name, batch = futures[future]
+                        future.result()
+                        done_bytes += sum(op.dst_blocks for op in batch) * payload.block_size
+                        self._update_progress(done_bytes / total_bytes, f"{name} 解码中")
+        except (PayloadError, lzma.LZMAError, OSError) as exc:
+            raise OperationError(f"payload 解码失败：{exc}") from exc
+
+        for part in payload.partitions:
+            out_img = out_dir / f"{part.name}.img"
+            self._log(f"  完成：{out_img.relative_to(project_dir)}（{_size_summary(out_img)}）")
+        self._cache_store(cache_key, out_dir, [f"{part.name}.img" for part in payload.partitions], payload_bin.name)
+        self._log_cache_stats()
         self._update_progress(1.0, "payload.bin 分解完成")
 
     def pack_bin(self, project_dir: Path) -> None:
@@ -566,21 +1791,521 @@ class OperationRunner:
         except OSError:
             return False
 
+    @_image_io_errors()
+    def _desparse(self, sparse_path: Path, raw_path: Path) -> int:
+        """原生展开稀疏镜像（空洞不落盘），返回展开后的字节数"""
+        with SparseImage(sparse_path) as image:
+            data_bytes = sum(c.out_size for c in image.data_chunks())
+            self._log(f"  有效数据：{data_bytes // (1024*1024)} MB / 展开大小：{image.size // (1024*1024)} MB")
+            image.expand_to(raw_path)
+            self._log(f"  RAW 镜像：{_size_summary(raw_path)}")
+            return image.size
+
+    def _prepare_raw_input(self, img_path: Path, private_path: Path) -> Path:
+        """RAW 镜像：只读提取的文件系统直接使用原文件，其余生成私有副本"""
+        fs_type = self._detect_filesystem_type(img_path)
+        if fs_type in READONLY_EXTRACT_FS:
+            self._log("  已是 RAW 镜像，直接只读解包（零拷贝）")
+            return img_path
+        method = clone_file(img_path, private_path)
+        self._log(f"  已是 RAW 镜像，生成私有副本（{method}，{_size_summary(private_path)}）")
+        return private_path
+
+    @_image_io_errors()
+    def _write_transfer_image(
+        self,
+        tlist: TransferList,
+        src: BinaryIO,
+        out_img: Path,
+        sparse: bool,
+        report: Callable[[float], None],
+    ) -> None:
+        """按 transfer.list 把 .new.dat 数据写成镜像；zero/erase、未覆盖区域与数据中的全零块不落盘"""
+        data_bytes = tlist.data_blocks * SDAT_BLOCK_SIZE
+        available = os.fstat(src.fileno()).st_size
+        if available < data_bytes:
+            raise OperationError(f"new.dat 数据不足：需要 {data_bytes} 字节，实际 {available} 字节")
+        image_size = tlist.total_blocks * SDAT_BLOCK_SIZE
+        self._log(f"  数据：{data_bytes // (1024*1024)} MB / 镜像：{image_size // (1024*1024)} MB")
+
+        written = 0
+        # 可能是指向缓存条目的硬链接，先解除再写入
+        out_img.unlink(missing_ok=True)
+        with out_img.open("wb") as out:
+            if not sparse:
+                # 按数据流顺序做大块定位写入，zero/erase 保持为空洞
+                for ext in tlist.data_extents():
+                    src_off = ext.src_block * SDAT_BLOCK_SIZE
+                    dst_off = ext.dst_block * SDAT_BLOCK_SIZE
+                    remaining = ext.blocks * SDAT_BLOCK_SIZE
+                    while remaining > 0:
+                        step = min(remaining, 4 * COPY_BUFFER_SIZE)
+                        copy_range(src, src_off, out, dst_off, step, holes=True)
+                        src_off += step
+                        dst_off += step
+                        remaining -= step
+                        written += step
+                        report(written / data_bytes if data_bytes else 1.0)
+                out.truncate(image_size)
+                return
+
+            # 稀疏输出需按输出块号递增排列；未覆盖的区域记为 DONT_CARE
+            spans: List[Tuple[int, int, Optional[int]]] = [
+                (ext.dst_block, ext.blocks, ext.src_block) for ext in tlist.data_extents()
+            ]
+            spans.extend((begin, end - begin, None) for begin, end in tlist.zero_ranges())
+            spans.sort()
+            writer = SparseWriter(out, SDAT_BLOCK_SIZE)
+            cursor = 0
+            for begin, blocks, src_block in spans:
+                if begin < cursor:
+                    raise OperationError(f"transfer.list 中存在重叠区间：块 {begin}")
+                writer.add_dont_care(begin - cursor)
+                if src_block is None:
+                    writer.add_fill(b"\0\0\0\0", blocks)
+                else:
+                    writer.add_raw_from(src, src_block * SDAT_BLOCK_SIZE, blocks * SDAT_BLOCK_SIZE)
+                    written += blocks * SDAT_BLOCK_SIZE
+                    report(written / data_bytes if data_bytes else 1.0)
+                cursor = begin + blocks
+            writer.finish(tlist.total_blocks)
+
+    @_image_io_errors()
+    def _encode_new_dat(
+        self,
+        img_path: Path,
+        part_out: Path,
+        part_name: str,
+        version: int,
+        report: Callable[[float], None],
+    ) -> None:
+        """流式编码：按 COPY_BUFFER_SIZE 读取镜像，全零块记为 zero，DONT_CARE 记为 erase"""
+        new_dat = part_out / f"{part_name}.new.dat"
+        with new_dat.open("wb") as out:
+            encoder = NewDataEncoder(out, SDAT_BLOCK_SIZE)
+            if self._is_sparse_image(img_path):
+                with SparseImage(img_path) as image:
+                    if image.block_size != SDAT_BLOCK_SIZE:
+                        raise OperationError(f"稀疏镜像块大小为 {image.block_size}，DAT 仅支持 4096")
+                    size = image.size
+                    for chunk in image.chunks():
+                        blocks = chunk.out_size // SDAT_BLOCK_SIZE
+                        if chunk.chunk_type == CHUNK_TYPE_DONT_CARE:
+                            encoder.add_erase(blocks)
+                        elif chunk.chunk_type == CHUNK_TYPE_FILL and chunk.fill == b"\0\0\0\0":
+                            encoder.add_zero(blocks)
+                        else:
+                            for offset in range(0, chunk.out_size, COPY_BUFFER_SIZE):
+                                step = min(COPY_BUFFER_SIZE, chunk.out_size - offset)
+                                encoder.add_data(image.read_at(chunk.out_offset + offset, step))
+                        report(chunk.out_offset / size if size else 1.0)
+            else:
+                size = img_path.stat().st_size
+                if size % SDAT_BLOCK_SIZE:
+                    raise OperationError(f"镜像大小不是 4096 的整数倍：{img_path.name}")
+                with img_path.open("rb") as src:
+                    done = 0
+                    while done < size:
+                        data = src.read(COPY_BUFFER_SIZE)
+                        if not data:
+                            raise OperationError(f"读取镜像失败：{img_path.name}")
+                        encoder.add_data(data)
+                        done += len(data)
+                        report(done / size)
+
+        (part_out / f"{part_name}.transfer.list").write_text(encoder.transfer_list(version), encoding="utf-8")
+        # 全量 OTA 没有差分数据
+        (part_out / f"{part_name}.patch.dat").write_bytes(b"")
+        zero_blocks = sum(end - begin for begin, end in encoder.zero_ranges)
+        self._log(
+            f"  数据块：{encoder.new_blocks} / 全零块：{zero_blocks} / 总块数：{encoder.cursor}"
+            f"（transfer.list v{version}）"
+        )
+
+    def _write_transfer_stream(
+        self,
+        tlist: TransferList,
+        stream: BinaryIO,
+        out_img: Path,
+        report: Callable[[float], None],
+    ) -> None:
+        """顺序消费 new.dat 数据流（不可 seek）写出 RAW 镜像，zero/erase 与数据中的全零块保持为空洞"""
+        data_bytes = tlist.data_blocks * SDAT_BLOCK_SIZE
+        image_size = tlist.total_blocks * SDAT_BLOCK_SIZE
+        self._log(f"  数据：{data_bytes // (1024*1024)} MB / 镜像：{image_size // (1024*1024)} MB")
+
+        written = 0
+        # 可能是指向缓存条目的硬链接，先解除再写入
+        out_img.unlink(missing_ok=True)
+        with out_img.open("wb") as out:
+            for ext in tlist.data_extents():
+                dst_off = ext.dst_block * SDAT_BLOCK_SIZE
+                remaining = ext.blocks * SDAT_BLOCK_SIZE
+                while remaining > 0:
+                    step = min(remaining, 4 * COPY_BUFFER_SIZE)
+                    data = _read_exact(stream, step)
+                    if len(data) < step:
+                        raise OperationError(f"new.dat 数据不足：需要 {data_bytes} 字节，实际 {written + len(data)} 字节")
+                    write_nonzero(out, data, dst_off)
+                    dst_off += step
+                    remaining -= step
+                    written += step
+                    report(written / data_bytes if data_bytes else 1.0)
+            out.truncate(image_size)
+
+    def _require_brotli_backend(self) -> None:
+        if brotli_lib is None and self.env.find_binary("brotli") is None:
+            raise OperationError("缺少 brotli 工具（或 Python brotli 模块）")
+
+    def _run_brotli_jobs(self, targets: List[Path], *, decompress: bool, quality: int, jobs: Optional[int]) -> None:
+        """并行压缩/解压多个文件，逐个输出字节数与吞吐量"""
+        total = len(targets)
+        workers = min(jobs or os.cpu_count() or 1, total)
+        action = "解压" if decompress else "压缩"
+        backend = "Python brotli 模块" if brotli_lib is not None else "brotli 命令行"
+        self._log(f"{action} {total} 个文件：{backend}，{workers} 个工作线程")
+        self._update_progress(0.0, f"准备{action} {total} 个文件")
+
+        def process(src: Path) -> Tuple[int, int, float]:
+            dst = src.with_suffix("") if decompress else Path(str(src) + ".br")
+            tmp = dst.with_name(f".{dst.name}.tmp")
+            if decompress:
+                self._log(f"  解压：{src.name} -> {dst.name}")
+            else:
+                self._log(f"  压缩：{src.name} -> {dst.name} (quality={quality})")
+            started = time.monotonic()
+            try:
+                self._brotli_file(src, tmp, decompress, quality)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
+            os.replace(tmp, dst)
+            elapsed = time.monotonic() - started
+            size_in, size_out = src.stat().st_size, dst.stat().st_size
+            raw_size = size_out if decompress else size_in
+            speed = raw_size / elapsed / (1024 * 1024) if elapsed > 0 else 0.0
+            self._log(
+                f"  {dst.name}：{size_in // 1024} KB -> {size_out // 1024} KB，"
+                f"耗时 {elapsed:.1f}s，{speed:.1f} MB/s"
+            )
+            return size_in, size_out, elapsed
+
+        results = self._map_parallel(targets, process, workers, lambda p: p.name, f"{action}完成")
+        total_in = sum(r[0] for r in results)
+        total_out = sum(r[1] for r in results)
+        self._log(f"合计：{total_in // 1024} KB -> {total_out // 1024} KB")
+
+    def _brotli_file(self, src: Path, dst: Path, decompress: bool, quality: int) -> None:
+        """单个文件的流式压缩/解压；内存占用与文件大小无关"""
+        if brotli_lib is None:
+            brotli = self.env.find_binary("brotli")
+            assert brotli
+            if decompress:
+                self._run([str(brotli), "-d", "-f", "-o", str(dst), str(src)])
+            else:
+                self._run([str(brotli), "-q", str(quality), "-f", "-o", str(dst), str(src)])
+            return
+
+        with src.open("rb") as fin, dst.open("wb") as fout:
+            if decompress:
+                reader = _BrotliReader(fin)
+                while True:
+                    data = reader.read(COPY_BUFFER_SIZE)
+                    if not data:
+                        break
+                    fout.write(data)
+            else:
+                # 与 brotli 命令行默认窗口一致（lgwin=24）
+                compressor = brotli_lib.Compressor(quality=quality, lgwin=24)
+                while True:
+                    data = fin.read(COPY_BUFFER_SIZE)
+                    if not data:
+                        break
+                    fout.write(compressor.process(data))
+                fout.write(compressor.finish())
+
+    @contextlib.contextmanager
+    def _open_brotli_stream(self, br_path: Path) -> Iterator[BinaryIO]:
+        """返回解压后的数据流：优先 Python brotli 模块，否则读取 brotli -d -c 的标准输出"""
+        if brotli_lib is not None:
+            with br_path.open("rb") as fh:
+                yield _BrotliReader(fh)
+            return
+
+        brotli = self.env.find_binary("brotli")
+        if brotli is None:
+            raise OperationError("缺少 brotli 工具（或 Python brotli 模块）")
+        cmd = [str(brotli), "-d", "-c", str(br_path)]
+        self._log(f"$ {' '.join(cmd)}")
+        process = subprocess.Popen(
+            cmd,
+            env=self.env.prepare_subprocess_env(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        assert process.stdout is not None and process.stderr is not None
+        try:
+            yield process.stdout
+        finally:
+            # 未读完的数据直接丢弃，避免子进程阻塞在管道写入上
+            process.stdout.close()
+            stderr = process.stderr.read().decode(errors="replace")
+            ret = process.wait()
+        if ret != 0:
+            raise OperationError(f"brotli 解压失败，退出码：{ret}\n{stderr}")
+
+    @contextlib.contextmanager
+    def _open_image(self, path: Path) -> Iterator[BinaryIO]:
+        """以只读文件对象打开镜像：稀疏镜像返回 SparseImage，RAW 返回普通文件"""
+        with _image_io_errors():
+            if self._is_sparse_image(path):
+                with SparseImage(path) as image:
+                    yield image
+            else:
+                with path.open("rb") as fh:
+                    yield fh
+
+    def _log_lp_metadata(self, metadata: LpMetadata) -> None:
+        geo = metadata.geometry
+        major, minor = metadata.header_version
+        self._log(
+            f"LP 元数据 v{major}.{minor}：{len(metadata.partitions)} 个分区，"
+            f"{geo.metadata_slot_count} 个 slot，设备大小 {metadata.device_size // (1024*1024)} MB"
+        )
+        for group in metadata.groups:
+            limit = f"{group.maximum_size // (1024*1024)} MB" if group.maximum_size else "不限"
+            self._log(f"  组 {group.name}：上限 {limit}")
+        for part in metadata.partitions:
+            self._log(f"  分区 {part.name}（组 {part.group}）：{part.size // (1024*1024)} MB，{len(part.extents)} 个 extent")
+
+    def _extract_lp_partition(
+        self, source: BinaryIO, part: LpPartition, out_img: Path, lock: Optional[threading.Lock] = None
+    ) -> None:
+        """按 extent 复制单个逻辑分区；ZERO extent、源镜像空洞与全零块不写入"""
+        # 可能是指向缓存条目的硬链接，先解除再写入
+        out_img.unlink(missing_ok=True)
+        with out_img.open("wb") as out:
+            dst = 0
+            for ext in part.extents:
+                if ext.target_type == LP_TARGET_TYPE_LINEAR:
+                    src = ext.target_data * LP_SECTOR_SIZE
+                    if isinstance(source, SparseImage):
+                        source.copy_range_to(src, ext.size, out, dst)
+                    else:
+                        copy_range(source, src, out, dst, ext.size, lock, holes=True)
+                elif ext.target_type != LP_TARGET_TYPE_ZERO:
+                    raise OperationError(f"分区 {part.name} 含未知 extent 类型：{ext.target_type}")
+                dst += ext.size
+            out.truncate(dst)
+
+    def _super_slot_name(self, name: str) -> str:
+        return name if name.endswith(("_a", "_b")) else f"{name}_a"
+
+    def _plan_super_layout(
+        self, sizes: Dict[str, int], *, ab: bool, device_size: Optional[int], alignment: int
+    ) -> LpBuilder:
+        """
+        计算 super 布局：非 A/B 使用 default 组与 2 个 metadata slot；
+        A/B 使用 main_a/main_b 两组与 3 个 slot，缺失的另一槽分区以空分区补齐，
+        两组上限均取单槽所需的最大值。
+        """
+        builder = LpBuilder(device_size or 0, slot_count=3 if ab else 2, alignment=alignment)
+        if not ab:
+            for name, size in sizes.items():
+                builder.add_partition(LpPartitionSpec(name, size))
+        else:
+            slots: Dict[str, Dict[str, int]] = {"_a": {}, "_b": {}}
+            for name, size in sizes.items():
+                slots[name[-2:]][name[:-2]] = size
+            bases = list(dict.fromkeys([*slots["_a"], *slots["_b"]]))
+            block = builder.block_size
+            budget = max(sum((size + block - 1) // block * block for size in slot.values()) for slot in slots.values())
+            for suffix, slot in slots.items():
+                group = f"main{suffix}"
+                builder.add_group(group, budget)
+                for base in bases:
+                    builder.add_partition(LpPartitionSpec(f"{base}{suffix}", slot.get(base, 0), group))
+
+        minimum = builder.minimum_device_size()
+        if device_size is None:
+            builder.fit_device_size()
+        elif device_size < minimum:
+            raise LpMetadataError(f"指定的设备大小 {device_size} 字节小于布局所需的 {minimum} 字节")
+        return builder
+
+    def _log_super_plan(self, builder: LpBuilder, placements: Sequence[LpPlacement], sizes: Dict[str, int]) -> None:
+        """输出布局规划：每个分区的位置与占用，以及设备中未承载数据的字节构成"""
+        mb = 1024 * 1024
+        self._log(
+            f"super 布局：设备 {builder.device_size / mb:.2f} MB，{builder.slot_count} 个 metadata slot，"
+            f"对齐 {builder.alignment // 1024} KB，元数据区 {builder.first_logical_offset // 1024} KB"
+        )
+        cursor = builder.first_logical_offset
+        gaps = rounding = 0
+        for part, place in zip(builder.partitions, placements):
+            if not place.size:
+                self._log(f"  {place.name:<20} 组 {part.group:<10} 空分区（预留给 OTA）")
+                continue
+            gap = place.offset - cursor
+            pad = place.size - sizes.get(place.name, 0)
+            gaps += gap
+            rounding += pad
+            cursor = place.offset + place.size
+            self._log(
+                f"  {place.name:<20} 组 {part.group:<10} 偏移 {place.offset / mb:>10.2f} MB  "
+                f"大小 {place.size / mb:>10.2f} MB  对齐空隙 {gap} 字节  块取整 {pad} 字节"
+            )
+        usage = builder.group_usage()
+        for group in builder.groups[1:]:
+            self._log(f"  组 {group.name}：已用 {usage[group.name] / mb:.2f} MB / 上限 {group.maximum_size / mb:.2f} MB")
+        tail = builder.device_size - cursor
+        data = sum(sizes.values())
+        wasted = builder.device_size - data
+        self._log(
+            f"浪费 {wasted} 字节（{wasted / mb:.2f} MB）：元数据区 {builder.first_logical_offset}，"
+            f"对齐空隙 {gaps}，块取整 {rounding}，尾部预留 {tail}"
+        )
+
+    def _shrink_super_input(self, name: str, path: Path, work_dir: Path) -> Path:
+        """
+        在 work_dir 中生成 RAW ext4 输入的私有副本并收缩到最小（resize2fs -M），返回用于布局的镜像。
+        原镜像保持不变（其打包清单记录的状态仍然有效）；稀疏镜像、其他文件系统、
+        含共享块（e2fsdroid -s）的镜像与收缩失败时返回原镜像。
+        """
+        if self._is_sparse_image(path):
+            self._log(f"  {name}：稀疏镜像不做收缩")
+            return path
+        if self._detect_filesystem_type(path) != "ext4":
+            return path
+        if self._ext4_has_shared_blocks(path):
+            self._log(f"  {name}：镜像含共享块（e2fsdroid -s），resize2fs 无法处理，不做收缩")
+            return path
+        copy = work_dir / path.name
+        method = clone_file(path, copy)
+        before = copy.stat().st_size
+        try:
+            after = self._shrink_ext4_image(copy)
+        except OperationError as exc:
+            self._log(f"  {name}：收缩失败，保持原大小（{exc}）")
+            copy.unlink(missing_ok=True)
+            return path
+        self._log(f"  {name}：ext4 收缩（{method}副本）{before // (1024*1024)} MB -> {after // (1024*1024)} MB")
+        return copy
+
+    def _shrink_ext4_image(self, raw_img: Path) -> int:
+        """e2fsck + resize2fs -M 收缩 ext4 镜像并截断文件，返回新的字节数"""
+        e2fsck = self.env.find_binary("e2fsck")
+        resize2fs = self.env.find_binary("resize2fs")
+        if not e2fsck or not resize2fs:
+            raise OperationError("缺少 e2fsck / resize2fs 工具")
+        self._run([str(e2fsck), "-f", "-y", str(raw_img)], ok_returncodes=(0, 1))
+        self._run([str(resize2fs), "-M", str(raw_img)])
+        size = self._ext4_fs_size(raw_img)
+        os.truncate(raw_img, size)
+        return size
+
+    def _ext4_fs_size(self, raw_img: Path) -> int:
+        """读取 ext4 超级块，返回文件系统的字节数"""
+        block_size, blocks, _ = self._ext4_block_counts(raw_img)
+        return blocks * block_size
+
+    def _ext4_superblock(self, raw_img: Path) -> bytes:
+        with raw_img.open("rb") as fh:
+            sb = pread(fh, 1024, 1024)
+        if len(sb) < 1024 or int.from_bytes(sb[0x38:0x3A], "little") != 0xEF53:
+            raise OperationError(f"不是 ext4 镜像：{raw_img.name}")
+        return sb
+
+    def _ext4_has_shared_blocks(self, raw_img: Path) -> bool:
+        """超级块是否带 RO_COMPAT_SHARED_BLOCKS（e2fsdroid -s 让相同内容的文件共享数据块）"""
+        return bool(int.from_bytes(self._ext4_superblock(raw_img)[0x64:0x68], "little") & RO_COMPAT_SHARED_BLOCKS)
+
+    def _ext4_block_counts(self, raw_img: Path) -> Tuple[int, int, int]:
+        """读取 ext4 超级块，返回 (块大小, 总块数, 空闲块数)"""
+        sb = self._ext4_superblock(raw_img)
+        blocks = int.from_bytes(sb[0x04:0x08], "little")
+        free = int.from_bytes(sb[0x0C:0x10], "little")
+        if int.from_bytes(sb[0x60:0x64], "little") & 0x80:  # INCOMPAT_64BIT
+            blocks |= int.from_bytes(sb[0x150:0x154], "little") << 32
+            free |= int.from_bytes(sb[0x158:0x15C], "little") << 32
+        return 1024 << int.from_bytes(sb[0x18:0x1C], "little"), blocks, free
+
+    def _write_raw_super(
+        self,
+        out: BinaryIO,
+        header: bytes,
+        placements: Sequence[LpPlacement],
+        sources: Dict[str, BinaryIO],
+        sizes: Dict[str, int],
+        device_size: int,
+    ) -> None:
+        """RAW super：分区间隙与稀疏输入的空洞保持为文件空洞"""
+        out.write(header)
+        out.flush()
+        for idx, place in enumerate(placements, start=1):
+            size = sizes.get(place.name, 0)
+            if size:
+                source = sources[place.name]
+                if isinstance(source, SparseImage):
+                    source.copy_range_to(0, size, out, place.offset)
+                else:
+                    copy_range(source, 0, out, place.offset, size, holes=True)
+            self._update_progress(idx / len(placements), f"已写入分区 {place.name}")
+        out.truncate(device_size)
+
+    def _write_sparse_super(
+        self,
+        out: BinaryIO,
+        header: bytes,
+        placements: Sequence[LpPlacement],
+        sources: Dict[str, BinaryIO],
+        sizes: Dict[str, int],
+        device_size: int,
+    ) -> None:
+        """稀疏 super：元数据为 RAW，稀疏输入的 chunk 原样转写，其余区域为 DONT_CARE"""
+        block_size = 4096
+        writer = SparseWriter(out, block_size)
+        # 与 lpmake 一致：首个保留块全零，记为 FILL
+        writer.add_fill(b"\0\0\0\0", 1)
+        writer.add_raw(header[block_size:])
+        cursor = len(header)
+        for idx, place in enumerate(placements, start=1):
+            if not place.size:
+                continue
+            writer.add_dont_care((place.offset - cursor) // block_size)
+            source = sources[place.name]
+            size = sizes[place.name]
+            if isinstance(source, SparseImage):
+                writer.add_sparse(source)
+            else:
+                aligned = size - size % block_size
+                if aligned:
+                    writer.add_raw_from(source, 0, aligned)
+                if size > aligned:
+                    tail = pread(source, size - aligned, aligned)
+                    writer.add_raw(tail + bytes(block_size - len(tail)))
+            written = (size + block_size - 1) // block_size * block_size
+            writer.add_dont_care((place.size - written) // block_size)
+            cursor = place.offset + place.size
+            self._update_progress(idx / len(placements), f"已写入分区 {place.name}")
+        writer.finish(device_size // block_size)
+
     def _is_super_image(self, filename: str) -> bool:
         name = filename.lower()
         return name.startswith("super") and name.endswith(".img")
 
     def _locate_super_image(self, project_dir: Path) -> Optional[Path]:
-        preferred = [project_dir / "super.img"]
-        variants = list(project_dir.glob("super_*.img")) + list(project_dir.glob("super*.img"))
-        candidates = preferred + sorted(variants)
-        for path in candidates:
-            if path.exists():
-                return path
-        return None
-
-    def _extract_fs(self, raw_path: Path, out_dir: Path) -> bool:
-        """尝试多种方式提取文件系统"""
+        """按 LP geometry 魔数在项目根目录中查找 super 镜像，优先 super.img，其次 super* 命名的文件"""
+        candidates = self._inventory(project_dir, top_level=True).entries("super", top_level=True)
+        if not candidates:
+            return None
+        return min(
+            candidates,
+            key=lambda entry: (entry.path.name != "super.img", not self._is_super_image(entry.path.name), entry.path),
+        ).path
+
+    def _extract_fs(self, raw_path: Path, out_dir: Path, config_dir: Optional[Path] = None) -> bool:
+        """尝试多种方式提取文件系统；config_dir 不为空时在其中写出属性配置（仅内置 ext4 解析器）"""
         # 检查文件大小
         file_size = raw_path.stat().st_size
         if file_size == 0:
@@ -591,6 +2316,10 @@ class OperationRunner:
         fs_type = self._detect_filesystem_type(raw_path)
         self._log(f"  检测到文件系统类型：{fs_type or '未知'}")
 
+        # ext4 优先使用内置解析器：不依赖外部工具，文件内容直接从映射区写出
+        if fs_type == "ext4" and self._extract_ext4_native(raw_path, out_dir, config_dir):
+            return True
+
         # 自定义脚本（Python）
         custom_py = self.env.tool_dir / "unpack_img_fs.py"
         if custom_py.exists():
@@ -647,38 +2376,84 @@ class OperationRunner:
         return False
 
     def _detect_filesystem_type(self, raw_path: Path) -> Optional[str]:
-        """检测文件系统类型"""
+        """检测文件系统类型；稀疏镜像只读取头部用到的 chunk，无需展开，结果按 inode 缓存"""
         try:
-            with raw_path.open("rb") as f:
-                # 读取前 4KB
-                header = f.read(4096)
-                
-                # EROFS magic: 0xE0F5E1E2 at offset 1024
-                if len(header) >= 1028:
-                    erofs_magic = int.from_bytes(header[1024:1028], "little")
-                    if erofs_magic == 0xE0F5E1E2:
-                        return "erofs"
-                
-                # EXT4 magic: 0xEF53 at offset 0x438 (1080)
-                if len(header) >= 1082:
-                    ext_magic = int.from_bytes(header[1080:1082], "little")
-                    if ext_magic == 0xEF53:
-                        return "ext4"
-                
-                # F2FS magic: 0xF2F52010 at offset 0x400 (1024)
-                if len(header) >= 1028:
-                    f2fs_magic = int.from_bytes(header[1024:1028], "little")
-                    if f2fs_magic == 0xF2F52010:
-                        return "f2fs"
-                
-                # SquashFS magic: "hsqs" at offset 0
-                if header[:4] == b"hsqs" or header[:4] == b"sqsh":
-                    return "squashfs"
-                
+            return classify(raw_path).fs
         except Exception:
             pass
         return None
 
+    def _fs_extractors(self, fs_type: Optional[str]) -> List[str]:
+        """按 _extract_fs 的尝试顺序列出当前环境中可用于该文件系统的解包方式"""
+        extractors: List[str] = []
+        if fs_type == "ext4":
+            extractors.append("内置 ext4 解析器")
+        if (self.env.tool_dir / "unpack_img_fs.py").exists() and (shutil.which("python") or shutil.which("python3")):
+            extractors.append("unpack_img_fs.py")
+        # unpack_img_fs.sh 对未知文件系统同样只会尝试 7z，不单独计入
+        if fs_type and (self.env.tool_dir / "unpack_img_fs.sh").exists() and not self.env.is_windows:
+            extractors.append("unpack_img_fs.sh")
+        if fs_type == "erofs" and self.env.find_binary("extract.erofs"):
+            extractors.append("extract.erofs")
+        elif fs_type == "ext4" and not self.env.is_windows and shutil.which("debugfs"):
+            extractors.append("debugfs")
+        elif fs_type == "f2fs" and self.env.find_binary("extract.f2fs"):
+            extractors.append("extract.f2fs")
+        seven_zip = self.env.find_binary("7z") or self.env.find_binary("7za")
+        if seven_zip:
+            extractors.append(seven_zip.name)
+        return extractors
+
+    def _detect_dat_filesystem(self, tlist: TransferList, open_stream: Callable[[], Any], seekable: bool) -> Optional[str]:
+        """
+        按 transfer.list 找到输出镜像首块在数据流中的位置，只读取这一块检测文件系统。
+        seekable 为 False（brotli 流）时需要解压丢弃之前的数据，首块过于靠后则不检测。
+        """
+        src_block = tlist.source_block(0)
+        if src_block is None:
+            return None
+        offset = src_block * SDAT_BLOCK_SIZE
+        if not seekable and offset > DAT_DETECT_MAX_SKIP:
+            return None
+        try:
+            with open_stream() as stream:
+                if seekable:
+                    stream.seek(offset)
+                else:
+                    while offset > 0:
+                        skipped = len(stream.read(min(offset, COPY_BUFFER_SIZE)))
+                        if not skipped:
+                            return None
+                        offset -= skipped
+                return filesystem_from_header(_read_exact(stream, FS_HEADER_SIZE))
+        except (OSError, OperationError):
+            # 提前关闭 brotli 命令行的输出管道会使其以非零状态退出，检测结果以读到的数据为准
+            return None
+
+    def _read_lp_range(
+        self, source: BinaryIO, part: LpPartition, offset: int, size: int, lock: Optional[threading.Lock] = None
+    ) -> bytes:
+        """读取逻辑分区内 [offset, offset+size) 的数据：按 extent 映射到 super 中的位置，ZERO extent 读出为零"""
+        out = bytearray()
+        pos = 0
+        for ext in part.extents:
+            end = pos + ext.size
+            if pos >= offset + size:
+                break
+            if end > offset:
+                start = max(offset, pos)
+                length = min(end, offset + size) - start
+                if ext.target_type == LP_TARGET_TYPE_LINEAR:
+                    src = ext.target_data * LP_SECTOR_SIZE + start - pos
+                    if isinstance(source, SparseImage):
+                        out += source.read_at(src, length)
+                    else:
+                        out += pread(source, length, src, lock)
+                else:
+                    out += bytes(length)
+            pos = end
+        return bytes(out)
+
     def _extract_erofs(self, raw_path: Path, out_dir: Path) -> bool:
         """使用 extract.erofs 提取 EROFS 文件系统"""
         extract_erofs = self.env.find_binary("extract.erofs")
@@ -697,6 +2472,35 @@ class OperationRunner:
             self._log("  extract.erofs 解包失败")
         return False
 
+    def _extract_ext4_native(self, raw_path: Path, out_dir: Path, config_dir: Optional[Path]) -> bool:
+        """
+        用内置解析器提取 ext4：线程池写出文件，权限与 mtime 写回文件，
+        uid/gid、capabilities 与 SELinux 上下文写入 config/<分区名>_fs_config 与 _file_contexts。
+        """
+        label = out_dir.name
+        started = time.monotonic()
+        self._log(f"  使用内置 ext4 解析器解包（{EXT4_EXTRACT_WORKERS} 个写入线程）...")
+        try:
+            with Ext4Image(raw_path) as image:
+                stats, fs_config, file_contexts = extract_ext4(
+                    image, out_dir, label, EXT4_EXTRACT_WORKERS, self._log
+                )
+        except (Ext4Error, OSError) as exc:
+            self._log(f"  内置 ext4 解析器失败：{exc}，尝试其他方式")
+            return False
+        elapsed = time.monotonic() - started
+        mb = stats.bytes / (1024 * 1024)
+        self._log(
+            f"  提取 {stats.files} 个文件、{stats.dirs} 个目录、{stats.symlinks} 个符号链接、"
+            f"{stats.hardlinks} 个硬链接，{mb:.1f} MB，耗时 {elapsed:.1f}s（{mb / elapsed if elapsed > 0 else 0:.0f} MB/s）"
+        )
+        if config_dir is not None:
+            config_dir.mkdir(parents=True, exist_ok=True)
+            for suffix, lines in zip(FS_CONFIG_SUFFIXES, (fs_config, file_contexts)):
+                (config_dir / f"{label}{suffix}").write_text("".join(f"{line}\n" for line in lines), encoding="utf-8")
+            self._log(f"  属性配置：config/{label}{FS_CONFIG_SUFFIXES[0]}，config/{label}{FS_CONFIG_SUFFIXES[1]}")
+        return True
+
     def _extract_ext4(self, raw_path: Path, out_dir: Path) -> bool:
         """提取 EXT4 文件系统"""
         # 尝试 debugfs (Linux)
@@ -732,8 +2536,11 @@ class OperationRunner:
                 self._log("  extract.f2fs 解包失败")
         return False
 
-    def _detect_img_pack_backend(self) -> Optional[str]:
-        """检测可用的 EXT4 打包后端"""
+    def _detect_img_pack_backend(self, prefer_e2fsdroid: bool = False) -> Optional[str]:
+        """检测可用的 EXT4 打包后端；prefer_e2fsdroid=True 时优先 mke2fs+e2fsdroid（支持共享块）"""
+        if prefer_e2fsdroid and self.env.find_binary("mke2fs") and self.env.find_binary("e2fsdroid"):
+            return "mke2fs+e2fsdroid"
+
         # 优先 mkfs.ext4 -d
         mkfs_ext4 = self.env.find_binary("mkfs.ext4")
         if mkfs_ext4:
@@ -752,25 +2559,41 @@ class OperationRunner:
 
         return None
 
-    def _estimate_partition_size(self, part_dir: Path) -> int:
-        """估算分区大小（MB），+30% 余量，最小 256MB，16MB 对齐"""
-        total_bytes = sum(f.stat().st_size for f in part_dir.rglob("*") if f.is_file())
-        size_mb = total_bytes // (1024 * 1024)
-        extra = int(size_mb * 0.3)
-        prealloc = size_mb + extra
-        prealloc = max(prealloc, 256)
-        # 16MB 对齐
-        prealloc = ((prealloc + 15) // 16) * 16
-        return prealloc
-
-    def _pack_ext4_image(self, src_dir: Path, out_img: Path, label: str, size_mb: int, backend: str) -> None:
-        """使用检测到的后端打包 EXT4 镜像"""
+    def _estimate_partition_size(self, scan: TreeScan, headroom: float, read_only: bool = False) -> Ext4Estimate:
+        """按遍历结果估算 ext4 镜像大小（4K 块取整、inode、目录、扩展属性与文件系统元数据）"""
+        usage = scan.usage
+        estimate = estimate_ext4(usage, headroom, journal=not read_only, resize_inode=not read_only)
+        mb = 1024 * 1024
+        self._log(
+            f"  内容：{usage.files} 个文件，{usage.dirs} 个目录，{usage.symlinks} 个符号链接，"
+            f"{usage.apparent_bytes / mb:.1f} MB（按块占用 {estimate.data_blocks * 4096 / mb:.1f} MB）"
+        )
+        self._log(
+            f"  最小大小：{estimate.min_bytes // mb} MB（元数据 {estimate.metadata_blocks * 4096 / mb:.1f} MB，"
+            f"日志 {estimate.journal_blocks * 4096 // mb} MB），"
+            f"预分配：{estimate.size_bytes // mb} MB（余量 {headroom:.0%}），inode：{estimate.inodes}"
+        )
+        return estimate
+
+    def _pack_ext4_image(
+        self, src_dir: Path, out_img: Path, label: str, size_mb: int, backend: str, inodes: int, read_only: bool = False
+    ) -> None:
+        """
+        使用检测到的后端打包 EXT4 镜像；统一使用 4K 块与 256 字节 inode，与大小估算一致。
+        read_only=True 时关闭日志、保留块与 resize_inode，inode 表随 mkfs 一次初始化；
+        mke2fs+e2fsdroid 后端另用 -s 让内容相同的文件共享数据块。
+        """
+        ro_opts = ["-O", READONLY_EXT4_FEATURES, "-m", "0", "-E", "lazy_itable_init=0"] if read_only else []
         if backend == "mkfs.ext4":
             mkfs_ext4 = self.env.find_binary("mkfs.ext4")
             assert mkfs_ext4
             self._run([
                 str(mkfs_ext4),
                 "-L", label,
+                "-b", "4096",
+                "-I", "256",
+                "-N", str(inodes),
+                *ro_opts,
                 "-d", str(src_dir),
                 str(out_img),
                 f"{size_mb}M"
@@ -781,6 +2604,8 @@ class OperationRunner:
             self._run([
                 str(make_ext4fs),
                 "-l", f"{size_mb}M",
+                "-i", str(inodes),
+                *(["-J", "-m", "0"] if read_only else []),
                 "-a", label,
                 str(out_img),
                 str(src_dir)
@@ -789,8 +2614,13 @@ class OperationRunner:
             mke2fs = self.env.find_binary("mke2fs")
             e2fsdroid = self.env.find_binary("e2fsdroid")
             assert mke2fs and e2fsdroid
-            self._run([str(mke2fs), "-t", "ext4", "-L", label, str(out_img), f"{size_mb}M"])
-            self._run([str(e2fsdroid), "-a", f"/{label}", "-f", str(src_dir), str(out_img)])
+            self._run([
+                str(mke2fs), "-t", "ext4", "-L", label, "-b", "4096", "-I", "256", "-N", str(inodes),
+                *ro_opts, str(out_img), f"{size_mb}M",
+            ])
+            self._run([
+                str(e2fsdroid), *(["-s"] if read_only else []), "-a", f"/{label}", "-f", str(src_dir), str(out_img)
+            ])
         else:
             raise OperationError("未知的打包后端")
 
@@ -810,27 +2640,3 @@ class OperationRunner:
                 partitions[name] = sparse_img
 
         return partitions
-
-    def _find_sdat2img_script(self) -> Optional[Path]:
-        """查找 sdat2img.py"""
-        candidates = [
-            self.env.bin_dir / "sdat2img.py",
-            self.env.tool_dir / "sdat2img.py",
-            self.env.root_dir / "bin" / "Linux" / "sdat2img.py",
-        ]
-        for path in candidates:
-            if path.exists():
-                return path
-        return None
-
-    def _find_img2sdat_script(self) -> Optional[Path]:
-        """查找 img2sdat.py"""
-        candidates = [
-            self.env.bin_dir / "img2sdat.py",
-            self.env.tool_dir / "img2sdat.py",
-            self.env.root_dir / "bin" / "Linux" / "img2sdat.py",
-        ]
-        for path in candidates:
-            if path.exists():
-                return path
-        return None
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.payload
+A/B OTA payload.bin（CrAU）解析与全量分区提取
+"""
+from __future__ import annotations
+
+import bz2
+import lzma
+import mmap
+import struct
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Sequence, Tuple
+
+from .blockio import write_nonzero
+
+PAYLOAD_MAGIC = b"CrAU"
+
+# InstallOperation.Type（update_metadata.proto）
+OP_REPLACE = 0
+OP_REPLACE_BZ = 1
+OP_ZERO = 6
+OP_DISCARD = 7
+OP_REPLACE_XZ = 8
+
+FULL_OTA_OPERATIONS = {OP_REPLACE, OP_REPLACE_BZ, OP_ZERO, OP_DISCARD, OP_REPLACE_XZ}
+
+OPERATION_NAMES = {
+    0: "REPLACE", 1: "REPLACE_BZ", 2: "MOVE", 3: "BSDIFF", 4: "SOURCE_COPY",
+    5: "SOURCE_BSDIFF", 6: "ZERO", 7: "DISCARD", 8: "REPLACE_XZ", 9: "PUFFDIFF",
+    10: "BROTLI_BSDIFF", 11: "ZUCCHINI", 12: "LZ4DIFF_BSDIFF", 13: "LZ4DIFF_PUFFDIFF",
+}
+
+
+class PayloadError(ValueError):
+    pass
+
+
+class Extent(NamedTuple):
+    start_block: int
+    num_blocks: int
+
+
+class InstallOperation(NamedTuple):
+    type: int
+    data_offset: int
+    data_length: int
+    dst_extents: Tuple[Extent, ...]
+
+    @property
+    def dst_blocks(self) -> int:
+        return sum(ext.num_blocks for ext in self.dst_extents)
+
+
+class PartitionUpdate(NamedTuple):
+    name: str
+    size: int
+    operations: Tuple[InstallOperation, ...]
+
+
+# ---------------------------------------------------------------------- #
+# 最小 protobuf 解码（仅用到 varint 与 length-delimited）
+# ---------------------------------------------------------------------- #
+def _read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(buf):
+            raise PayloadError("manifest 数据被截断")
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(buf: bytes) -> Iterator[Tuple[int, object]]:
+    """遍历消息字段，返回 (字段号, 值)；varint 为 int，length-delimited 为 bytes"""
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire == 1:
+            value = int.from_bytes(buf[pos:pos + 8], "little")
+            pos += 8
+        elif wire == 2:
+            length, pos = _read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire == 5:
+            value = int.from_bytes(buf[pos:pos + 4], "little")
+            pos += 4
+        else:
+            raise PayloadError(f"不支持的 protobuf wire type：{wire}")
+        if pos > end:
+            raise PayloadError("manifest 数据被截断")
+        yield field, value
+
+
+def _parse_extent(buf: bytes) -> Extent:
+    start = count = 0
+    for field, value in _iter_fields(buf):
+        if field == 1:
+            start = value
+        elif field == 2:
+            count = value
+    return Extent(start, count)
+
+
+def _parse_operation(buf: bytes) -> InstallOperation:
+    op_type = data_offset = data_length = 0
+    extents: List[Extent] = []
+    for field, value in _iter_fields(buf):
+        if field == 1:
+            op_type = value
+        elif field == 2:
+            data_offset = value
+        elif field == 3:
+            data_length = value
+        elif field == 6:
+            extents.append(_parse_extent(value))
+    return InstallOperation(op_type, data_offset, data_length, tuple(extents))
+
+
+def _parse_partition(buf: bytes) -> PartitionUpdate:
+    name = ""
+    size = 0
+    operations: List[InstallOperation] = []
+    for field, value in _iter_fields(buf):
+        if field == 1:
+            name = value.decode("utf-8")
+        elif field == 7:
+            for info_field, info_value in _iter_fields(value):
+                if info_field == 1:
+                    size = info_value
+        elif field == 8:
+            operations.append(_parse_operation(value))
+    return PartitionUpdate(name, size, tuple(operations))
+
+
+class Payload:
+    """
+    payload.bin 头部与 manifest，只解析一次。
+
+    ``data_offset`` 为数据区起点，操作中的 data_offset 均相对于此。
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        with self.path.open("rb") as fh:
+            header = fh.read(24)
+            if header[:4] != PAYLOAD_MAGIC:
+                raise PayloadError(f"不是 payload.bin（缺少 CrAU 标识）：{self.path.name}")
+            version, manifest_size = struct.unpack(">QQ", header[4:20])
+            if version == 1:
+                header_size, signature_size = 20, 0
+            elif version == 2:
+                header_size = 24
+                (signature_size,) = struct.unpack(">I", header[20:24])
+            else:
+                raise PayloadError(f"不支持的 payload 版本：{version}")
+            fh.seek(header_size)
+            manifest = fh.read(manifest_size)
+        if len(manifest) < manifest_size:
+            raise PayloadError("payload.bin 被截断（manifest 不完整）")
+
+        self.version = version
+        self.data_offset = header_size + manifest_size + signature_size
+        self.block_size = 4096
+        self.partitions: List[PartitionUpdate] = []
+        for field, value in _iter_fields(manifest):
+            if field == 3:
+                self.block_size = value
+            elif field == 13:
+                self.partitions.append(_parse_partition(value))
+
+    def partition(self, name: str) -> PartitionUpdate:
+        for part in self.partitions:
+            if part.name == name:
+                return part
+        raise PayloadError(f"payload 中不存在分区：{name}")
+
+    def check_full_ota(self, part: PartitionUpdate) -> None:
+        for op in part.operations:
+            if op.type not in FULL_OTA_OPERATIONS:
+                name = OPERATION_NAMES.get(op.type, str(op.type))
+                raise PayloadError(f"分区 {part.name} 含增量操作 {name}，仅支持全量 OTA")
+
+
+def batch_operations(
+    operations: Sequence[InstallOperation], block_size: int, batch_bytes: int = 64 * 1024 * 1024
+) -> Iterator[Tuple[InstallOperation, ...]]:
+    """按输出字节数把操作分批，作为进程池的任务单元"""
+    batch: List[InstallOperation] = []
+    size = 0
+    for op in operations:
+        batch.append(op)
+        size += op.dst_blocks * block_size
+        if size >= batch_bytes:
+            yield tuple(batch)
+            batch, size = [], 0
+    if batch:
+        yield tuple(batch)
+
+
+def apply_operations(
+    payload_path: str,
+    data_offset: int,
+    block_size: int,
+    out_path: str,
+    operations: Sequence[InstallOperation],
+) -> int:
+    """
+    在工作进程中执行一批操作，返回写入的字节数。
+
+    payload 以 mmap 只读映射；输出用定位写入，多个进程可同时写同一个镜像。
+    ZERO / DISCARD 与数据中的全零块都不写入（输出文件预先截断，未写区域即为空洞）。
+    """
+    written = 0
+    with open(payload_path, "rb") as fin, open(out_path, "r+b") as fout:
+        blob = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for op in operations:
+                if op.type in (OP_ZERO, OP_DISCARD):
+                    continue
+                start = data_offset + op.data_offset
+                data = blob[start:start + op.data_length]
+                if op.type == OP_REPLACE_XZ:
+                    data = lzma.decompress(data)
+                elif op.type == OP_REPLACE_BZ:
+                    data = bz2.decompress(data)
+                elif op.type != OP_REPLACE:
+                    raise PayloadError(f"不支持的操作：{OPERATION_NAMES.get(op.type, op.type)}")
+
+                view = memoryview(data)
+                for ext in op.dst_extents:
+                    length = ext.num_blocks * block_size
+                    piece = view[:length]
+                    write_nonzero(fout, piece, ext.start_block * block_size)
+                    written += len(piece)
+                    view = view[length:]
+                    if not view:
+                        break
+        finally:
+            blob.close()
+    return written
+
+
+def partition_sizes(payload: Payload) -> Dict[str, int]:
+    """各分区输出大小；旧版 manifest 缺少 new_partition_info 时按操作覆盖范围推算"""
+    sizes: Dict[str, int] = {}
+    for part in payload.partitions:
+        size = part.size
+        if not size:
+            ends = [ext.start_block + ext.num_blocks for op in part.operations for ext in op.dst_extents]
+            size = max(ends, default=0) * payload.block_size
+        sizes[part.name] = size
+    return sizes
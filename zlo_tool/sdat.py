@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.sdat
+block-based OTA（.new.dat + .transfer.list）格式解析
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Tuple
+
+BLOCK_SIZE = 4096
+# 每条命令最多携带的区间数，避免单行 RangeSet 过长
+MAX_RANGES_PER_COMMAND = 1024
+
+ANDROID_VERSIONS = {
+    1: "Android 5.0",
+    2: "Android 5.1",
+    3: "Android 6.x",
+    4: "Android 7.x+",
+}
+
+# 全量 OTA 只会出现这三种命令；其余（move/bsdiff/stash ...）属于增量包
+FULL_OTA_COMMANDS = ("erase", "new", "zero")
+
+BlockRange = Tuple[int, int]
+
+
+class TransferListError(ValueError):
+    pass
+
+
+class TransferCommand(NamedTuple):
+    name: str
+    ranges: Tuple[BlockRange, ...]
+
+
+class DataExtent(NamedTuple):
+    """new 命令中一段连续数据：输出块号、.new.dat 中的块号、块数"""
+
+    dst_block: int
+    src_block: int
+    blocks: int
+
+
+def parse_rangeset(text: str) -> Tuple[BlockRange, ...]:
+    """解析 ``count,a1,b1,a2,b2...`` 形式的 RangeSet"""
+    try:
+        nums = [int(item) for item in text.strip().split(",")]
+    except ValueError:
+        raise TransferListError(f"无法解析 RangeSet：{text.strip()}") from None
+    if not nums or len(nums) != nums[0] + 1 or nums[0] % 2:
+        raise TransferListError(f"RangeSet 长度不匹配：{text.strip()}")
+    ranges = tuple((nums[i], nums[i + 1]) for i in range(1, len(nums), 2))
+    for begin, end in ranges:
+        if end <= begin:
+            raise TransferListError(f"RangeSet 区间无效：{begin}-{end}")
+    return ranges
+
+
+def format_rangeset(ranges: List[BlockRange]) -> str:
+    values = [str(v) for pair in ranges for v in pair]
+    return ",".join([str(len(values))] + values)
+
+
+def _append_range(ranges: List[BlockRange], begin: int, end: int) -> None:
+    if ranges and ranges[-1][1] == begin:
+        ranges[-1] = (ranges[-1][0], end)
+    else:
+        ranges.append((begin, end))
+
+
+class TransferList:
+    """
+    全量 OTA 的 transfer.list。
+
+    ``data_extents()`` 按 .new.dat 的数据流顺序给出写入位置，相邻区间已合并，
+    调用方据此可以做大块的定位写入，而无需逐块复制。
+    """
+
+    def __init__(self, version: int, new_blocks: int, commands: List[TransferCommand]) -> None:
+        self.version = version
+        self.new_blocks = new_blocks
+        self.commands = commands
+
+    @classmethod
+    def parse(cls, path: Path) -> "TransferList":
+        with Path(path).open("r", encoding="utf-8") as fh:
+            lines = [line.strip() for line in fh]
+        if len(lines) < 2:
+            raise TransferListError(f"transfer.list 内容不完整：{path}")
+        try:
+            version = int(lines[0])
+            new_blocks = int(lines[1])
+        except ValueError:
+            raise TransferListError(f"transfer.list 头部无效：{path}") from None
+
+        # v2+ 第 3、4 行为 stash 条目数与最大 stash 块数
+        body = lines[4:] if version >= 2 else lines[2:]
+        commands: List[TransferCommand] = []
+        for line in body:
+            if not line:
+                continue
+            name, _, arg = line.partition(" ")
+            if name in FULL_OTA_COMMANDS:
+                commands.append(TransferCommand(name, parse_rangeset(arg)))
+            elif name[0].isdigit():
+                continue
+            else:
+                raise TransferListError(f"不支持的命令 \"{name}\"（仅支持全量 OTA）")
+        return cls(version, new_blocks, commands)
+
+    @property
+    def version_name(self) -> str:
+        return ANDROID_VERSIONS.get(self.version, "未知版本")
+
+    @property
+    def total_blocks(self) -> int:
+        """输出镜像的块数：所有命令覆盖到的最大块号"""
+        ends = [end for cmd in self.commands for _begin, end in cmd.ranges]
+        return max(ends) if ends else 0
+
+    @property
+    def data_blocks(self) -> int:
+        return sum(ext.blocks for ext in self.data_extents())
+
+    def data_extents(self) -> Iterator[DataExtent]:
+        src = 0
+        pending = None
+        for cmd in self.commands:
+            if cmd.name != "new":
+                continue
+            for begin, end in cmd.ranges:
+                count = end - begin
+                if pending is not None and pending.dst_block + pending.blocks == begin:
+                    pending = pending._replace(blocks=pending.blocks + count)
+                else:
+                    if pending is not None:
+                        yield pending
+                    pending = DataExtent(begin, src, count)
+                src += count
+        if pending is not None:
+            yield pending
+
+    def source_block(self, block: int) -> Optional[int]:
+        """输出镜像第 block 块在 .new.dat 中的块号；该块不由 new 命令写入时返回 None"""
+        for ext in self.data_extents():
+            if ext.dst_block <= block < ext.dst_block + ext.blocks:
+                return ext.src_block + block - ext.dst_block
+        return None
+
+    def zero_ranges(self) -> Iterator[BlockRange]:
+        """zero 命令覆盖的区间（erase 只表示丢弃，不保证内容）"""
+        for cmd in self.commands:
+            if cmd.name == "zero":
+                yield from cmd.ranges
+
+
+class NewDataEncoder:
+    """
+    全量 OTA 编码器：按块号顺序接收镜像内容。
+
+    全零块记为 ``zero`` 命令不进入 .new.dat，其余数据直接流式写入 ``out``；
+    内存中只保留区间列表。
+    """
+
+    def __init__(self, out: BinaryIO, block_size: int = BLOCK_SIZE) -> None:
+        self.out = out
+        self.block_size = block_size
+        self.new_ranges: List[BlockRange] = []
+        self.zero_ranges: List[BlockRange] = []
+        self.erase_ranges: List[BlockRange] = []
+        self.cursor = 0
+        self._zero_block = memoryview(bytes(block_size))
+
+    @property
+    def new_blocks(self) -> int:
+        return sum(end - begin for begin, end in self.new_ranges)
+
+    def add_data(self, data: bytes) -> None:
+        """追加块对齐的数据，逐块区分全零块与数据块"""
+        bs = self.block_size
+        if len(data) % bs:
+            raise ValueError(f"数据长度必须是 {bs} 的整数倍")
+        view = memoryview(data)
+        if view == memoryview(bytes(len(view))):
+            self.add_zero(len(view) // bs)
+            return
+
+        run_start = 0
+        run_zero = view[:bs] == self._zero_block
+        for offset in range(bs, len(view), bs):
+            is_zero = view[offset:offset + bs] == self._zero_block
+            if is_zero != run_zero:
+                self._emit(view[run_start:offset], run_zero)
+                run_start, run_zero = offset, is_zero
+        self._emit(view[run_start:], run_zero)
+
+    def add_zero(self, blocks: int) -> None:
+        if blocks > 0:
+            _append_range(self.zero_ranges, self.cursor, self.cursor + blocks)
+            self.cursor += blocks
+
+    def add_erase(self, blocks: int) -> None:
+        """内容无关的区域（如稀疏镜像的 DONT_CARE）"""
+        if blocks > 0:
+            _append_range(self.erase_ranges, self.cursor, self.cursor + blocks)
+            self.cursor += blocks
+
+    def _emit(self, view: memoryview, is_zero: bool) -> None:
+        blocks = len(view) // self.block_size
+        if is_zero:
+            self.add_zero(blocks)
+            return
+        self.out.write(view)
+        _append_range(self.new_ranges, self.cursor, self.cursor + blocks)
+        self.cursor += blocks
+
+    def transfer_list(self, version: int = 4) -> str:
+        if version not in ANDROID_VERSIONS:
+            raise ValueError(f"不支持的 transfer.list 版本：{version}")
+        lines = [str(version), str(self.new_blocks)]
+        if version >= 2:
+            # 全量包不使用 stash
+            lines += ["0", "0"]
+        for name, ranges in (("erase", self.erase_ranges), ("new", self.new_ranges), ("zero", self.zero_ranges)):
+            for i in range(0, len(ranges), MAX_RANGES_PER_COMMAND):
+                lines.append(f"{name} {format_rangeset(ranges[i:i + MAX_RANGES_PER_COMMAND])}")
+        return "\n".join(lines) + "\n"
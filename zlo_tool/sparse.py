@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.sparse
+Android 稀疏镜像（simg）的读取、写出与原生 img2simg 块分类
+"""
+from __future__ import annotations
+
+import bisect
+import io
+import os
+import threading
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator, List, NamedTuple, Optional, Tuple
+
+from .blockio import (
+    CHUNK_TYPE_CRC32,
+    CHUNK_TYPE_DONT_CARE,
+    CHUNK_TYPE_FILL,
+    CHUNK_TYPE_RAW,
+    COPY_BUFFER_SIZE,
+    SPARSE_CHUNK_HEADER,
+    SPARSE_HEADER,
+    SPARSE_MAGIC,
+    copy_range,
+    data_regions,
+    pread,
+)
+
+# 与 libsparse 一致：单个 RAW chunk 最大 64MB（img2simg 的 FILL chunk 同样按此拆分）
+SPARSE_MAX_RAW_CHUNK = 64 * 1024 * 1024
+
+
+class SparseError(ValueError):
+    pass
+
+
+class SparseChunk(NamedTuple):
+    """稀疏镜像中的一个 chunk；偏移与长度均以展开后的字节计"""
+
+    chunk_type: int
+    out_offset: int
+    out_size: int
+    data_offset: int = 0
+    fill: bytes = b""
+
+
+class SparseImage(io.RawIOBase):
+    """
+    Android 稀疏镜像（simg）只读解析器。
+
+    - ``chunks()`` 返回展开后的 chunk 映射，可直接据此跳过 DONT_CARE 区域；
+    - 本身是可 seek 的只读文件对象，按需读取任意区间，无需先完整展开；
+    - ``expand_to()`` 原生展开为 RAW，DONT_CARE、全零 FILL 与 RAW 中的全零块以文件空洞表示。
+    """
+
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+        self.path = Path(path)
+        self._fh: BinaryIO = self.path.open("rb")
+        self._lock = threading.Lock()
+        self._pos = 0
+        try:
+            self._parse()
+        except Exception:
+            self._fh.close()
+            raise
+
+    # ------------------------------------------------------------------ #
+    def _parse(self) -> None:
+        header = self._fh.read(SPARSE_HEADER.size)
+        if len(header) < SPARSE_HEADER.size:
+            raise SparseError(f"稀疏镜像头部不完整：{self.path.name}")
+        (magic, major, _minor, file_hdr_sz, chunk_hdr_sz,
+         blk_sz, total_blks, total_chunks, _checksum) = SPARSE_HEADER.unpack(header)
+        if magic != SPARSE_MAGIC:
+            raise SparseError(f"不是稀疏镜像：{self.path.name}")
+        if major != 1 or blk_sz == 0 or blk_sz % 4:
+            raise SparseError(f"不支持的稀疏镜像格式：{self.path.name}")
+
+        self.block_size: int = blk_sz
+        self.total_blocks: int = total_blks
+        self.size: int = blk_sz * total_blks
+
+        chunks: List[SparseChunk] = []
+        offset = file_hdr_sz
+        out_offset = 0
+        for _ in range(total_chunks):
+            self._fh.seek(offset)
+            raw = self._fh.read(SPARSE_CHUNK_HEADER.size)
+            if len(raw) < SPARSE_CHUNK_HEADER.size:
+                raise SparseError(f"稀疏镜像被截断：{self.path.name}")
+            chunk_type, _reserved, chunk_blks, total_sz = SPARSE_CHUNK_HEADER.unpack(raw)
+            data_offset = offset + chunk_hdr_sz
+            out_size = chunk_blks * blk_sz
+
+            if chunk_type == CHUNK_TYPE_RAW:
+                if total_sz != chunk_hdr_sz + out_size:
+                    raise SparseError(f"RAW chunk 长度异常：{self.path.name} @ {offset}")
+                chunks.append(SparseChunk(chunk_type, out_offset, out_size, data_offset))
+            elif chunk_type == CHUNK_TYPE_FILL:
+                self._fh.seek(data_offset)
+                fill = self._fh.read(4)
+                if len(fill) < 4:
+                    raise SparseError(f"FILL chunk 数据不完整：{self.path.name} @ {offset}")
+                chunks.append(SparseChunk(chunk_type, out_offset, out_size, data_offset, fill))
+            elif chunk_type == CHUNK_TYPE_DONT_CARE:
+                chunks.append(SparseChunk(chunk_type, out_offset, out_size))
+            elif chunk_type == CHUNK_TYPE_CRC32:
+                # 校验值不参与展开
+                offset += total_sz
+                continue
+            else:
+                raise SparseError(f"未知 chunk 类型 0x{chunk_type:04X}：{self.path.name}")
+
+            out_offset += out_size
+            offset += total_sz
+
+        if out_offset != self.size:
+            raise SparseError(f"稀疏镜像块数不一致：{self.path.name}")
+        self._chunks = chunks
+        self._starts = [c.out_offset for c in chunks]
+
+    # ------------------------------------------------------------------ #
+    # chunk 映射
+    # ------------------------------------------------------------------ #
+    def chunks(self) -> Iterator[SparseChunk]:
+        """按展开偏移顺序遍历 chunk（不含 CRC32）"""
+        return iter(self._chunks)
+
+    def data_chunks(self) -> Iterator[SparseChunk]:
+        """只遍历真正承载数据的 chunk：RAW 与非零 FILL"""
+        for chunk in self._chunks:
+            if chunk.chunk_type == CHUNK_TYPE_RAW:
+                yield chunk
+            elif chunk.chunk_type == CHUNK_TYPE_FILL and chunk.fill != b"\0\0\0\0":
+                yield chunk
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        """读取展开后 [offset, offset+size) 区间，线程安全"""
+        if offset >= self.size or size <= 0:
+            return b""
+        size = min(size, self.size - offset)
+        out = bytearray()
+        idx = self._chunk_index(offset)
+        while size > 0 and idx < len(self._chunks):
+            chunk = self._chunks[idx]
+            inner = offset - chunk.out_offset
+            step = min(size, chunk.out_size - inner)
+            if chunk.chunk_type == CHUNK_TYPE_RAW:
+                data = pread(self._fh, step, chunk.data_offset + inner, self._lock)
+                if len(data) < step:
+                    raise SparseError(f"稀疏镜像数据被截断：{self.path.name}")
+                out += data
+            elif chunk.chunk_type == CHUNK_TYPE_FILL:
+                shift = inner % 4
+                pattern = chunk.fill[shift:] + chunk.fill[:shift]
+                out += (pattern * (step // 4 + 1))[:step]
+            else:
+                out += bytes(step)
+            offset += step
+            size -= step
+            idx += 1
+        return bytes(out)
+
+    def copy_range_to(self, offset: int, length: int, out: BinaryIO, dst_offset: int) -> None:
+        """
+        把展开后 [offset, offset+length) 复制到 out 的 dst_offset 处。
+
+        按 chunk 映射处理：RAW 走 copy_range（全零块跳过），非零 FILL 写入填充值，
+        DONT_CARE 与全零 FILL 直接跳过（调用方负责输出文件的最终长度）。
+        """
+        end = min(offset + length, self.size)
+        idx = self._chunk_index(offset)
+        while offset < end and idx < len(self._chunks):
+            chunk = self._chunks[idx]
+            inner = offset - chunk.out_offset
+            step = min(end - offset, chunk.out_size - inner)
+            if chunk.chunk_type == CHUNK_TYPE_RAW:
+                copy_range(self._fh, chunk.data_offset + inner, out, dst_offset, step, self._lock, holes=True)
+            elif chunk.chunk_type == CHUNK_TYPE_FILL and chunk.fill != b"\0\0\0\0":
+                out.seek(dst_offset)
+                remaining = step
+                while remaining > 0:
+                    piece = self.read_at(offset + step - remaining, min(remaining, COPY_BUFFER_SIZE))
+                    out.write(piece)
+                    remaining -= len(piece)
+            offset += step
+            dst_offset += step
+            idx += 1
+
+    def _chunk_index(self, offset: int) -> int:
+        return bisect.bisect_right(self._starts, offset) - 1
+
+    # ------------------------------------------------------------------ #
+    # 展开
+    # ------------------------------------------------------------------ #
+    def expand_to(self, out_path: Path) -> None:
+        """展开为 RAW 镜像；DONT_CARE、全零 FILL 与 RAW chunk 中的全零块不写入，保留为空洞"""
+        with Path(out_path).open("wb") as out:
+            for chunk in self._chunks:
+                if chunk.chunk_type == CHUNK_TYPE_RAW:
+                    copy_range(
+                        self._fh, chunk.data_offset, out, chunk.out_offset, chunk.out_size, self._lock, holes=True
+                    )
+                elif chunk.chunk_type == CHUNK_TYPE_FILL and chunk.fill != b"\0\0\0\0":
+                    out.seek(chunk.out_offset)
+                    block = chunk.fill * (self.block_size // 4)
+                    remaining = chunk.out_size
+                    batch = block * max(1, COPY_BUFFER_SIZE // self.block_size)
+                    while remaining > 0:
+                        piece = batch[:remaining]
+                        out.write(piece)
+                        remaining -= len(piece)
+            out.truncate(self.size)
+
+    # ------------------------------------------------------------------ #
+    # io.RawIOBase 接口
+    # ------------------------------------------------------------------ #
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"无效的 whence：{whence}")
+        if pos < 0:
+            raise ValueError("seek 位置不能为负")
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer) -> int:
+        data = self.read_at(self._pos, len(buffer))
+        buffer[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self._fh.close()
+        super().close()
+
+
+class SparseWriter:
+    """
+    顺序写出 Android 稀疏镜像。
+
+    chunk 必须按展开偏移递增追加；相邻的同类 chunk 会被合并，
+    ``finish()`` 时回填文件头中的块数与 chunk 数。
+    """
+
+    def __init__(self, out: BinaryIO, block_size: int = 4096) -> None:
+        self.out = out
+        self.block_size = block_size
+        self.total_blocks = 0
+        self.total_chunks = 0
+        self._start = out.tell()
+        # 尚未落盘的 RAW 数据：(源文件, 偏移, 长度) 或 (None, bytes, 长度)
+        self._pending_raw: List[Tuple[Optional[BinaryIO], Any, int]] = []
+        self._pending_raw_size = 0
+        self._pending_dont_care = 0
+        self.out.write(bytes(SPARSE_HEADER.size))
+
+    def add_raw(self, data: bytes) -> None:
+        self._check_aligned(len(data))
+        self._flush_dont_care()
+        view = memoryview(data)
+        while view:
+            step = self._raw_room()
+            self._pending_raw.append((None, view[:step], len(view[:step])))
+            self._pending_raw_size += len(view[:step])
+            view = view[step:]
+
+    def add_raw_from(self, src: BinaryIO, offset: int, length: int) -> None:
+        """追加来自 src[offset:offset+length] 的数据，落盘时走 copy_range"""
+        self._check_aligned(length)
+        self._flush_dont_care()
+        while length > 0:
+            step = min(length, self._raw_room())
+            self._pending_raw.append((src, offset, step))
+            self._pending_raw_size += step
+            offset += step
+            length -= step
+
+    def add_sparse(self, image: "SparseImage") -> None:
+        """按 chunk 映射原样转写另一个稀疏镜像，数据不经过展开"""
+        if image.block_size != self.block_size:
+            raise SparseError(f"稀疏镜像块大小不一致：{image.path.name}")
+        for chunk in image.chunks():
+            blocks = chunk.out_size // self.block_size
+            if chunk.chunk_type == CHUNK_TYPE_RAW:
+                self.add_raw_from(image._fh, chunk.data_offset, chunk.out_size)
+            elif chunk.chunk_type == CHUNK_TYPE_FILL:
+                self.add_fill(chunk.fill, blocks)
+            else:
+                self.add_dont_care(blocks)
+
+    def add_fill(self, value: bytes, blocks: int) -> None:
+        if blocks <= 0:
+            return
+        self._flush()
+        self._write_chunk(CHUNK_TYPE_FILL, blocks, value)
+
+    def add_dont_care(self, blocks: int) -> None:
+        if blocks <= 0:
+            return
+        self._flush_raw()
+        self._pending_dont_care += blocks
+
+    def finish(self, total_blocks: Optional[int] = None) -> None:
+        """结束写入；total_blocks 大于已写块数时以 DONT_CARE 补齐"""
+        pending = self.total_blocks + self._pending_dont_care + self._pending_raw_size // self.block_size
+        if total_blocks is not None and total_blocks > pending:
+            self.add_dont_care(total_blocks - pending)
+        self._flush()
+        end = self.out.tell()
+        self.out.seek(self._start)
+        self.out.write(SPARSE_HEADER.pack(
+            SPARSE_MAGIC, 1, 0, SPARSE_HEADER.size, SPARSE_CHUNK_HEADER.size,
+            self.block_size, self.total_blocks, self.total_chunks, 0,
+        ))
+        self.out.seek(end)
+
+    # ------------------------------------------------------------------ #
+    def _check_aligned(self, length: int) -> None:
+        if length <= 0 or length % self.block_size:
+            raise SparseError(f"稀疏镜像数据长度必须是块大小的整数倍：{length}")
+
+    def _raw_room(self) -> int:
+        """当前 RAW chunk 还能容纳的字节数；已满则先落盘"""
+        if self._pending_raw_size >= SPARSE_MAX_RAW_CHUNK:
+            self._flush_raw()
+        return SPARSE_MAX_RAW_CHUNK - self._pending_raw_size
+
+    def _flush(self) -> None:
+        self._flush_raw()
+        self._flush_dont_care()
+
+    def _flush_dont_care(self) -> None:
+        if self._pending_dont_care:
+            blocks, self._pending_dont_care = self._pending_dont_care, 0
+            self._write_chunk(CHUNK_TYPE_DONT_CARE, blocks, b"")
+
+    def _flush_raw(self) -> None:
+        if not self._pending_raw:
+            return
+        pieces, size = self._pending_raw, self._pending_raw_size
+        self._pending_raw, self._pending_raw_size = [], 0
+        self._write_chunk(CHUNK_TYPE_RAW, size // self.block_size, b"", size)
+        for src, data, length in pieces:
+            if src is None:
+                self.out.write(data)
+            else:
+                pos = self.out.tell()
+                self.out.flush()
+                copy_range(src, data, self.out, pos, length)
+                self.out.seek(pos + length)
+
+    def _write_chunk(self, chunk_type: int, blocks: int, payload: bytes, data_size: Optional[int] = None) -> None:
+        body = len(payload) if data_size is None else data_size
+        self.out.write(SPARSE_CHUNK_HEADER.pack(chunk_type, 0, blocks, SPARSE_CHUNK_HEADER.size + body))
+        self.out.write(payload)
+        self.total_blocks += blocks
+        self.total_chunks += 1
+
+
+# 块分类结果：(起始块, 块数, 填充值)，填充值为 None 表示 RAW
+BlockRun = Tuple[int, int, Optional[bytes]]
+
+
+def append_run(runs: List[BlockRun], block: int, count: int, fill: Optional[bytes]) -> None:
+    """追加一段块分类，与前一段相邻且类型相同时合并"""
+    if runs:
+        last_block, last_count, last_fill = runs[-1]
+        if last_fill == fill and last_block + last_count == block:
+            runs[-1] = (last_block, last_count + count, fill)
+            return
+    runs.append((block, count, fill))
+
+
+def _is_fill_run(buf: Any, full: int, block_size: int) -> bool:
+    """
+    [0, full) 是否整段由同一个 32 位值重复组成。逐块与单个块大小的模式比较，
+    不分配（也不缓存）整段大小的模式。
+    """
+    pattern = bytes(buf[:4]) * (block_size // 4)
+    return all(buf.startswith(pattern, pos) for pos in range(0, full, block_size))
+
+
+def _uniform_candidates(buf: bytes, full: int, block_size: int) -> List[int]:
+    """
+    找出前 8 字节为同一个 32 位值重复的块（相对块号）。每个字节位置取一次跨步切片，
+    用大整数异或一次比较所有块，只有候选块才需要逐块完整比较；随机数据几乎没有候选。
+    """
+    diff = 0
+    for k in range(4):
+        diff |= int.from_bytes(buf[k:full:block_size], "little") ^ int.from_bytes(buf[k + 4:full:block_size], "little")
+    if not diff:
+        return list(range(full // block_size))
+    flags = diff.to_bytes(full // block_size, "little")
+    candidates = []
+    idx = flags.find(0)
+    while idx >= 0:
+        candidates.append(idx)
+        idx = flags.find(0, idx + 1)
+    return candidates
+
+
+def _classify_sparse_blocks(buf: Any, first_block: int, block_size: int, runs: List[BlockRun]) -> None:
+    """
+    按 img2simg 的规则给一段连续数据分块：整块由同一个 32 位值重复组成时为 FILL（含全零），
+    其余为 RAW，不足一块的尾部总是 RAW。
+    """
+    size = len(buf)
+    full = size - size % block_size
+    count = full // block_size
+    candidates = _uniform_candidates(buf, full, block_size) if full else []
+    if count and len(candidates) == count and _is_fill_run(buf, full, block_size):
+        # 整段是同一个值（常见于全零区域）：一次比较完成
+        append_run(runs, first_block, count, bytes(buf[:4]))
+        candidates = []
+        raw_from = count
+    else:
+        raw_from = 0
+    for idx in candidates:
+        pos = idx * block_size
+        if buf[pos + 4:pos + block_size] != buf[pos:pos + block_size - 4]:
+            continue
+        if idx > raw_from:
+            append_run(runs, first_block + raw_from, idx - raw_from, None)
+        append_run(runs, first_block + idx, 1, bytes(buf[pos:pos + 4]))
+        raw_from = idx + 1
+    if count > raw_from:
+        append_run(runs, first_block + raw_from, count - raw_from, None)
+    if full < size:
+        append_run(runs, first_block + count, 1, None)
+
+
+def scan_sparse_blocks(path: str, offset: int, length: int, block_size: int) -> List[BlockRun]:
+    """
+    扫描 RAW 镜像 [offset, offset+length)（offset 按块对齐）并分类，可在工作进程中执行。
+
+    文件空洞（SEEK_HOLE）不读取，直接记为全零 FILL，与 img2simg 读到的全零数据结果相同。
+    """
+    runs: List[BlockRun] = []
+    # 整块读取复用同一个缓冲区，避免每次分配 8MB 带来的缺页开销
+    buffer = bytearray(COPY_BUFFER_SIZE) if hasattr(os, "preadv") else None
+    end = offset + length
+    # 末尾不足一块的数据即使落在空洞中也按 RAW 处理
+    full_end = end - (end - offset) % block_size
+    pos = offset
+    with open(path, "rb") as fh:
+        fd = fh.fileno()
+        for start, size in data_regions(fd, offset, length):
+            start -= (start - offset) % block_size
+            stop = min(end, -(-(start + size - offset) // block_size) * block_size + offset)
+            start = max(start, pos)
+            if start >= stop:
+                continue
+            if start > pos:
+                append_run(runs, pos // block_size, (start - pos) // block_size, b"\0\0\0\0")
+            while start < stop:
+                step = min(stop - start, COPY_BUFFER_SIZE)
+                if buffer is not None and step == len(buffer):
+                    got = os.preadv(fd, [buffer], start)
+                    buf = buffer if got == step else pread(fh, step, start)
+                else:
+                    buf = pread(fh, step, start)
+                if len(buf) != step:
+                    raise EOFError(f"读取镜像失败：{path}")
+                _classify_sparse_blocks(buf, start // block_size, block_size, runs)
+                start += step
+            pos = stop
+    if pos < full_end:
+        append_run(runs, pos // block_size, (full_end - pos) // block_size, b"\0\0\0\0")
+        pos = full_end
+    if pos < end:
+        append_run(runs, pos // block_size, 1, None)
+    return runs
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zlo_tool.xattr
+ext4 / EROFS 共用的扩展属性名称前缀与 SELinux、capabilities 属性解析
+"""
+from __future__ import annotations
+
+import struct
+from typing import Dict, Optional
+
+# 磁盘上的 name_index -> 属性名前缀（ext4 与 EROFS 编码相同）
+XATTR_PREFIXES = {
+    1: "user.",
+    2: "system.posix_acl_access",
+    3: "system.posix_acl_default",
+    4: "trusted.",
+    6: "security.",
+    7: "system.",
+    8: "system.richacl",
+}
+
+
+def selinux_context(xattrs: Dict[str, bytes]) -> Optional[str]:
+    """security.selinux 中的上下文字符串"""
+    value = xattrs.get("security.selinux")
+    return value.rstrip(b"\0").decode("utf-8", "replace") if value else None
+
+
+def capabilities(xattrs: Dict[str, bytes]) -> int:
+    """security.capability（vfs_cap_data）中的 permitted 位，v2/v3 为 64 位"""
+    value = xattrs.get("security.capability")
+    if not value or len(value) < 12:
+        return 0
+    permitted = struct.unpack_from("<I", value, 4)[0]
+    if len(value) >= 20:
+        permitted |= struct.unpack_from("<I", value, 12)[0] << 32
+    return permitted